@@ -2,14 +2,353 @@ from crewai import Agent, Task, Crew, Process
 from dotenv import load_dotenv
 # Removendo as ferramentas que podem estar causando problemas
 # from crewai_tools import SerperDevTool, DallETool
-from langchain_openai import ChatOpenAI
+from resumos import MemoriaResumos, contexto_legado
+from entidades import IndiceEntidades
+from routing import executar_com_llm, ETAPA_ESTRUTURA, ETAPA_PROSA, ETAPA_REVISAO
+from llm_cache import chave_cache, obter_cache
+from outline import (LeitorEstrutura, interpretar_parte_global, interpretar_capitulo, carregar_estrutura,
+                     formatar_parte_global, contexto_capitulo)
+from duplicatas import IndiceDuplicatas
+from linter import (verificar_capitulo, remover_cabecalhos_soltos, extrair_personagens, termina_frase,
+                    PROBLEMA_REPETIDO, PROBLEMA_CABECALHO, PROBLEMA_NOME, PROBLEMA_CORTADO)
+from metrics import medir_chamada, obter_metricas
+from book_store import MontadorLivro
+from manifest import (ManifestoLivro, gerar_job_id, localizar_livro, escrever_json_atomico, STATUS_CONCLUIDO, STATUS_ERRO,
+                      STATUS_CANCELADO)
+from cancelamento import Cancelamento, LivroCancelado, PRAZO_CHAMADA, PRAZO_LIVRO
 import os
+import time
 from datetime import datetime
 import json
-import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Pasta onde ficam os diretórios `livro_*` (padrão: a pasta deste arquivo)
+DIRETORIO_LIVROS = os.getenv("LIVROS_CREWAI_DIR", os.path.dirname(os.path.abspath(__file__)))
+
+# Máximo de pedidos de continuação por capítulo curto ou cortado
+MAX_CONTINUACOES_CAPITULO = int(os.getenv("MAX_CONTINUACOES_CAPITULO", "3"))
+# Resumos de capítulos enviados no modo sequencial (os mais antigos ficam a cargo do índice de entidades)
+RESUMOS_RECENTES = int(os.getenv("RESUMOS_RECENTES", "3"))
+# Parágrafos sinalizados pelo linter enviados à revisão por capítulo (os demais ficam como estão)
+MAX_REVISOES_CAPITULO = int(os.getenv("MAX_REVISOES_CAPITULO", "8"))
+
+# Motores de geração: agentes da CrewAI ou chamadas diretas ao modelo (mesmo pipeline, sem o loop do agente)
+MOTOR_CREWAI = "crewai"
+MOTOR_DIRETO = "direto"
+
+# Passo de continuidade para capítulos escritos em paralelo
+def revisar_transicoes(capitulos, max_concorrencia=4, paragrafos=2, indices=None, livro_id=None, cancelamento=None):
+    """
+    Reescreve apenas os parágrafos iniciais de cada capítulo (a partir do segundo)
+    para que se conectem ao final do capítulo anterior.
+
+    `indices` restringe a revisão a alguns capítulos (posições na lista, a partir de 1).
+
+    Cada transição lê o final original do capítulo anterior e altera somente o
+    início do capítulo atual, então todas podem ser revisadas em paralelo.
+    Capítulos com erro são mantidos como estão. O modelo vem da rota de revisão.
+    Retorna `(capitulos, revisados)`, com `revisados` o conjunto das posições cuja
+    transição foi de fato reescrita pelo modelo.
+    """
+    def revisar(indice):
+        anterior = capitulos[indice - 1]
+        atual = capitulos[indice]
+        if anterior.startswith("[ERRO NO CAPÍTULO") or atual.startswith("[ERRO NO CAPÍTULO"):
+            return atual, False
+        paragrafos_atual = atual.split('\n\n')
+        if len(paragrafos_atual) <= paragrafos:
+            return atual, False
+        final_anterior = '\n\n'.join(anterior.split('\n\n')[-paragrafos:])
+        inicio_atual = '\n\n'.join(paragrafos_atual[:paragrafos])
+        prompt = f"""Você está revisando a transição entre dois capítulos consecutivos de um livro.
+
+FINAL DO CAPÍTULO ANTERIOR:
+{final_anterior}
+
+INÍCIO DO CAPÍTULO SEGUINTE:
+{inicio_atual}
+
+Reescreva apenas o INÍCIO DO CAPÍTULO SEGUINTE para que a transição seja natural e coerente com o final do capítulo anterior.
+Mantenha o título do capítulo (se houver), os mesmos acontecimentos, o mesmo tamanho aproximado e a separação em parágrafos.
+Responda somente com o texto reescrito."""
+        def invocar(llm):
+            with medir_chamada(getattr(llm, "model_name", None), livro_id, indice + 1, "transicao") as chamada:
+                chamada["resposta"] = llm.invoke(prompt)
+            return chamada["resposta"]
+
+        try:
+            resposta = executar_com_llm(ETAPA_REVISAO, invocar, cancelamento)
+            novo_inicio = str(getattr(resposta, "content", resposta)).strip()
+        except LivroCancelado:
+            raise
+        except Exception as e:
+            print(f"Erro ao revisar transição do capítulo {indice + 1}: {str(e)}")
+            return atual, False
+        if not novo_inicio:
+            return atual, False
+        return '\n\n'.join([novo_inicio] + paragrafos_atual[paragrafos:]), True
+
+    if indices is None:
+        indices = range(1, len(capitulos))
+    indices = list(indices)
+    capitulos = list(capitulos)
+    revisados = set()
+    with ThreadPoolExecutor(max_workers=max(1, max_concorrencia)) as executor:
+        for indice, (texto, sucesso) in zip(indices, executor.map(revisar, indices)):
+            capitulos[indice] = texto
+            if sucesso:
+                revisados.add(indice)
+    return capitulos, revisados
+
+# Revisão dirigida pelo linter local: só os parágrafos sinalizados vão ao modelo
+INSTRUCOES_REVISAO = {
+    PROBLEMA_REPETIDO: "Este parágrafo repete um trecho anterior do livro. Reescreva-o com conteúdo novo que faça a cena avançar.",
+    PROBLEMA_CABECALHO: "Este parágrafo contém um cabeçalho de capítulo que sobrou no meio do texto. Remova o cabeçalho e mantenha o restante.",
+    PROBLEMA_NOME: "Corrija a grafia dos nomes dos personagens: {detalhe}.",
+    PROBLEMA_CORTADO: "Este é o último parágrafo do capítulo e a última frase foi cortada. Complete a frase e encerre o parágrafo de forma natural.",
+}
+
+def revisar_sinalizados(capitulos, personagens=(), max_concorrencia=4, livro_id=None, indice_duplicatas=None,
+                        primeiro=1, cancelamento=None, max_por_capitulo=MAX_REVISOES_CAPITULO):
+    """
+    Revisão pós-rascunho: roda as verificações locais de `linter` em cada capítulo
+    e manda ao modelo de revisão apenas os parágrafos sinalizados (com o parágrafo
+    anterior como contexto), em paralelo entre capítulos.
+
+    Cabeçalhos "Capítulo N" soltos são removidos localmente, sem chamada. Parágrafos
+    quase iguais a um trecho anterior são regenerados com esse trecho como exemplo do
+    que não repetir. `indice_duplicatas` permite verificar um capítulo por vez contra
+    os anteriores (`primeiro` é o número do primeiro capítulo da lista). Retorna
+    `(capitulos_revisados, relatorio)`; capítulos com erro são mantidos como estão.
+    `personagens` são os nomes da estrutura, usados na verificação de grafia.
+    No máximo `max_por_capitulo` parágrafos de cada capítulo vão ao modelo: primeiro
+    o final cortado e as repetições, depois as grafias de nomes.
+    """
+    personagens = list(personagens)
+    indice_duplicatas = IndiceDuplicatas() if indice_duplicatas is None else indice_duplicatas
+    revisados = list(capitulos)
+    pendentes = []
+    contagem = {}
+    ignorados = 0
+    for indice, texto in enumerate(capitulos):
+        if texto.startswith("[ERRO NO CAPÍTULO"):
+            continue
+        problemas = verificar_capitulo(texto, personagens, indice_duplicatas, primeiro + indice)
+        for problema in problemas:
+            contagem[problema["tipo"]] = contagem.get(problema["tipo"], 0) + 1
+        texto, problemas = remover_cabecalhos_soltos(texto, problemas)
+        revisados[indice] = texto
+        # Um pedido por parágrafo, com todas as instruções (e trechos a não repetir) que se aplicam a ele
+        por_paragrafo = {}
+        for problema in problemas:
+            instrucoes, originais = por_paragrafo.setdefault(problema["paragrafo"], ([], []))
+            instrucoes.append(INSTRUCOES_REVISAO[problema["tipo"]].format(detalhe=problema["detalhe"]))
+            if problema.get("original"):
+                originais.append(problema["original"])
+        prioritarios = {p["paragrafo"] for p in problemas if p["tipo"] in (PROBLEMA_CORTADO, PROBLEMA_REPETIDO)}
+        selecionados = sorted(por_paragrafo, key=lambda paragrafo: (paragrafo not in prioritarios, paragrafo))
+        selecionados = sorted(selecionados[:max(0, max_por_capitulo)])
+        ignorados += len(por_paragrafo) - len(selecionados)
+        pendentes.extend((indice, paragrafo) + por_paragrafo[paragrafo] for paragrafo in selecionados)
+
+    def revisar(pendente):
+        indice, paragrafo, instrucoes, originais = pendente
+        paragrafos = revisados[indice].split('\n\n')
+        anterior = paragrafos[paragrafo - 1] if paragrafo > 0 else ""
+        repetidos = "".join(f"\nTRECHO JÁ USADO NO LIVRO (não repita as suas frases, imagens nem acontecimentos):\n{original}\n"
+                            for original in originais)
+        usuario = f"""Você está revisando um parágrafo do capítulo {primeiro + indice} de um livro.
+Personagens: {", ".join(personagens) or "(não informados)"}
+
+PARÁGRAFO ANTERIOR (apenas contexto, não reescreva):
+{anterior}
+
+PARÁGRAFO A REVISAR:
+{paragrafos[paragrafo]}
+{repetidos}
+{chr(10).join("- " + instrucao for instrucao in instrucoes)}
+Mantenha o estilo, o tom e os acontecimentos. Responda somente com o parágrafo revisado."""
+        try:
+            return executar_com_llm(ETAPA_REVISAO, lambda llm: completar_direto(
+                llm, "Revisor de livros: corrige apenas o que foi apontado, sem mudar a história.", usuario,
+                livro_id, primeiro + indice, "revisao"
+            ), cancelamento).strip()
+        except LivroCancelado:
+            raise
+        except Exception as e:
+            print(f"Erro ao revisar parágrafo {paragrafo} do capítulo {primeiro + indice}: {str(e)}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, max_concorrencia)) as executor:
+        respostas = list(executor.map(revisar, pendentes))
+
+    # Substituições feitas depois de todas as respostas: os índices dos parágrafos não mudam
+    for (indice, paragrafo, _, _), resposta in zip(pendentes, respostas):
+        if resposta:
+            paragrafos = revisados[indice].split('\n\n')
+            paragrafos[paragrafo] = resposta
+            revisados[indice] = '\n\n'.join(paragrafos)
+    relatorio = {
+        "problemas": contagem,
+        "paragrafos_enviados": len(pendentes),
+        "paragrafos_ignorados": ignorados,
+        "paragrafos_revisados": sum(1 for r in respostas if r),
+        "capitulos_alterados": sorted(primeiro + i for i, (a, b) in enumerate(zip(capitulos, revisados)) if a != b)
+    }
+    return revisados, relatorio
+
+# Executa uma crew de uma única tarefa passando pelo cache de respostas
+def kickoff_em_cache(crew, agente, tarefa, livro_id=None, inputs=None, capitulo=None, etapa=None):
+    """
+    Executa `crew.kickoff` apenas se a mesma chamada ainda não estiver no cache.
+
+    A chave usa o modelo, a temperatura e o max_tokens do LLM do agente, as
+    mensagens que definem a chamada (papel, história e objetivo do agente e a tarefa)
+    e o `livro_id` da geração.
+    Tokens, latência e custo da execução são registrados nas métricas do livro.
+    """
+    llm = agente.llm
+    mensagens = [
+        {"role": "system", "content": f"{agente.role}\n{agente.backstory}\n{agente.goal}"},
+        {"role": "user", "content": f"{tarefa.description}\n{tarefa.expected_output}\n{json.dumps(inputs or {}, ensure_ascii=False, sort_keys=True)}"}
+    ]
+    chave = chave_cache(getattr(llm, "model_name", None), getattr(llm, "temperature", None), getattr(llm, "max_tokens", None), mensagens,
+                        livro_id=livro_id)
+    cache = obter_cache()
+    with medir_chamada(getattr(llm, "model_name", None), livro_id, capitulo, etapa) as chamada:
+        resposta = cache.obter(chave, livro_id)
+        if resposta is not None:
+            chamada["cache"] = True
+            return resposta
+        resultado = crew.kickoff(inputs=inputs) if inputs else crew.kickoff()
+        # Uso de tokens somado pela crew (todas as chamadas do agente nesta tarefa)
+        chamada["resposta"] = resultado if getattr(resultado, "token_usage", None) is not None else crew
+    resposta = str(resultado)
+    cache.salvar(chave, getattr(llm, "model_name", None), resposta, livro_id=livro_id)
+    return resposta
+
+# Chamada direta ao modelo, sem agente, passando pelo cache de respostas
+def completar_direto(llm, sistema, usuario, livro_id=None, capitulo=None, etapa=None):
+    """
+    Equivalente de `kickoff_em_cache` para o motor direto: uma única chamada de chat
+    com a mensagem de sistema (papel, história e objetivo) e a tarefa, sem o loop do agente.
+    """
+    return completar_direto_detalhado(llm, sistema, usuario, livro_id, capitulo, etapa)[0]
+
+def completar_direto_detalhado(llm, sistema, usuario, livro_id=None, capitulo=None, etapa=None):
+    """Como `completar_direto`, mas retorna `(texto, finish_reason)` (finish_reason é None em acertos do cache)."""
+    mensagens = [{"role": "system", "content": sistema}, {"role": "user", "content": usuario}]
+    modelo = getattr(llm, "model_name", None)
+    chave = chave_cache(modelo, getattr(llm, "temperature", None), getattr(llm, "max_tokens", None), mensagens,
+                        livro_id=livro_id)
+    cache = obter_cache()
+    with medir_chamada(modelo, livro_id, capitulo, etapa) as chamada:
+        resposta = cache.obter(chave, livro_id)
+        if resposta is not None:
+            chamada["cache"] = True
+            return resposta, None
+        mensagem = chamada["resposta"] = llm.invoke(mensagens)
+    resposta = str(getattr(mensagem, "content", mensagem))
+    cache.salvar(chave, modelo, resposta, livro_id=livro_id)
+    return resposta, (getattr(mensagem, "response_metadata", None) or {}).get("finish_reason")
+
+def transmitir_direto(llm, sistema, usuario, ao_receber, livro_id=None, capitulo=None, etapa=None, cancelamento=None):
+    """
+    Como `completar_direto`, mas pede a resposta em streaming e repassa cada trecho
+    a `ao_receber(delta)` à medida que chega. Em um acerto do cache, o texto inteiro
+    é repassado de uma só vez. Com `cancelamento`, o streaming é interrompido entre
+    dois trechos assim que o livro é cancelado; passado `PRAZO_CHAMADA`, também (a
+    espera de quem chama já terminou e os trechos seguintes não seriam usados).
+    """
+    mensagens = [{"role": "system", "content": sistema}, {"role": "user", "content": usuario}]
+    modelo = getattr(llm, "model_name", None)
+    chave = chave_cache(modelo, getattr(llm, "temperature", None), getattr(llm, "max_tokens", None), mensagens,
+                        livro_id=livro_id)
+    cache = obter_cache()
+    partes = []
+    with medir_chamada(modelo, livro_id, capitulo, etapa) as chamada:
+        resposta = cache.obter(chave, livro_id)
+        if resposta is not None:
+            chamada["cache"] = True
+            ao_receber(resposta)
+            return resposta
+        acumulado = None
+        limite = time.monotonic() + PRAZO_CHAMADA if PRAZO_CHAMADA else None
+        for trecho in llm.stream(mensagens):
+            if cancelamento is not None:
+                cancelamento.verificar()
+            if limite is not None and time.monotonic() > limite:
+                raise TimeoutError(f"Chamada ao modelo passou do prazo de {PRAZO_CHAMADA:.0f}s")
+            # Os trechos do langchain se somam; o acumulado traz o uso da chamada, quando informado
+            acumulado = trecho if acumulado is None else acumulado + trecho
+            if trecho.content:
+                partes.append(trecho.content)
+                ao_receber(trecho.content)
+        chamada["resposta"] = acumulado
+    resposta = "".join(partes)
+    cache.salvar(chave, modelo, resposta, livro_id=livro_id)
+    return resposta
+
+# Controle de tamanho dos capítulos por continuação
+def estender_capitulo(texto, meta_palavras, sistema, contexto_fixo, capitulo_num, finish_reason=None,
+                      livro_id=None, max_continuacoes=MAX_CONTINUACOES_CAPITULO, palavras_cauda=350, tolerancia=0.9,
+                      cancelamento=None):
+    """
+    Completa um capítulo curto ou cortado pedindo apenas a continuação do trecho que falta.
+
+    Dispara quando a resposta foi cortada pelo limite de tokens (`finish_reason == "length"`
+    ou texto terminando no meio de uma frase) ou quando o capítulo ficou abaixo de
+    `tolerancia * meta_palavras`. Cada pedido leva o mesmo prefixo fixo do capítulo
+    (`sistema` e `contexto_fixo`, aproveitando o cache de prefixo do provedor) e só o
+    final do texto já escrito, e pede as palavras que faltam. Retorna
+    `(texto, continuacoes)`.
+    """
+    continuacoes = 0
+    while continuacoes < max_continuacoes:
+        palavras = len(texto.split())
+        cortado = finish_reason == "length" or not termina_frase(texto)
+        if palavras >= meta_palavras * tolerancia and not cortado:
+            break
+        faltam = max(meta_palavras - palavras, 200)
+
+        # Final do capítulo como contexto: últimos parágrafos até ~palavras_cauda palavras
+        cauda = []
+        for paragrafo in reversed(texto.split('\n\n')):
+            cauda.insert(0, paragrafo)
+            if len(' '.join(cauda).split()) >= palavras_cauda:
+                break
+        trecho_final = '\n\n'.join(cauda)
+        usuario = f"""{contexto_fixo}
+            CONTINUAÇÃO DO CAPÍTULO {capitulo_num}:
+            O capítulo {capitulo_num} já foi começado, mas {"foi interrompido no meio" if cortado else "ficou curto"}. Estes são os últimos parágrafos já escritos:
+
+            {trecho_final}
+
+            Continue o capítulo exatamente do ponto onde o texto parou{", completando a frase interrompida" if cortado else ""}.
+            Escreva aproximadamente {faltam} palavras novas, mantendo personagens, tom e estilo.
+            Não repita o que já foi escrito, não reescreva o título e não comece um novo capítulo.
+            Responda somente com o texto da continuação."""
+        try:
+            continuacao, finish_reason = executar_com_llm(
+                ETAPA_PROSA, lambda llm: completar_direto_detalhado(llm, sistema, usuario, livro_id, capitulo_num, "continuacao"),
+                cancelamento
+            )
+        except LivroCancelado:
+            raise
+        except Exception as e:
+            print(f"Erro ao continuar o capítulo {capitulo_num}: {str(e)}")
+            break
+        continuacao = continuacao.strip()
+        if not continuacao:
+            break
+        # Frase cortada: a continuação emenda na mesma linha; senão, começa um novo parágrafo
+        separador = " " if not termina_frase(texto) else "\n\n"
+        texto = texto.rstrip() + separador + continuacao
+        continuacoes += 1
+    return texto, continuacoes
 
 # Função principal para gerar o livro genérico
-def gerar_livro_generico(tema, api_key=None, autor=None, email_autor=None, descricao=None, genero=None, estilo=None, publico_alvo=None, callback=None, num_capitulos=12):
+def gerar_livro_generico(tema, api_key=None, autor=None, email_autor=None, descricao=None, genero=None, estilo=None, publico_alvo=None, callback=None, num_capitulos=12, modo_paralelo=False, max_concorrencia=4, job_id=None, motor=MOTOR_CREWAI, cancelamento=None, prazo_livro=PRAZO_LIVRO):
     # Carregar variáveis de ambiente
     load_dotenv()
     
@@ -26,16 +365,44 @@ def gerar_livro_generico(tema, api_key=None, autor=None, email_autor=None, descr
     publico_alvo = publico_alvo or "Adulto"
     ano_atual = datetime.now().year
 
-    # Criar diretório para salvar os capítulos do livro
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    livro_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), f"livro_{timestamp}")
+    # ID estável do pedido: o mesmo livro sempre cai no mesmo diretório e pode ser retomado
+    especificacao = {
+        "tema": tema,
+        "autor": autor,
+        "email_autor": email_autor,
+        "descricao": descricao,
+        "genero": genero,
+        "estilo": estilo,
+        "publico_alvo": publico_alvo,
+        "num_capitulos": num_capitulos,
+        "modo_paralelo": modo_paralelo,
+        "max_concorrencia": max_concorrencia,
+        "motor": motor
+    }
+    job_id = job_id or gerar_job_id(especificacao)
+
+    # Reaproveitar o diretório de um livro interrompido ou criar um novo
+    livro_dir = localizar_livro(DIRETORIO_LIVROS, job_id)
+    if livro_dir:
+        # "livro_<AAAAmmdd_HHMMSS>_<job_id>" (ou só o timestamp, em livros mais antigos)
+        timestamp = os.path.basename(livro_dir)[len("livro_"):len("livro_AAAAmmdd_HHMMSS")]
+        print(f"Retomando livro {job_id} em {livro_dir}")
+    else:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        # O job_id no nome: livros iniciados no mesmo segundo (lote, fila de jobs) não dividem o diretório
+        livro_dir = os.path.join(DIRETORIO_LIVROS, f"livro_{timestamp}_{job_id}")
     os.makedirs(livro_dir, exist_ok=True)
+    # Cada geração tem o seu id (o diretório): cache e métricas de uma retomada continuam os do livro,
+    # mas o mesmo pedido feito depois de um livro pronto não reaproveita as respostas dele
+    livro_id = os.path.basename(livro_dir)
+    manifesto = ManifestoLivro(livro_dir, job_id, especificacao)
     
     # Arquivo de metadados para o livro
     metadata_file = os.path.join(livro_dir, "metadata.json")
     
     # Criar metadados iniciais
     metadata = {
+        "job_id": job_id,
         "tema": tema,
         "autor": autor,
         "email": email_autor,
@@ -45,22 +412,27 @@ def gerar_livro_generico(tema, api_key=None, autor=None, email_autor=None, descr
         "publico_alvo": publico_alvo,
         "ano": ano_atual,
         "timestamp": timestamp,
+        "modo_paralelo": modo_paralelo,
+        "motor": motor,
         "capitulos": []
     }
     
-    # Salvar metadados iniciais
-    with open(metadata_file, 'w', encoding='utf-8') as f:
-        json.dump(metadata, f, ensure_ascii=False, indent=2)
-
-    # Definir modelos de IA - usando modelos diferentes para diferentes tarefas
-    llm_planejamento = ChatOpenAI(model_name="gpt-4o-mini", temperature=0.7, max_tokens=3000)
-    llm_escrita = ChatOpenAI(model_name="gpt-4o-mini", temperature=0.7, max_tokens=4000)
-    llm_revisao = ChatOpenAI(model_name="gpt-4o-mini", temperature=0.2, max_tokens=2000)
+    # Ao retomar, a lista de capítulos vem do manifesto (snapshot + diário)
+    metadata["capitulos"] = manifesto.capitulos_registrados()
+
+    # Salvar metadados iniciais (gravação atômica; os capítulos vão para o diário append-only)
+    escrever_json_atomico(metadata_file, metadata)
+
+    # Modelos de IA: cada etapa usa o modelo, a temperatura e o max_tokens da sua rota
+    # (routing.ROTAS), com modelos alternativos quando o principal estiver limitado
     
     # Configurações
     # Número de capítulos agora é parâmetro
     # num_capitulos = 12  # Número de capítulos (removido, agora vem do argumento)
-    timeout_seconds = 180  # 3 minutos por tarefa
+    # Cancelamento cooperativo e prazo do livro, repassados a todas as etapas (cada pedido ao
+    # modelo tem ainda o seu próprio prazo, cancelamento.PRAZO_CHAMADA)
+    cancelamento = cancelamento or Cancelamento()
+    cancelamento.definir_prazo(prazo_livro)
     
     # Meta de palavras
     meta_palavras_total = 27000  # Entre 25.000 e 30.000
@@ -68,19 +440,13 @@ def gerar_livro_generico(tema, api_key=None, autor=None, email_autor=None, descr
     total_palavras_livro = 0
     
     # Função para salvar um capítulo em arquivo
-    def salvar_capitulo(numero, conteudo):
+    def salvar_capitulo(numero, conteudo, revisado=False):
         arquivo = os.path.join(livro_dir, f"capitulo_{numero}.txt")
         with open(arquivo, 'w', encoding='utf-8') as f:
             f.write(conteudo)
         print(f"Capítulo {numero} salvo em {arquivo}")
-        # Atualizar metadados
-        metadata["capitulos"].append({
-            "numero": numero,
-            "arquivo": arquivo,
-            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        })
-        with open(metadata_file, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, ensure_ascii=False, indent=2)
+        # Registrar o capítulo no diário append-only (metadata.json não é reescrito a cada capítulo)
+        manifesto.registrar_capitulo(numero, conteudo, arquivo, revisado)
         return arquivo
 
     # Função para atualizar o progresso
@@ -88,180 +454,421 @@ def gerar_livro_generico(tema, api_key=None, autor=None, email_autor=None, descr
         if callback:
             callback(etapa, mensagem)
     
-    # Atualizar progresso: Iniciando
-    atualizar_progresso(1, f"Planejando a estrutura do livro sobre '{tema}'...")
+    # Parte fixa do pedido de cada capítulo: idêntica byte a byte em todos os capítulos do livro,
+    # para que o provedor reaproveite o prefixo em cache; só o final do pedido muda por capítulo.
+    # É definida assim que a parte global da estrutura fica disponível, na forma compacta da estrutura
+    # tipada (título, personagens e arco); cada capítulo recebe só a sua sinopse e a dos vizinhos.
+    prefixo_capitulos = None
+    capitulos_estrutura = {}
 
-    # FASE 1: GERAR ESTRUTURA E PLANEJAMENTO
-    coordenador = Agent(
-        role="Planejador e Estruturador de Livros",
-        backstory=f"""Especialista em estruturação de livros do gênero {genero} com estilo {estilo}, 
-        focado no tema '{tema}'. Conhece os requisitos da Amazon KDP para publicação.""",
-        goal=f"""Definir a estrutura do livro sobre '{tema}' com elementos necessários: 
-        título, capítulos, personagens e arco narrativo consistente com o gênero {genero} e estilo {estilo}.""",
-        verbose=True,
-        llm=llm_planejamento,
-        max_iterations=3,
-        allow_delegation=False
-    )
-
-    estrutura_task = Task(
-        description=f"""Criar a estrutura do livro sobre '{tema}' do gênero {genero} com estilo {estilo} para o público {publico_alvo}, 
-        incluindo título, subtítulo, sumário e personagens.
-        
-        Desenvolva uma única história contínua ao longo de {num_capitulos} capítulos, com personagens 
-        consistentes e um arco narrativo adequado. Para cada capítulo, forneça um título e um resumo 
-        detalhado do que acontecerá.""",
-        expected_output=f"""Estrutura completa com:
-        1. Título e subtítulo do livro
-        2. Lista de {num_capitulos} capítulos com títulos e resumos detalhados (pelo menos 3 parágrafos por capítulo)
-        3. Personagens principais com descrição de características físicas e psicológicas
-        4. Arco narrativo principal completo""",
-        agent=coordenador,
-        async_execution=False
-    )
-
-    atualizar_progresso(2, f"Gerando estrutura do livro sobre '{tema}'...")
-    estrutura_crew = Crew(
-        agents=[coordenador],
-        tasks=[estrutura_task],
-        verbose=True
-    )
-    
-    try:
-        estrutura_resultado = estrutura_crew.kickoff(inputs={"tema": tema, "genero": genero, "estilo": estilo, "publico_alvo": publico_alvo})
-        
-        # Salvar estrutura em arquivo
-        estrutura_file = os.path.join(livro_dir, "estrutura.txt")
-        with open(estrutura_file, 'w', encoding='utf-8') as f:
-            f.write(str(estrutura_resultado))
+    def definir_prefixo(texto_estrutura):
+        nonlocal prefixo_capitulos
+        prefixo_capitulos = f"""ESTRUTURA DO LIVRO:
+            {texto_estrutura}
+
+            INSTRUÇÕES GERAIS:
+            O livro tem {num_capitulos} capítulos e deve ter mais de 100 páginas no total. Cada capítulo deve ser detalhado, extenso e contribuir para que o livro ultrapasse 100 páginas. Escreva capítulos longos, densos e completos, com bastante desenvolvimento de cenas, diálogos e descrições.
+            - Garanta que o conteúdo seja apropriado para o público {publico_alvo} e siga as convenções do gênero {genero} com estilo {estilo}.
+            - Certifique-se de incluir título e conteúdo.
+            - O capítulo deve ser longo, detalhado e contribuir para que o livro ultrapasse 100 páginas no total. Capriche no desenvolvimento de cenas, diálogos e descrições.
+            - Se o nome do personagem principal for especificado na descrição, use exatamente esse nome em toda a história.
+
+            FORMATAÇÃO PARA KDP (Amazon):
+            - Estruture o livro com: página de título, dedicatória (opcional), direitos autorais, sumário/índice, capítulos, sobre o autor (no final).
+            - Cada capítulo deve começar em uma nova página e ter o título centralizado (estilo “Título 1”).
+            - Utilize fonte clara e legível (Times New Roman ou Arial, tamanho 12), texto justificado, recuo de 5 mm na primeira linha de cada parágrafo, espaçamento simples.
+            - Inclua sumário/índice no início, com os títulos dos capítulos.
+            - Se inserir imagens, use apenas como ilustração e indique onde elas devem aparecer.
+            - Adicione, se possível, uma breve seção “Sobre o autor” ao final.
+            - Siga rigorosamente as normas de formatação para publicação na Amazon KDP.
+            """
+
+    # Sinopse do capítulo na estrutura, com as dos capítulos vizinhos
+    def trecho_capitulo(capitulo_num):
+        return contexto_capitulo(capitulos_estrutura, capitulo_num)
+
+    # Papel, história e objetivo do escritor não mencionam o capítulo: fazem parte do prefixo fixo
+    papel_escritor = "Escritor do Livro"
+    historia_escritor = f"""Escritor especializado em {genero} com estilo {estilo}, criador de histórias envolventes sobre '{tema}' 
+            para o público {publico_alvo}."""
+    objetivo_escritor = f"""Escrever um capítulo completo e cativante, seguindo fielmente a estrutura fornecida e mantendo a continuidade narrativa. 
+            Este capítulo deve ter pelo menos {meta_palavras_capitulo} palavras, visando que o livro final tenha entre 25.000 e 30.000 palavras. 
+            Mantenha a história coerente, conectada e sem deixar pontas soltas."""
+
+    # Função que escreve um capítulo com o motor escolhido (crew de um agente ou chamada direta)
+    def escrever_capitulo(capitulo_num, contexto, instrucao_abertura):
+        # Tarefa de escrita para o capítulo: prefixo fixo primeiro, depois o que é deste capítulo
+        descricao = f"""{prefixo_capitulos}
+            {contexto}
             
-        estrutura = str(estrutura_resultado)
-        atualizar_progresso(3, f"Estrutura do livro criada com sucesso!")
-    except Exception as e:
-        print(f"Erro ao gerar estrutura: {str(e)}")
-        atualizar_progresso(3, f"Erro ao gerar estrutura: {str(e)}")
-        return f"Erro ao gerar estrutura: {str(e)}"
+            INSTRUÇÕES IMPORTANTES:
+            1. {instrucao_abertura}
+            2. {"Desenvolva o conflito principal." if 1 < capitulo_num < num_capitulos else ""}
+            3. {"Conclua a história com uma resolução satisfatória." if capitulo_num == num_capitulos else "Termine em um ponto que crie expectativa para o próximo capítulo."}
 
-    # FASE 2: GERAR CADA CAPÍTULO INDIVIDUALMENTE
-    capitulos_conteudo = []
-    
-    for i in range(num_capitulos):
-        capitulo_num = i + 1
-        capitulo_path = os.path.join(livro_dir, f"capitulo_{capitulo_num}.txt")
-        if os.path.exists(capitulo_path):
-            # Se já existe, carregar o conteúdo para manter continuidade
-            with codecs.open(capitulo_path, 'r', encoding='utf-8') as f:
-                capitulo_texto = f.read()
-            capitulos_conteudo.append(capitulo_texto)
-            print(f"Capítulo {capitulo_num} já existe. Pulando geração.")
-            atualizar_progresso(4, f"Capítulo {capitulo_num} já existente. Pulando geração.")
-            continue
+            Escreva agora o Capítulo {capitulo_num} baseado na estrutura e no contexto fornecidos.
+            """
+        resultado_esperado = f"""O capítulo {capitulo_num} completo com título e conteúdo, seguindo todas as instruções.
+            Deve ter tamanho adequado (mínimo de 1000 palavras) e ser estruturado em parágrafos."""
 
-        atualizar_progresso(4, f"Gerando capítulo {capitulo_num} de {num_capitulos}...")
-        try:
-            # Criar escritor para este capítulo
+        sistema_escritor = f"{papel_escritor}\n{historia_escritor}\n{objetivo_escritor}"
+        if motor == MOTOR_DIRETO:
+            texto, finish_reason = executar_com_llm(ETAPA_PROSA, lambda llm: completar_direto_detalhado(
+                llm,
+                sistema_escritor,
+                f"{descricao}\nResultado esperado:\n{resultado_esperado}",
+                livro_id, capitulo=capitulo_num, etapa="capitulo"
+            ), cancelamento)
+            return completar_tamanho(capitulo_num, texto, sistema_escritor, finish_reason)
+
+        def escrever_com_crew(llm):
             escritor = Agent(
-                role=f"Escritor do Capítulo {capitulo_num}",
-                backstory=f"""Escritor especializado em {genero} com estilo {estilo}, criador de histórias envolventes sobre '{tema}' 
-                para o público {publico_alvo}.""",
-                goal=f"""Escrever um capítulo completo e cativante, seguindo fielmente a estrutura fornecida e mantendo a continuidade narrativa. 
-                Este capítulo deve ter pelo menos {meta_palavras_capitulo} palavras, visando que o livro final tenha entre 25.000 e 30.000 palavras. 
-                Mantenha a história coerente, conectada e sem deixar pontas soltas.""",
+                role=papel_escritor,
+                backstory=historia_escritor,
+                goal=objetivo_escritor,
                 verbose=True,
-                llm=llm_escrita,
+                llm=llm,
                 max_iterations=3,
                 allow_delegation=False
             )
-            
-            # Contexto para o capítulo atual
-            contexto = f"""ESTRUTURA DO LIVRO:
-            {estrutura}
-            
-            INSTRUÇÕES PARA ESTE CAPÍTULO:
-            Você está escrevendo o Capítulo {capitulo_num} de {num_capitulos}.
-            O livro deve ter mais de 100 páginas no total. Cada capítulo deve ser detalhado, extenso e contribuir para que o livro ultrapasse 100 páginas. Escreva capítulos longos, densos e completos, com bastante desenvolvimento de cenas, diálogos e descrições."""
-            
-            # Adicionar conteúdo dos capítulos anteriores para continuidade
-            if capitulo_num > 1:
-                contexto += "\nCONTEÚDO DOS CAPÍTULOS ANTERIORES:\n"
-                for j in range(len(capitulos_conteudo)):
-                    contexto += f"\n--- CAPÍTULO {j+1} ---\n"
-                    # Mostrar apenas os primeiros e últimos parágrafos para economizar tokens
-                    cap_paragrafos = capitulos_conteudo[j].split('\n\n')
-                    if len(cap_paragrafos) > 6:
-                        inicio = '\n\n'.join(cap_paragrafos[:3])
-                        fim = '\n\n'.join(cap_paragrafos[-3:])
-                        contexto += f"\n{inicio}\n\n[...]\n\n{fim}\n"
-                    else:
-                        contexto += f"\n{capitulos_conteudo[j]}\n"
-            
-            # Tarefa de escrita para o capítulo
             capitulo_task = Task(
-                description=f"""Escrever o Capítulo {capitulo_num} baseado na estrutura e contexto fornecidos.
-                
-                {contexto}
-                
-                INSTRUÇÕES IMPORTANTES:
-                1. {"Inicie a história apresentando os personagens e o cenário." if capitulo_num == 1 else "Continue exatamente de onde o capítulo anterior parou."}
-                2. {"Desenvolva o conflito principal." if 1 < capitulo_num < num_capitulos else ""}
-                3. {"Conclua a história com uma resolução satisfatória." if capitulo_num == num_capitulos else "Termine em um ponto que crie expectativa para o próximo capítulo."}
-                4. Garanta que o conteúdo seja apropriado para o público {publico_alvo} e siga as convenções do gênero {genero} com estilo {estilo}.
-                5. Certifique-se de incluir título e conteúdo.
-                6. O capítulo deve ser longo, detalhado e contribuir para que o livro ultrapasse 100 páginas no total. Capriche no desenvolvimento de cenas, diálogos e descrições.
-                7. Se o nome do personagem principal for especificado na descrição, use exatamente esse nome em toda a história.
-
-                FORMATAÇÃO PARA KDP (Amazon):
-                - Estruture o livro com: página de título, dedicatória (opcional), direitos autorais, sumário/índice, capítulos, sobre o autor (no final).
-                - Cada capítulo deve começar em uma nova página e ter o título centralizado (estilo “Título 1”).
-                - Utilize fonte clara e legível (Times New Roman ou Arial, tamanho 12), texto justificado, recuo de 5 mm na primeira linha de cada parágrafo, espaçamento simples.
-                - Inclua sumário/índice no início, com os títulos dos capítulos.
-                - Se inserir imagens, use apenas como ilustração e indique onde elas devem aparecer.
-                - Adicione, se possível, uma breve seção “Sobre o autor” ao final.
-                - Siga rigorosamente as normas de formatação para publicação na Amazon KDP.
-                """,
-                expected_output=f"""O capítulo {capitulo_num} completo com título e conteúdo, seguindo todas as instruções.
-                Deve ter tamanho adequado (mínimo de 1000 palavras) e ser estruturado em parágrafos.""",
+                description=descricao,
+                expected_output=resultado_esperado,
                 agent=escritor
             )
-            
+
             # Criar crew para gerar o capítulo
             capitulo_crew = Crew(
                 agents=[escritor],
                 tasks=[capitulo_task],
                 verbose=True
             )
+            return kickoff_em_cache(capitulo_crew, escritor, capitulo_task, livro_id, capitulo=capitulo_num, etapa="capitulo")
+
+        # Gerar o capítulo (o resultado da Crew não informa o finish_reason; vale a contagem de palavras)
+        texto = executar_com_llm(ETAPA_PROSA, escrever_com_crew, cancelamento)
+        return completar_tamanho(capitulo_num, texto, sistema_escritor)
+
+    # Pedir continuações enquanto o capítulo estiver cortado ou abaixo da meta de palavras
+    def completar_tamanho(capitulo_num, texto, sistema_escritor, finish_reason=None):
+        texto, continuacoes = estender_capitulo(
+            texto, meta_palavras_capitulo, sistema_escritor, prefixo_capitulos,
+            capitulo_num, finish_reason, livro_id, cancelamento=cancelamento
+        )
+        if continuacoes:
+            print(f"Capítulo {capitulo_num} estendido com {continuacoes} continuação(ões): {len(texto.split())} palavras.")
+        return texto
+
+    # Início da parte variável do pedido de cada capítulo
+    def contexto_base(capitulo_num):
+        return f"""INSTRUÇÕES PARA ESTE CAPÍTULO:
+            Você está escrevendo o Capítulo {capitulo_num} de {num_capitulos}."""
+
+    # Capítulo escrito só a partir do seu trecho da estrutura (modo paralelo e primeiro capítulo):
+    # pode começar antes de os capítulos anteriores existirem
+    def tarefa_capitulo(capitulo_num):
+        trecho = trecho_capitulo(capitulo_num)
+        contexto = contexto_base(capitulo_num)
+        if trecho:
+            contexto += f"\n\n{trecho}"
+        instrucao = ("Inicie a história apresentando os personagens e o cenário." if capitulo_num == 1
+                     else "Comece o capítulo de forma coerente com o final previsto para o capítulo anterior na estrutura.")
+        return escrever_capitulo(capitulo_num, contexto, instrucao)
+
+    # Capítulos iniciados enquanto a estrutura ainda chega em streaming (motor direto): todos no modo
+    # paralelo; no sequencial, só o primeiro, que não depende de outro capítulo
+    executor_capitulos = ThreadPoolExecutor(max_workers=max(1, max_concorrencia) if modo_paralelo else 1)
+    antecipados = {}
+
+    # Livro cancelado ou fora do prazo: os capítulos já salvos ficam no manifesto e o livro pode ser retomado
+    def interromper():
+        executor_capitulos.shutdown(wait=False, cancel_futures=True)
+        manifesto.definir_status(STATUS_CANCELADO)
+        print(f"Livro {job_id} interrompido: {cancelamento.motivo}")
+        atualizar_progresso(4, f"Geração interrompida ({cancelamento.motivo}). Os capítulos prontos foram mantidos "
+                               f"e o livro pode ser retomado.")
+
+    def antecipar_capitulo(capitulo_num):
+        if capitulo_num in antecipados or not 1 <= capitulo_num <= num_capitulos:
+            return
+        if modo_paralelo or capitulo_num == 1:
+            atualizar_progresso(2, f"Capítulo {capitulo_num} iniciado enquanto a estrutura ainda é gerada...")
+            antecipados[capitulo_num] = executor_capitulos.submit(tarefa_capitulo, capitulo_num)
+
+    leitor_estrutura = LeitorEstrutura()
+
+    def ao_receber_estrutura(delta):
+        prontos = leitor_estrutura.alimentar(delta)
+        if prefixo_capitulos is None and leitor_estrutura.parte_global is not None:
+            definir_prefixo(formatar_parte_global(interpretar_parte_global(leitor_estrutura.parte_global)))
+        for capitulo_num, trecho in prontos:
+            capitulos_estrutura.setdefault(capitulo_num, interpretar_capitulo(capitulo_num, trecho))
+            antecipar_capitulo(capitulo_num)
+
+    # Atualizar progresso: Iniciando
+    atualizar_progresso(1, f"Planejando a estrutura do livro sobre '{tema}'...")
+
+    # FASE 1: GERAR ESTRUTURA E PLANEJAMENTO
+    # Ao retomar, a estrutura já gerada (e conferida pelo hash) é reaproveitada
+    estrutura = manifesto.estrutura_salva()
+    if estrutura is not None:
+        atualizar_progresso(3, "Estrutura do livro recuperada do manifesto.")
+    else:
+        papel_planejador = "Planejador e Estruturador de Livros"
+        historia_planejador = f"""Especialista em estruturação de livros do gênero {genero} com estilo {estilo}, 
+            focado no tema '{tema}'. Conhece os requisitos da Amazon KDP para publicação."""
+        objetivo_planejador = f"""Definir a estrutura do livro sobre '{tema}' com elementos necessários: 
+            título, capítulos, personagens e arco narrativo consistente com o gênero {genero} e estilo {estilo}."""
+        descricao_estrutura = f"""Criar a estrutura do livro sobre '{tema}' do gênero {genero} com estilo {estilo} para o público {publico_alvo}, 
+            incluindo título, subtítulo, personagens e sumário.
             
-            # Gerar o capítulo
-            capitulo_resultado = capitulo_crew.kickoff()
-            capitulo_texto = str(capitulo_resultado)
-            
-            # Contar palavras do capítulo
-            qtd_palavras = len(capitulo_texto.split())
-            total_palavras_livro += qtd_palavras
-            print(f"Capítulo {capitulo_num} gerado com {qtd_palavras} palavras.")
-            atualizar_progresso(4, f"Capítulo {capitulo_num} gerado com {qtd_palavras} palavras.")
-            
-            # Salvar o capítulo em arquivo
-            salvar_capitulo(capitulo_num, capitulo_texto)
-            
-            # Armazenar o conteúdo do capítulo
-            capitulos_conteudo.append(capitulo_texto)
-            
-            # Pequena pausa para evitar rate limiting
-            time.sleep(2)
+            Desenvolva uma única história contínua ao longo de {num_capitulos} capítulos, com personagens 
+            consistentes e um arco narrativo adequado. Para cada capítulo, forneça um título e um resumo 
+            detalhado do que acontecerá."""
+        # Parte global primeiro e capítulos por último: no motor direto, cada capítulo começa a ser
+        # escrito assim que o seu resumo termina de chegar
+        resultado_estrutura = f"""Estrutura completa, nesta ordem:
+            1. Título e subtítulo do livro
+            2. Personagens principais com descrição de características físicas e psicológicas
+            3. Arco narrativo principal completo
+            4. Lista de {num_capitulos} capítulos, cada um começando em uma nova linha com "Capítulo N: título", seguido do resumo detalhado (pelo menos 3 parágrafos por capítulo)"""
+
+        atualizar_progresso(2, f"Gerando estrutura do livro sobre '{tema}'...")
+        try:
+            if motor == MOTOR_DIRETO:
+                # Estrutura em streaming: os capítulos já descritos começam antes de ela terminar
+                estrutura_resultado = executar_com_llm(ETAPA_ESTRUTURA, lambda llm: transmitir_direto(
+                    llm,
+                    f"{papel_planejador}\n{historia_planejador}\n{objetivo_planejador}",
+                    f"{descricao_estrutura}\n\nResultado esperado:\n{resultado_estrutura}",
+                    ao_receber_estrutura, livro_id, etapa="estrutura", cancelamento=cancelamento
+                ), cancelamento)
+            else:
+                def planejar_com_crew(llm):
+                    coordenador = Agent(
+                        role=papel_planejador,
+                        backstory=historia_planejador,
+                        goal=objetivo_planejador,
+                        verbose=True,
+                        llm=llm,
+                        max_iterations=3,
+                        allow_delegation=False
+                    )
+                    estrutura_task = Task(
+                        description=descricao_estrutura,
+                        expected_output=resultado_estrutura,
+                        agent=coordenador,
+                        async_execution=False
+                    )
+                    estrutura_crew = Crew(
+                        agents=[coordenador],
+                        tasks=[estrutura_task],
+                        verbose=True
+                    )
+                    return kickoff_em_cache(estrutura_crew, coordenador, estrutura_task, livro_id,
+                                            inputs={"tema": tema, "genero": genero, "estilo": estilo, "publico_alvo": publico_alvo},
+                                            etapa="estrutura")
+
+                estrutura_resultado = executar_com_llm(ETAPA_ESTRUTURA, planejar_com_crew, cancelamento)
             
+            # Salvar estrutura em arquivo
+            estrutura_file = os.path.join(livro_dir, "estrutura.txt")
+            with open(estrutura_file, 'w', encoding='utf-8') as f:
+                f.write(str(estrutura_resultado))
+                
+            estrutura = str(estrutura_resultado)
+            manifesto.registrar_estrutura(estrutura, estrutura_file)
+            atualizar_progresso(3, "Estrutura do livro criada com sucesso!")
+        except LivroCancelado:
+            interromper()
+            raise
         except Exception as e:
-            print(f"Erro ao gerar capítulo {capitulo_num}: {str(e)}")
-            atualizar_progresso(4, f"Erro ao gerar capítulo {capitulo_num}: {str(e)}")
-            capitulos_conteudo.append(f"[ERRO NO CAPÍTULO {capitulo_num}: {str(e)}]")
-            continue
+            print(f"Erro ao gerar estrutura: {str(e)}")
+            atualizar_progresso(3, f"Erro ao gerar estrutura: {str(e)}")
+            manifesto.definir_status(STATUS_ERRO)
+            executor_capitulos.shutdown(cancel_futures=True)
+            raise RuntimeError(f"Erro ao gerar estrutura: {str(e)}") from e
+
+    # Estrutura tipada, interpretada uma única vez e salva em estrutura.json (os capítulos já usados
+    # pelos capítulos antecipados são os mesmos que `separar_estrutura` encontra no texto completo)
+    estrutura_tipada = carregar_estrutura(livro_dir, estrutura, num_capitulos)
+    if prefixo_capitulos is None:
+        definir_prefixo(formatar_parte_global(estrutura_tipada))
+    for capitulo in estrutura_tipada["capitulos"]:
+        capitulos_estrutura.setdefault(capitulo["numero"], capitulo)
+
+    # FASE 2: GERAR CADA CAPÍTULO INDIVIDUALMENTE
+    capitulos_conteudo = []
+
+    # Registrar um capítulo concluído (contagem, arquivo e progresso)
+    def registrar_capitulo(capitulo_num, capitulo_texto):
+        nonlocal total_palavras_livro
+        qtd_palavras = len(capitulo_texto.split())
+        total_palavras_livro += qtd_palavras
+        print(f"Capítulo {capitulo_num} gerado com {qtd_palavras} palavras.")
+        atualizar_progresso(4, f"Capítulo {capitulo_num} gerado com {qtd_palavras} palavras.")
+        salvar_capitulo(capitulo_num, capitulo_texto)
+
+    # Nomes dos personagens da estrutura tipada (ou, se ela não os reconheceu, das linhas "Nome: descrição")
+    personagens_estrutura = ([p["nome"] for p in estrutura_tipada["personagens"]]
+                             or extrair_personagens(estrutura_tipada["texto_global"]))
+
+    # Revisão dirigida: verificações locais baratas e, só para os parágrafos sinalizados, o modelo de
+    # revisão. No modo sequencial cada capítulo é verificado assim que chega, contra os anteriores
+    indice_duplicatas = IndiceDuplicatas()
+    relatorio_revisao = {"problemas": {}, "paragrafos_enviados": 0, "paragrafos_revisados": 0, "capitulos_alterados": []}
+
+    def acumular_revisao(revisao):
+        for tipo, quantidade in revisao["problemas"].items():
+            relatorio_revisao["problemas"][tipo] = relatorio_revisao["problemas"].get(tipo, 0) + quantidade
+        relatorio_revisao["paragrafos_enviados"] += revisao["paragrafos_enviados"]
+        relatorio_revisao["paragrafos_revisados"] += revisao["paragrafos_revisados"]
+        relatorio_revisao["capitulos_alterados"].extend(revisao["capitulos_alterados"])
+
+    if modo_paralelo:
+        # Modo paralelo: cada capítulo é escrito a partir do seu próprio trecho da estrutura,
+        # sem depender do texto completo do capítulo anterior
+        # Capítulos já gerados em uma execução anterior são reaproveitados
+        resultados = {}
+        for capitulo_num in range(1, num_capitulos + 1):
+            capitulo_texto = manifesto.capitulo_salvo(capitulo_num)
+            if capitulo_texto is not None:
+                total_palavras_livro += len(capitulo_texto.split())
+                resultados[capitulo_num] = capitulo_texto
+        pendentes = [n for n in range(1, num_capitulos + 1) if n not in resultados]
+        atualizar_progresso(4, f"Gerando {len(pendentes)} capítulos em paralelo (até {max_concorrencia} por vez)...")
+
+        # Os capítulos antecipados durante o streaming da estrutura já estão no mesmo executor
+        with executor_capitulos as executor:
+            futuros = {antecipados.get(n) or executor.submit(tarefa_capitulo, n): n for n in pendentes}
+            for futuro in as_completed(futuros):
+                capitulo_num = futuros[futuro]
+                try:
+                    capitulo_texto = futuro.result()
+                    registrar_capitulo(capitulo_num, capitulo_texto)
+                    resultados[capitulo_num] = capitulo_texto
+                except LivroCancelado:
+                    interromper()
+                    raise
+                except Exception as e:
+                    print(f"Erro ao gerar capítulo {capitulo_num}: {str(e)}")
+                    atualizar_progresso(4, f"Erro ao gerar capítulo {capitulo_num}: {str(e)}")
+                    resultados[capitulo_num] = f"[ERRO NO CAPÍTULO {capitulo_num}: {str(e)}]"
+
+        capitulos_conteudo = [resultados[n] for n in range(1, num_capitulos + 1)]
+
+        # Passo de continuidade: suavizar as transições entre capítulos escritos em paralelo
+        atualizar_progresso(4, "Ajustando a continuidade entre os capítulos...")
+        # (transições já revisadas em uma execução anterior não são pagas de novo)
+        a_revisar = [i for i in range(1, num_capitulos) if not manifesto.capitulo_revisado(i + 1)]
+        try:
+            capitulos_conteudo, transicoes_revisadas = revisar_transicoes(
+                capitulos_conteudo, max_concorrencia, indices=a_revisar, livro_id=livro_id, cancelamento=cancelamento)
+        except LivroCancelado:
+            interromper()
+            raise
+        # Só as transições reescritas ficam marcadas como revisadas; as que falharam são tentadas na retomada
+        for i in sorted(transicoes_revisadas):
+            salvar_capitulo(i + 1, capitulos_conteudo[i], revisado=True)
+    else:
+        # Memória incremental de resumos (substitui o reenvio dos capítulos anteriores)
+        memoria = MemoriaResumos(livro_dir, livro_id=livro_id, cancelamento=cancelamento)
+        # Índice local de personagens, lugares e objetos (continuidade sem reenviar prosa antiga)
+        indice_entidades = IndiceEntidades(livro_dir, personagens_estrutura)
+
+        for i in range(num_capitulos):
+            capitulo_num = i + 1
+            capitulo_texto = manifesto.capitulo_salvo(capitulo_num)
+            if capitulo_texto is not None:
+                # Capítulo já gerado (e conferido pelo hash): carregar o conteúdo para manter continuidade
+                total_palavras_livro += len(capitulo_texto.split())
+                capitulos_conteudo.append(capitulo_texto)
+                memoria.resumir(capitulo_num, capitulo_texto)
+                indice_entidades.atualizar(capitulo_num, capitulo_texto)
+                indice_duplicatas.adicionar_capitulo(capitulo_num, capitulo_texto)
+                print(f"Capítulo {capitulo_num} já existe. Pulando geração.")
+                atualizar_progresso(4, f"Capítulo {capitulo_num} já existente. Pulando geração.")
+                continue
+
+            atualizar_progresso(4, f"Gerando capítulo {capitulo_num} de {num_capitulos}...")
+            try:
+                # Contexto para o capítulo atual
+                contexto = contexto_base(capitulo_num)
+
+                # Adicionar os resumos recentes, o final do capítulo imediatamente anterior e o estado
+                # das entidades citadas no trecho deste capítulo na estrutura
+                if capitulo_num > 1:
+                    contexto_continuidade = (memoria.montar_contexto(capitulo_num, capitulos_conteudo[-1], RESUMOS_RECENTES)
+                                             + indice_entidades.montar_contexto(trecho_capitulo(capitulo_num)))
+                    memoria.registrar_economia(contexto_continuidade, contexto_legado(capitulos_conteudo))
+                    contexto += contexto_continuidade
+
+                if capitulo_num == 1:
+                    # O primeiro capítulo pode já ter começado durante o streaming da estrutura
+                    futuro = antecipados.get(1) or executor_capitulos.submit(tarefa_capitulo, 1)
+                    capitulo_texto = futuro.result()
+                else:
+                    # A estrutura fixa só tem a parte global: a sinopse do capítulo vai no contexto
+                    if trecho_capitulo(capitulo_num):
+                        contexto += f"\n\n{trecho_capitulo(capitulo_num)}"
+                    capitulo_texto = escrever_capitulo(capitulo_num, contexto,
+                                                       "Continue exatamente de onde o capítulo anterior parou.")
+
+                # Regenerar só os parágrafos sinalizados antes que o capítulo alimente os próximos contextos
+                revisados, revisao = revisar_sinalizados([capitulo_texto], personagens_estrutura, max_concorrencia,
+                                                         livro_id, indice_duplicatas, capitulo_num, cancelamento)
+                capitulo_texto = revisados[0]
+                acumular_revisao(revisao)
+
+                # Contar palavras e salvar o capítulo em arquivo
+                registrar_capitulo(capitulo_num, capitulo_texto)
+
+                # Resumir e indexar o capítulo uma única vez para os próximos contextos
+                if capitulo_num < num_capitulos:
+                    memoria.resumir(capitulo_num, capitulo_texto)
+                    indice_entidades.atualizar(capitulo_num, capitulo_texto)
+
+                # Armazenar o conteúdo do capítulo
+                capitulos_conteudo.append(capitulo_texto)
+
+            except LivroCancelado:
+                interromper()
+                raise
+            except Exception as e:
+                print(f"Erro ao gerar capítulo {capitulo_num}: {str(e)}")
+                atualizar_progresso(4, f"Erro ao gerar capítulo {capitulo_num}: {str(e)}")
+                capitulos_conteudo.append(f"[ERRO NO CAPÍTULO {capitulo_num}: {str(e)}]")
+                continue
+        executor_capitulos.shutdown()
+
+    try:
+        if modo_paralelo:
+            # Capítulos escritos em paralelo: verificados todos juntos, na ordem do livro
+            atualizar_progresso(4, "Verificando repetições, cabeçalhos, nomes e finais cortados...")
+            revisados, revisao = revisar_sinalizados(capitulos_conteudo, personagens_estrutura, max_concorrencia,
+                                                     livro_id, indice_duplicatas, cancelamento=cancelamento)
+            for capitulo_num in revisao["capitulos_alterados"]:
+                salvar_capitulo(capitulo_num, revisados[capitulo_num - 1], revisado=manifesto.capitulo_revisado(capitulo_num))
+            capitulos_conteudo = revisados
+            total_palavras_livro = sum(len(capitulo.split()) for capitulo in capitulos_conteudo)
+            acumular_revisao(revisao)
+        # Último ponto de cancelamento: daqui em diante o livro só é montado em arquivo
+        cancelamento.verificar()
+    except LivroCancelado:
+        interromper()
+        raise
+    atualizar_progresso(4, f"Revisão dirigida: {sum(relatorio_revisao['problemas'].values())} problemas encontrados, "
+                           f"{relatorio_revisao['paragrafos_enviados']} parágrafos enviados ao modelo, "
+                           f"{len(relatorio_revisao['capitulos_alterados'])} capítulos alterados.")
     
     # FASE 3: COMPILAR O LIVRO COMPLETO
-    atualizar_progresso(5, f"Compilando livro completo...")
+    atualizar_progresso(5, "Compilando livro completo...")
     
+    livro_file = os.path.join(livro_dir, "livro_completo.txt")
     try:
-        # Criar o livro completo
-        livro_completo = f"""# {tema.upper()}
+        # Montar o livro direto no arquivo, capítulo a capítulo (sem concatenar o livro inteiro em memória)
+        with MontadorLivro(livro_file) as livro:
+            livro.escrever(f"""# {tema.upper()}
 
 ## Livro
 
@@ -276,14 +883,16 @@ Todos os direitos reservados.
 
 ---
 
-"""
-        
-        # Adicionar cada capítulo
-        for i, capitulo in enumerate(capitulos_conteudo):
-            livro_completo += f"\n\n## Capítulo {i+1}\n\n{capitulo}\n\n---\n"
-        
-        # Adicionar informações do autor
-        livro_completo += f"""
+""")
+
+            # Adicionar cada capítulo
+            for i, capitulo in enumerate(capitulos_conteudo):
+                livro.escrever(f"\n\n## Capítulo {i+1}\n\n")
+                livro.escrever(capitulo)
+                livro.escrever("\n\n---\n")
+
+            # Adicionar informações do autor
+            livro.escrever(f"""
 ## Sobre o Autor
 
 {autor} é um autor de livros apaixonado por criar histórias mágicas que inspiram e educam.
@@ -291,24 +900,83 @@ Todos os direitos reservados.
 Para contato: {email_autor}
 
 Este livro foi gerado com assistência de Inteligência Artificial para publicação na Amazon KDP.
-"""
-        
-        # Salvar o livro completo
-        livro_file = os.path.join(livro_dir, "livro_completo.txt")
-        with open(livro_file, 'w', encoding='utf-8') as f:
-            f.write(livro_completo)
-        
-        atualizar_progresso(6, f"Livro '{tema}' finalizado com sucesso! Salvo em {livro_file}")
+""")
+
+        # Relatório da execução
+        capitulos_com_erro = [n for n, capitulo in enumerate(capitulos_conteudo, 1)
+                              if capitulo.startswith("[ERRO NO CAPÍTULO")]
+        if capitulos_com_erro:
+            # Livro incompleto: continua retomável, com os capítulos prontos e as respostas em cache
+            manifesto.definir_status(STATUS_ERRO)
+        else:
+            # Livro concluído: suas respostas deixam de ser fixadas no cache
+            obter_cache().liberar_livro(livro_id)
+            manifesto.definir_status(STATUS_CONCLUIDO)
+        metadata["capitulos"] = manifesto.capitulos_registrados()
+        escrever_json_atomico(metadata_file, metadata)
+        relatorio = {
+            "tema": tema,
+            "num_capitulos": num_capitulos,
+            "total_palavras": total_palavras_livro,
+            "modo_paralelo": modo_paralelo,
+            "motor": motor,
+            "cache_llm": obter_cache().estatisticas(),
+            "revisao": relatorio_revisao,
+            "capitulos_com_erro": capitulos_com_erro
+        }
+        if not modo_paralelo:
+            relatorio["memoria_resumos"] = memoria.relatorio()
+            atualizar_progresso(5, f"Memória de resumos: {relatorio['memoria_resumos']['tokens_economizados']} tokens de contexto economizados "
+                                   f"({relatorio['memoria_resumos']['economia_percentual']}%).")
+        with open(os.path.join(livro_dir, "relatorio.json"), 'w', encoding='utf-8') as f:
+            json.dump(relatorio, f, ensure_ascii=False, indent=2)
+
+        # Tokens, latência e custo de cada chamada, agregados por etapa, capítulo e modelo
+        metricas = obter_metricas().salvar_resumo_livro(livro_id, os.path.join(livro_dir, "metrics.json"))
+        atualizar_progresso(5, f"Chamadas ao modelo: {metricas['total']['chamadas']}, "
+                               f"{metricas['total']['tokens_prompt'] + metricas['total']['tokens_resposta']} tokens, "
+                               f"custo estimado US$ {metricas['total']['custo_usd']:.4f}, "
+                               f"{metricas['total']['taxa_prompt_cache']:.0%} do prompt atendido pelo cache do provedor.")
         
-        return livro_completo
+        if capitulos_com_erro:
+            erro_capitulos = (f"{len(capitulos_com_erro)} capítulo(s) falharam "
+                              f"({', '.join(str(n) for n in capitulos_com_erro)}); gere o mesmo livro de novo "
+                              f"para continuar a partir dos capítulos prontos")
+            atualizar_progresso(6, f"Livro '{tema}' incompleto: {erro_capitulos}. Rascunho em {livro_file}")
+        else:
+            atualizar_progresso(6, f"Livro '{tema}' finalizado com sucesso! Salvo em {livro_file}")
         
     except Exception as e:
         print(f"Erro ao compilar livro: {str(e)}")
         atualizar_progresso(6, f"Erro ao compilar livro: {str(e)}")
-        return livro_completo
+        raise
+
+    if capitulos_com_erro:
+        raise RuntimeError(erro_capitulos)
+    return livro_file
 
 # Executar diretamente apenas se o script for chamado diretamente
 if __name__ == "__main__":
-    tema_padrao = "Aventuras no Mundo Mágico"
-    livro = gerar_livro_generico(tema_padrao)
-    print(livro)
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Gera um livro, ou um lote de livros sem a interface.")
+    parser.add_argument("--tema", default="Aventuras no Mundo Mágico", help="Tema do livro (sem --lote)")
+    parser.add_argument("--lote", metavar="ARQUIVO",
+                        help="CSV ou JSONL com tema, genero, estilo, publico_alvo, num_capitulos e autor por livro; "
+                             "rodar o mesmo lote de novo pula os concluídos e retoma os interrompidos")
+    parser.add_argument("--processos", type=int, default=None, help="Processos geradores do lote (padrão: LOTE_PROCESSOS)")
+    parser.add_argument("--relatorio", help="Arquivo JSON do relatório do lote (padrão: <lote>_relatorio.json)")
+    parser.add_argument("--motor", choices=(MOTOR_CREWAI, MOTOR_DIRETO), default=MOTOR_CREWAI)
+    parser.add_argument("--modo-paralelo", action="store_true", help="Escreve os capítulos de cada livro em paralelo")
+    parser.add_argument("--max-concorrencia", type=int, default=4, help="Capítulos simultâneos por livro no modo paralelo")
+    args = parser.parse_args()
+
+    if args.lote:
+        from batch import executar_lote, imprimir_relatorio, PROCESSOS_LOTE
+        relatorio = executar_lote(args.lote, args.processos or PROCESSOS_LOTE, args.motor, args.modo_paralelo,
+                                  args.max_concorrencia, args.relatorio)
+        imprimir_relatorio(relatorio)
+    else:
+        livro_file = gerar_livro_generico(args.tema, modo_paralelo=args.modo_paralelo,
+                                          max_concorrencia=args.max_concorrencia, motor=args.motor)
+        print(f"Livro salvo em {livro_file}")
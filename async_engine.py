@@ -0,0 +1,356 @@
+import os
+import glob
+import json
+import random
+import asyncio
+import hashlib
+import threading
+from datetime import datetime
+
+from openai import AsyncOpenAI
+
+from rate_limiter import criar_http_client_async
+from llm_cache import completar_chat_async, obter_cache
+from outline import interpretar_sumario, LeitorSumario
+from book_store import MontadorLivro, DIRETORIO_LIVROS
+from manifest import escrever_texto_atomico
+from metrics import etiquetar, obter_metricas
+from routing import executar_com_rota_async, ETAPA_TITULOS, ETAPA_PROSA
+from cancelamento import Cancelamento, LivroCancelado, PRAZO_CHAMADA, PRAZO_LIVRO
+
+# Limite de chamadas de capítulo simultâneas por livro
+MAX_CAPITULOS_SIMULTANEOS = int(os.getenv("MAX_CAPITULOS_SIMULTANEOS", "4"))
+# Tentativas de cada capítulo (além das novas tentativas do SDK para 429 e 5xx) e espera base entre
+# elas, com jitter: a espera da tentativa n é sorteada entre 0 e ESPERA_BASE_CAPITULO * 2^(n-1).
+# Ao menos uma tentativa: com 0, o capítulo seria gravado sem nunca ter sido pedido
+TENTATIVAS_CAPITULO = max(1, int(os.getenv("TENTATIVAS_CAPITULO", "3")))
+ESPERA_BASE_CAPITULO = float(os.getenv("ESPERA_BASE_CAPITULO", "2"))
+# Tentativas de capítulo com erro toleradas no livro inteiro; esgotado o orçamento, nenhum capítulo
+# tenta de novo nem começa, e o livro falha mantendo os capítulos prontos para a próxima execução
+ORCAMENTO_FALHAS_LIVRO = int(os.getenv("ORCAMENTO_FALHAS_LIVRO", "6"))
+
+# Marca gravada no diretório de um livro montado por completo (os seus capítulos não são mais reaproveitados)
+ARQUIVO_CONCLUIDO = ".concluido"
+
+
+def diretorio_do_livro(chave):
+    """
+    Diretório da geração ainda não concluída do livro com esta chave (o hash da
+    especificação), para retomá-la; se todas estiverem concluídas, um diretório novo
+    (`<chave>_<timestamp>`), para que pedir o mesmo livro de novo gere outro livro.
+    """
+    existentes = glob.glob(os.path.join(DIRETORIO_LIVROS, chave)) + glob.glob(os.path.join(DIRETORIO_LIVROS, f"{chave}_*"))
+    for pasta in sorted(existentes, reverse=True):
+        if not os.path.exists(os.path.join(pasta, ARQUIVO_CONCLUIDO)):
+            return pasta
+    if not existentes:
+        return os.path.join(DIRETORIO_LIVROS, chave)
+    return os.path.join(DIRETORIO_LIVROS, f"{chave}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}")
+
+
+async def gerar_livro_generico_async(tema, autor, email_autor, genero, estilo, publico_alvo, descricao, formato,
+                                     num_capitulos=12, api_key=None, callback=None, ao_receber_trecho=None,
+                                     max_capitulos=MAX_CAPITULOS_SIMULTANEOS, cancelamento=None, prazo_livro=PRAZO_LIVRO):
+    """
+    Versão assíncrona do gerador de livros baseado na API da OpenAI.
+
+    O sumário (personagens, títulos e sinopse de cada capítulo) vem de uma única
+    chamada em JSON, recebida em streaming: cada capítulo começa a ser escrito assim
+    que a sua sinopse chega (depois dos personagens e da lista de títulos), enquanto
+    o resto do sumário ainda está sendo gerado. O texto completo é depois validado e
+    reparado localmente para os capítulos que ainda não começaram. Os capítulos
+    são limitados por um semáforo, então vários livros podem estar em andamento no
+    mesmo loop de eventos sem ocupar uma thread cada.
+
+    Args:
+        tema, autor, email_autor, genero, estilo, publico_alvo, descricao, formato:
+            Mesmos parâmetros de `streamlit_app.gerar_livro_generico`
+        num_capitulos: Número de capítulos a serem gerados (padrão: 12)
+        api_key: Chave da API da OpenAI
+        callback: Função opcional `callback(etapa, mensagem)` para acompanhar o progresso
+        ao_receber_trecho: Função opcional `ao_receber_trecho(capitulo, delta, fim)` que recebe o
+            texto de cada capítulo em streaming, trecho a trecho (`fim=True` no último aviso;
+            `delta=None` descarta o texto já recebido do capítulo, antes de uma nova tentativa)
+        max_capitulos: Máximo de pedidos de capítulo simultâneos
+        cancelamento: `cancelamento.Cancelamento` opcional; cancelado (de qualquer thread), interrompe
+            o sumário e todos os capítulos em andamento com `LivroCancelado`
+        prazo_livro: Tempo máximo da geração em segundos (0 = sem prazo)
+
+    Cada capítulo é gravado em disco assim que termina; numa nova execução do mesmo
+    livro depois de uma falha ou de um cancelamento, os capítulos já gravados não são
+    pedidos de novo. Um livro já concluído não é reaproveitado: o mesmo pedido gera
+    outro livro, em outro diretório. Um capítulo com erro é repetido até `TENTATIVAS_CAPITULO` vezes,
+    com espera exponencial sorteada, dentro do orçamento `ORCAMENTO_FALHAS_LIVRO` do livro.
+
+    Returns:
+        str: Caminho do arquivo com o livro completo formatado (cada capítulo é gravado
+            em disco assim que termina e o livro é montado em arquivo, sem ficar inteiro em memória)
+    """
+    if not api_key:
+        raise ValueError("Chave da API da OpenAI não fornecida")
+
+    def atualizar_progresso(etapa, mensagem):
+        if callback:
+            callback(etapa, mensagem)
+
+    cancelamento = cancelamento or Cancelamento()
+    cancelamento.definir_prazo(prazo_livro)
+
+    # Diretório da geração (o de uma geração interrompida do mesmo livro, se houver); o seu nome
+    # identifica o livro nas métricas e fixa as suas respostas no cache enquanto ele é gerado
+    livro_dir = diretorio_do_livro(hashlib.sha256(
+        json.dumps([tema, autor, genero, estilo, publico_alvo, descricao, num_capitulos], ensure_ascii=False).encode("utf-8")
+    ).hexdigest()[:16])
+    livro_id = os.path.basename(livro_dir)
+    os.makedirs(livro_dir, exist_ok=True)
+
+    def arquivo_capitulo(i):
+        return os.path.join(livro_dir, f"capitulo_{i}.txt")
+
+    def ler_capitulo_salvo(i):
+        if not os.path.exists(arquivo_capitulo(i)):
+            return None
+        with open(arquivo_capitulo(i), 'r', encoding='utf-8') as f:
+            return f.read() or None
+
+    falhas = {"total": 0, "esgotado": False}
+
+    async with AsyncOpenAI(api_key=api_key, http_client=criar_http_client_async(api_key), max_retries=6,
+                           timeout=PRAZO_CHAMADA) as client:
+        semaforo_capitulos = asyncio.Semaphore(max(1, max_capitulos))
+
+        leitor = LeitorSumario(num_capitulos)
+        tarefas = {}
+        titulos_capitulos = {}
+        parte_global = {}
+
+        def montar_parte_global(titulos):
+            # Fixada uma única vez: é o prefixo comum a todos os pedidos de capítulo
+            parte_global["sumario"] = "\n".join(f"{i}. {titulo}" for i, titulo in enumerate(titulos, 1))
+            parte_global["personagens"] = "\n".join(
+                f"- {p.get('nome', '')}: {p.get('descricao', '')}" if isinstance(p, dict) else f"- {p}"
+                for p in leitor.personagens
+            ) or "- (definidos na sinopse de cada capítulo)"
+
+        def iniciar_capitulo(item):
+            if item["numero"] in tarefas:
+                return
+            titulos_capitulos[item["numero"]] = item["titulo"]
+            tarefas[item["numero"]] = asyncio.create_task(gerar_capitulo(item["numero"], item["titulo"], item["sinopse"]))
+
+        def ao_receber_sumario(delta):
+            leitor.alimentar(delta)
+            # Personagens e títulos completos: os capítulos já recebidos podem começar
+            if not parte_global and {"personagens", "titulos"} <= leitor.listas_concluidas and leitor.titulos:
+                montar_parte_global(leitor.titulos[:num_capitulos])
+                atualizar_progresso(1, "Personagens e títulos recebidos; escrevendo capítulos enquanto o sumário chega...")
+            if parte_global:
+                for item in leitor.capitulos:
+                    iniciar_capitulo(item)
+
+        async def gerar_sumario():
+            try:
+                with etiquetar(etapa="sumario"):
+                    resposta = await executar_com_rota_async(ETAPA_TITULOS, lambda rota: completar_chat_async(
+                        client,
+                        model=rota["modelo"],
+                        messages=[
+                            {"role": "system", "content": "Você é um escritor especializado em planejar livros e criar títulos de capítulos cativantes. Responda sempre em JSON válido."},
+                            {"role": "user", "content": f"""Crie o sumário de um livro sobre '{tema}' com exatamente {num_capitulos} capítulos.
+O gênero é {genero}, o estilo é {estilo} e o público-alvo é {publico_alvo}.
+Descrição do livro: {descricao}
+
+Responda apenas com um objeto JSON com as chaves nesta ordem:
+{{"personagens": [{{"nome": "nome", "descricao": "características físicas e psicológicas em uma frase"}}],
+"titulos": ["título criativo de cada capítulo, sem numeração"],
+"capitulos": [{{"titulo": "o mesmo título da lista", "sinopse": "um parágrafo com o que acontece no capítulo"}}]}}"""}
+                        ],
+                        max_tokens=min(rota["max_tokens"], 400 + 170 * num_capitulos),
+                        temperature=rota["temperatura"],
+                        livro_id=livro_id,
+                        response_format={"type": "json_object"},
+                        ao_receber=ao_receber_sumario
+                    ), cancelamento)
+            except LivroCancelado:
+                raise
+            except Exception as e:
+                atualizar_progresso(1, f"Erro ao gerar o sumário: {str(e)}")
+                resposta = ""
+            return interpretar_sumario(resposta, num_capitulos)
+
+        async def gerar_capitulo(i, titulo, sinopse):
+            # Tudo que é igual em todos os capítulos vem antes (prefixo reaproveitado pelo cache do provedor);
+            # o que é específico do capítulo fica no final
+            prompt = f"""
+            Escreva um capítulo de um livro com as seguintes características:
+            - Tema principal: {tema}
+            - Gênero: {genero}
+            - Estilo: {estilo}
+            - Público-alvo: {publico_alvo}
+            - Descrição: {descricao}
+
+            Personagens principais:
+            {parte_global["personagens"]}
+
+            Sumário do livro:
+            {parte_global["sumario"]}
+
+            O capítulo deve ter entre 500 e 800 palavras, ser bem estruturado e cativante, e manter a coerência com o sumário.
+
+            Este é o capítulo {i} de {num_capitulos}.
+            - Título: {titulo}
+            O que acontece neste capítulo:
+            {sinopse}
+            """
+            # Capítulo já gravado por uma execução anterior deste livro
+            salvo = await asyncio.to_thread(ler_capitulo_salvo, i)
+            if salvo is not None:
+                atualizar_progresso(2, f"Capítulo {i}/{num_capitulos} já gerado anteriormente.")
+                if ao_receber_trecho:
+                    ao_receber_trecho(i, salvo, True)
+                return
+            async with semaforo_capitulos:
+                for tentativa in range(1, TENTATIVAS_CAPITULO + 1):
+                    if falhas["esgotado"]:
+                        raise RuntimeError("orçamento de falhas do livro esgotado")
+                    atualizar_progresso(2, f"Gerando capítulo {i}/{num_capitulos}: {titulo}"
+                                           + (f" (tentativa {tentativa})" if tentativa > 1 else ""))
+                    try:
+                        with etiquetar(capitulo=i, etapa="capitulo"):
+                            conteudo = await executar_com_rota_async(ETAPA_PROSA, lambda rota: completar_chat_async(
+                                client,
+                                model=rota["modelo"],
+                                messages=[
+                                    {"role": "system", "content": "Você é um escritor profissional especializado em criar conteúdo literário cativante."},
+                                    {"role": "user", "content": prompt}
+                                ],
+                                max_tokens=rota["max_tokens"],
+                                temperature=rota["temperatura"],
+                                livro_id=livro_id,
+                                ao_receber=(lambda delta: ao_receber_trecho(i, delta, False)) if ao_receber_trecho else None
+                            ), cancelamento)
+                        break
+                    except LivroCancelado:
+                        raise
+                    except Exception as e:
+                        falhas["total"] += 1
+                        falhas["esgotado"] = falhas["esgotado"] or falhas["total"] >= ORCAMENTO_FALHAS_LIVRO
+                        if tentativa == TENTATIVAS_CAPITULO or falhas["esgotado"]:
+                            raise
+                        espera = random.uniform(0, ESPERA_BASE_CAPITULO * 2 ** (tentativa - 1))
+                        atualizar_progresso(2, f"Erro no capítulo {i} ({str(e)}); nova tentativa em {espera:.1f}s")
+                        if ao_receber_trecho:
+                            ao_receber_trecho(i, None, False)
+                        await asyncio.sleep(espera)
+                if ao_receber_trecho:
+                    ao_receber_trecho(i, "", True)
+            # O capítulo vai para o disco assim que fica pronto (gravação atômica: um arquivo existente
+            # está sempre completo); só o arquivo é usado na montagem
+            await asyncio.to_thread(escrever_texto_atomico, arquivo_capitulo(i), conteudo.strip())
+
+        atualizar_progresso(1, f"Planejando o sumário dos {num_capitulos} capítulos...")
+        try:
+            # Cancelamento e prazo interrompem o sumário e os capítulos no meio do streaming
+            sumario = await cancelamento.executar_async(gerar_sumario())
+            # Capítulos que não começaram durante o streaming usam o sumário completo, validado e reparado
+            if not parte_global:
+                montar_parte_global([item["titulo"] for item in sumario])
+            for item in sumario:
+                iniciar_capitulo(item)
+            # Um capítulo com erro não interrompe os outros: o que já foi pago termina e fica gravado
+            resultados = await cancelamento.executar_async(asyncio.gather(*tarefas.values(), return_exceptions=True))
+            for resultado in resultados:
+                if isinstance(resultado, LivroCancelado):
+                    raise resultado
+        except LivroCancelado as e:
+            for tarefa in tarefas.values():
+                tarefa.cancel()
+            await asyncio.gather(*tarefas.values(), return_exceptions=True)
+            atualizar_progresso(2, f"Geração interrompida ({e}). Os capítulos prontos foram mantidos em {livro_dir}.")
+            raise
+        com_erro = {numero: resultado for numero, resultado in zip(tarefas, resultados) if isinstance(resultado, BaseException)}
+        if com_erro:
+            detalhes = "; ".join(f"capítulo {numero}: {erro}" for numero, erro in sorted(com_erro.items()))
+            atualizar_progresso(2, f"{len(com_erro)} capítulo(s) falharam ({detalhes}). Os outros "
+                                   f"{num_capitulos - len(com_erro)} foram mantidos em {livro_dir}.")
+            raise RuntimeError(f"{len(com_erro)} capítulo(s) falharam ({detalhes}); gere o mesmo livro de novo "
+                               f"para continuar a partir dos capítulos prontos")
+        capitulos = [titulos_capitulos[i] for i in range(1, num_capitulos + 1)]
+
+    def montar_livro():
+        livro_file = os.path.join(livro_dir, "livro_completo.txt")
+        with MontadorLivro(livro_file) as livro:
+            livro.escrever(f"# {tema.upper()}\n\n")
+            livro.escrever(f"**Autor:** {autor}\n")
+            livro.escrever(f"**Gênero:** {genero}\n")
+            livro.escrever(f"**Estilo:** {estilo}\n")
+            livro.escrever(f"**Público-alvo:** {publico_alvo}\n\n")
+
+            # Adicionar prefácio
+            livro.escrever("## Prefácio\n\n")
+            livro.escrever("Este livro foi gerado automaticamente pelo Gerador de Livros AI. \n")
+            livro.escrever(f"Tema: {tema}\n")
+            livro.escrever(f"Autor: {autor} ({email_autor})\n\n")
+
+            # Índice
+            livro.escrever("## Índice\n\n")
+            for i, titulo in enumerate(capitulos, 1):
+                livro.escrever(f"{i}. {titulo}\n")
+            livro.escrever("\n")
+
+            for i, titulo in enumerate(capitulos, 1):
+                livro.escrever(f"# Capítulo {i}: {titulo}\n\n")
+                livro.copiar_arquivo(arquivo_capitulo(i))
+                livro.escrever("\n\n")
+
+            # Adicionar posfácio
+            livro.escrever("# Posfácio\n\n")
+            livro.escrever(f"Chegamos ao final desta jornada sobre '{tema}'. Espero que tenha gostado da leitura. ")
+            livro.escrever("Este livro foi gerado automaticamente, mas cada palavra foi cuidadosamente elaborada para você.\n\n")
+            livro.escrever(f"Atenciosamente,\n{autor}\n")
+
+            # Adicionar informações de direitos autorais
+            ano_atual = datetime.now().year
+            livro.escrever("\n---\n")
+            livro.escrever(f"© {ano_atual} {autor}. Todos os direitos reservados.\n")
+            livro.escrever("Este livro foi gerado pelo Gerador de Livros AI.\n")
+        return livro_file
+
+    # Montar o livro em arquivo, fora do loop de eventos
+    livro_file = await asyncio.to_thread(montar_livro)
+    # Geração concluída: um novo pedido do mesmo livro começa em outro diretório
+    await asyncio.to_thread(escrever_texto_atomico, os.path.join(livro_dir, ARQUIVO_CONCLUIDO), datetime.now().isoformat())
+
+    # Livro concluído: suas respostas deixam de ser fixadas e seguem o LRU do cache
+    cache = obter_cache()
+    await asyncio.to_thread(cache.liberar_livro, livro_id)
+    estatisticas = await asyncio.to_thread(cache.estatisticas)
+    metricas = await asyncio.to_thread(obter_metricas().salvar_resumo_livro, livro_id, os.path.join(livro_dir, "metrics.json"))
+    atualizar_progresso(3, f"Chamadas ao modelo: {metricas['total']['chamadas']}, "
+                           f"{metricas['total']['tokens_prompt'] + metricas['total']['tokens_resposta']} tokens, "
+                           f"custo estimado US$ {metricas['total']['custo_usd']:.4f}, "
+                           f"{metricas['total']['taxa_prompt_cache']:.0%} do prompt atendido pelo cache do provedor")
+    atualizar_progresso(3, f"Cache de respostas: {estatisticas['acertos']} acertos, {estatisticas['falhas']} falhas, "
+                           f"{estatisticas['tokens_economizados']} tokens economizados")
+
+    return livro_file
+
+
+# Loop de eventos compartilhado pelo processo: todos os livros em andamento rodam nele
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def obter_loop():
+    """Retorna (e inicia na primeira chamada) o loop de eventos de fundo do processo."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="loop-geracao-livros", daemon=True).start()
+        return _loop
+
+
+def submeter(coro):
+    """Agenda uma corrotina no loop compartilhado e retorna um `concurrent.futures.Future`."""
+    return asyncio.run_coroutine_threadsafe(coro, obter_loop())
@@ -0,0 +1,189 @@
+import os
+import csv
+import json
+import time
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+from manifest import gerar_job_id, localizar_livro, ler_manifesto, escrever_json_atomico, STATUS_CONCLUIDO, STATUS_CANCELADO
+from cancelamento import LivroCancelado
+from metrics import obter_metricas
+from rate_limiter import GerenciadorLimitador, LimitadorCompartilhado, usar_limitador_compartilhado, RPM_INICIAL, TPM_INICIAL
+
+# Processos geradores usados quando o lote não informa outro número
+PROCESSOS_LOTE = int(os.getenv("LOTE_PROCESSOS", "2"))
+
+# Colunas aceitas no arquivo de especificações (só `tema` é obrigatória)
+CAMPOS_LOTE = ("tema", "genero", "estilo", "publico_alvo", "num_capitulos", "autor", "email_autor", "descricao")
+
+
+def ler_especificacoes(caminho):
+    """
+    Lê as especificações de livros de um CSV (com cabeçalho) ou de um JSONL (um objeto por linha).
+
+    Linhas sem `tema` são ignoradas com um aviso; `num_capitulos` vira inteiro (padrão: 12).
+    """
+    with open(caminho, 'r', encoding='utf-8-sig') as f:
+        if caminho.lower().endswith((".jsonl", ".json")):
+            linhas = [json.loads(linha) for linha in f if linha.strip()]
+        else:
+            linhas = list(csv.DictReader(f))
+
+    especificacoes = []
+    for numero, linha in enumerate(linhas, 1):
+        especificacao = {campo: str(linha[campo]).strip() for campo in CAMPOS_LOTE
+                         if linha.get(campo) not in (None, "")}
+        if not especificacao.get("tema"):
+            print(f"Linha {numero} de {caminho} sem tema; ignorada.")
+            continue
+        especificacao["num_capitulos"] = int(especificacao.get("num_capitulos") or 12)
+        especificacoes.append(especificacao)
+    return especificacoes
+
+
+def _iniciar_processo(proxy_limitador):
+    """Inicialização de cada processo do lote: todas as chamadas passam pelo limitador compartilhado."""
+    load_dotenv()
+    usar_limitador_compartilhado(LimitadorCompartilhado(proxy_limitador))
+
+
+def gerar_especificacao(especificacao, job_id, motor, modo_paralelo, max_concorrencia):
+    """Gera um livro do lote (em um processo do pool) e retorna a linha do relatório."""
+    from app import gerar_livro_generico, DIRETORIO_LIVROS
+
+    # As métricas são do livro_id da geração (o diretório): o de um livro retomado, se houver
+    metricas = obter_metricas()
+    retomado = localizar_livro(DIRETORIO_LIVROS, job_id)
+    antes = metricas.resumo_livro(os.path.basename(retomado) if retomado else None)["total"]
+    linha = {"tema": especificacao["tema"], "job_id": job_id, "status": STATUS_CONCLUIDO, "livro": None, "erro": None}
+
+    def callback(etapa, mensagem):
+        print(f"[{job_id}] {mensagem}", flush=True)
+
+    inicio = time.perf_counter()
+    try:
+        linha["livro"] = gerar_livro_generico(callback=callback, job_id=job_id, motor=motor, modo_paralelo=modo_paralelo,
+                                              max_concorrencia=max_concorrencia, **especificacao)
+    except LivroCancelado as e:
+        # Prazo do livro esgotado: os capítulos prontos ficam para a próxima execução do lote
+        linha["status"] = STATUS_CANCELADO
+        linha["erro"] = str(e)
+    except Exception as e:
+        linha["status"] = "erro"
+        linha["erro"] = str(e)
+    linha["duracao_s"] = round(time.perf_counter() - inicio, 2)
+
+    # Só o que foi gasto nesta execução (um livro retomado já tem chamadas de execuções anteriores)
+    livro_dir = os.path.dirname(linha["livro"]) if linha["livro"] else localizar_livro(DIRETORIO_LIVROS, job_id)
+    depois = metricas.resumo_livro(os.path.basename(livro_dir) if livro_dir else None)["total"]
+    linha["chamadas"] = depois["chamadas"] - antes["chamadas"]
+    linha["tokens"] = (depois["tokens_prompt"] + depois["tokens_resposta"]
+                       - antes["tokens_prompt"] - antes["tokens_resposta"])
+    linha["custo_usd"] = round(depois["custo_usd"] - antes["custo_usd"], 6)
+    linha["chamadas_com_erro"] = depois["erros"] - antes["erros"]
+    if linha["livro"]:
+        manifesto = ler_manifesto(livro_dir) or {}
+        linha["capitulos_com_erro"] = _capitulos_com_erro(linha["livro"])
+        linha["palavras"] = sum(c.get("palavras", 0) for c in manifesto.get("capitulos", {}).values())
+    return linha
+
+
+def _capitulos_com_erro(caminho_livro):
+    with open(caminho_livro, 'r', encoding='utf-8') as f:
+        return sum(linha.count("[ERRO NO CAPÍTULO") for linha in f)
+
+
+def executar_lote(caminho_especificacoes, processos=PROCESSOS_LOTE, motor="crewai", modo_paralelo=False,
+                  max_concorrencia=4, caminho_relatorio=None, rpm=RPM_INICIAL, tpm=TPM_INICIAL):
+    """
+    Gera todos os livros de um arquivo de especificações em um pool de processos.
+
+    Os processos compartilham um único limitador de taxa (hospedado em um
+    `GerenciadorLimitador`), então o lote inteiro respeita os limites da chave de
+    API. Cada especificação tem um `job_id` estável: rodar o mesmo lote de novo
+    pula os livros já concluídos e retoma os interrompidos do último capítulo
+    salvo. Retorna o relatório, também gravado em `caminho_relatorio` (JSON).
+    """
+    from app import DIRETORIO_LIVROS
+
+    especificacoes = ler_especificacoes(caminho_especificacoes)
+    caminho_relatorio = caminho_relatorio or os.path.splitext(caminho_especificacoes)[0] + "_relatorio.json"
+    linhas = []
+    pendentes = []
+    for especificacao in especificacoes:
+        job_id = gerar_job_id(especificacao)
+        concluido = localizar_livro(DIRETORIO_LIVROS, job_id, incluir_concluidos=True)
+        livro = os.path.join(concluido, "livro_completo.txt") if concluido else None
+        if livro and ler_manifesto(concluido).get("status") == STATUS_CONCLUIDO and os.path.exists(livro):
+            print(f"[{job_id}] '{especificacao['tema']}' já concluído em {livro}; pulando.")
+            linhas.append({"tema": especificacao["tema"], "job_id": job_id, "status": "ja_concluido", "livro": livro,
+                           "erro": None, "duracao_s": 0.0, "chamadas": 0, "tokens": 0, "custo_usd": 0.0,
+                           "chamadas_com_erro": 0})
+        else:
+            pendentes.append((especificacao, job_id))
+
+    print(f"Lote: {len(especificacoes)} livros, {len(pendentes)} a gerar em {processos} processos.")
+    inicio = time.perf_counter()
+    with GerenciadorLimitador() as gerenciador:
+        limitador = gerenciador.LimitadorTaxa(rpm, tpm)
+        with ProcessPoolExecutor(max_workers=max(1, processos), initializer=_iniciar_processo,
+                                 initargs=(limitador,)) as executor:
+            futuros = {
+                executor.submit(gerar_especificacao, especificacao, job_id, motor, modo_paralelo, max_concorrencia): job_id
+                for especificacao, job_id in pendentes
+            }
+            for futuro in as_completed(futuros):
+                try:
+                    linha = futuro.result()
+                except Exception as e:
+                    # O processo do livro morreu: o livro fica retomável na próxima execução do lote
+                    linha = {"tema": None, "job_id": futuros[futuro], "status": "erro", "livro": None, "erro": str(e),
+                             "duracao_s": 0.0, "chamadas": 0, "tokens": 0, "custo_usd": 0.0, "chamadas_com_erro": 0}
+                linhas.append(linha)
+                print(f"[{linha['job_id']}] {linha['status']} em {linha['duracao_s']}s, {linha['tokens']} tokens"
+                      + (f": {linha['erro']}" if linha["erro"] else ""), flush=True)
+                # Relatório parcial a cada livro: um lote interrompido ainda deixa o que já terminou registrado
+                relatorio = _montar_relatorio(caminho_especificacoes, linhas, time.perf_counter() - inicio)
+                escrever_json_atomico(caminho_relatorio, relatorio)
+        estado_limitador = limitador.estado()
+
+    relatorio = _montar_relatorio(caminho_especificacoes, linhas, time.perf_counter() - inicio)
+    relatorio["limitador"] = estado_limitador
+    escrever_json_atomico(caminho_relatorio, relatorio)
+    return relatorio
+
+
+def _montar_relatorio(caminho_especificacoes, linhas, duracao):
+    gerados = [l for l in linhas if l["status"] != "ja_concluido"]
+    return {
+        "especificacoes": os.path.abspath(caminho_especificacoes),
+        "gerado_em": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "duracao_total_s": round(duracao, 2),
+        "total": {
+            "livros": len(linhas),
+            "concluidos": sum(1 for l in gerados if l["status"] == STATUS_CONCLUIDO),
+            "ja_concluidos": len(linhas) - len(gerados),
+            "falhas": sum(1 for l in gerados if l["status"] == "erro"),
+            "cancelados": sum(1 for l in gerados if l["status"] == STATUS_CANCELADO),
+            "tokens": sum(l["tokens"] for l in gerados),
+            "custo_usd": round(sum(l["custo_usd"] for l in gerados), 6)
+        },
+        "livros": linhas
+    }
+
+
+def imprimir_relatorio(relatorio):
+    colunas = [("job_id", "job"), ("status", "status"), ("duracao_s", "duração (s)"), ("tokens", "tokens"),
+               ("custo_usd", "custo (US$)"), ("chamadas_com_erro", "erros"), ("tema", "tema")]
+    linhas = relatorio["livros"]
+    larguras = [max(len(titulo), *(len(str(l.get(chave))) for l in linhas)) if linhas else len(titulo)
+                for chave, titulo in colunas]
+    print("  ".join(titulo.ljust(largura) for (_, titulo), largura in zip(colunas, larguras)))
+    for l in linhas:
+        print("  ".join(str(l.get(chave)).ljust(largura) for (chave, _), largura in zip(colunas, larguras)))
+    total = relatorio["total"]
+    print(f"\n{total['concluidos']} concluídos, {total['ja_concluidos']} já concluídos, {total['falhas']} falhas, "
+          f"{total['cancelados']} cancelados; "
+          f"{total['tokens']} tokens, US$ {total['custo_usd']:.4f} em {relatorio['duracao_total_s']}s")
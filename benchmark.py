@@ -0,0 +1,168 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+import subprocess
+
+from fake_llm_server import iniciar_servidor, adicionar_argumentos, configuracao_dos_argumentos
+
+MOTORES = ("crewai", "direto", "openai")
+CAPITULOS_PADRAO = (12, 30, 60)
+
+# Parâmetros do livro usados em todas as execuções
+LIVRO_BENCHMARK = {
+    "tema": "Aventuras no Mundo Mágico",
+    "autor": "Autor de Teste",
+    "email_autor": "autor@exemplo.com",
+    "genero": "Fantasia",
+    "estilo": "Narrativo",
+    "publico_alvo": "Jovem adulto",
+    "descricao": "Uma história sobre amizade e coragem em uma floresta encantada."
+}
+
+
+def percentil(valores, p):
+    """Percentil `p` (0-100) por interpolação linear; 0 se não houver valores."""
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    posicao = (len(ordenados) - 1) * p / 100
+    inferior = int(posicao)
+    superior = min(inferior + 1, len(ordenados) - 1)
+    return ordenados[inferior] + (ordenados[superior] - ordenados[inferior]) * (posicao - inferior)
+
+
+def executar_um(motor, num_capitulos, modo_paralelo):
+    """
+    Gera um livro com o motor informado neste processo e retorna as medições.
+
+    Roda em um subprocesso próprio para que o pico de memória (RSS) seja só desta execução.
+    """
+    from metrics import obter_metricas
+
+    inicio = time.perf_counter()
+    if motor in ("crewai", "direto"):
+        from app import gerar_livro_generico
+        livro_file = gerar_livro_generico(api_key=os.environ["OPENAI_API_KEY"], num_capitulos=num_capitulos,
+                                          modo_paralelo=modo_paralelo, motor=motor, **LIVRO_BENCHMARK)
+    else:
+        from async_engine import gerar_livro_generico_async
+        livro_file = asyncio.run(gerar_livro_generico_async(formato="eBook Kindle", num_capitulos=num_capitulos,
+                                                            api_key=os.environ["OPENAI_API_KEY"], **LIVRO_BENCHMARK))
+    duracao = time.perf_counter() - inicio
+    latencias = obter_metricas().latencias(etapa="capitulo")
+    return {
+        "duracao_s": duracao,
+        "latencias_capitulo": latencias,
+        # ru_maxrss vem em KB no Linux
+        "pico_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "tamanho_livro_bytes": os.path.getsize(livro_file)
+    }
+
+
+def medir(motor, num_capitulos, url, modo_paralelo, rpm, tpm):
+    """Executa um livro em um subprocesso isolado (cache, métricas e pastas temporários) e retorna as medições."""
+    with tempfile.TemporaryDirectory(prefix="benchmark_livros_") as pasta:
+        ambiente = dict(
+            os.environ,
+            OPENAI_API_KEY="sk-benchmark-falsa",
+            OPENAI_BASE_URL=url,
+            OPENAI_API_BASE=url,
+            OPENAI_RPM_INICIAL=str(rpm),
+            OPENAI_TPM_INICIAL=str(tpm),
+            LLM_CACHE_PATH=os.path.join(pasta, "cache.sqlite3"),
+            METRICS_PATH=os.path.join(pasta, "metricas.sqlite3"),
+            LIVROS_DIR=os.path.join(pasta, "livros"),
+            LIVROS_CREWAI_DIR=pasta
+        )
+        comando = [sys.executable, os.path.abspath(__file__), "--executar-um", motor, str(num_capitulos)]
+        if modo_paralelo:
+            comando.append("--modo-paralelo")
+        processo = subprocess.run(comando, env=ambiente, capture_output=True, text=True)
+        if processo.returncode != 0:
+            raise RuntimeError(f"Execução {motor}/{num_capitulos} falhou:\n{processo.stderr[-2000:]}")
+        # O resultado é a última linha da saída (a geração imprime o progresso antes)
+        return json.loads(processo.stdout.strip().splitlines()[-1])
+
+
+def executar_benchmark(motores, lista_capitulos, config, repeticoes=1, modo_paralelo=False):
+    """Roda cada motor para cada número de capítulos contra o servidor falso e retorna o relatório."""
+    servidor, url = iniciar_servidor(config)
+    resultados = []
+    try:
+        for motor in motores:
+            for num_capitulos in lista_capitulos:
+                duracoes, latencias, picos, tokens, requisicoes, limitadas = [], [], [], [], [], []
+                for _ in range(repeticoes):
+                    config.zerar_contadores()
+                    medicao = medir(motor, num_capitulos, url, modo_paralelo, config.rpm, config.tpm)
+                    duracoes.append(medicao["duracao_s"])
+                    latencias.extend(medicao["latencias_capitulo"])
+                    picos.append(medicao["pico_rss_mb"])
+                    # Tokens contados no servidor: incluem novas tentativas e chamadas internas da CrewAI
+                    tokens.append(config.tokens_recebidos)
+                    requisicoes.append(config.requisicoes)
+                    limitadas.append(config.respostas_429)
+                media_duracao = sum(duracoes) / len(duracoes)
+                resultados.append({
+                    "motor": motor,
+                    "capitulos": num_capitulos,
+                    "repeticoes": repeticoes,
+                    "livros_por_hora": round(3600 / media_duracao, 2) if media_duracao else 0.0,
+                    "duracao_media_s": round(media_duracao, 2),
+                    "latencia_capitulo_p50_s": round(percentil(latencias, 50), 3),
+                    "latencia_capitulo_p99_s": round(percentil(latencias, 99), 3),
+                    "pico_rss_mb": round(max(picos), 1),
+                    "tokens_enviados_por_livro": int(sum(tokens) / len(tokens)),
+                    "tokens_enviados_por_capitulo": int(sum(tokens) / len(tokens) / num_capitulos),
+                    "requisicoes_por_livro": int(sum(requisicoes) / len(requisicoes)),
+                    "respostas_429_por_livro": round(sum(limitadas) / len(limitadas), 1)
+                })
+                print(json.dumps(resultados[-1], ensure_ascii=False), flush=True)
+    finally:
+        servidor.shutdown()
+    return resultados
+
+
+def imprimir_tabela(resultados):
+    colunas = [("motor", "motor"), ("capitulos", "caps"), ("livros_por_hora", "livros/h"),
+               ("latencia_capitulo_p50_s", "p50 cap (s)"), ("latencia_capitulo_p99_s", "p99 cap (s)"),
+               ("pico_rss_mb", "pico RSS (MB)"), ("tokens_enviados_por_livro", "tokens/livro"),
+               ("tokens_enviados_por_capitulo", "tokens/cap"),
+               ("respostas_429_por_livro", "429/livro")]
+    larguras = [max(len(titulo), *(len(str(r[chave])) for r in resultados)) for chave, titulo in colunas]
+    print("  ".join(titulo.ljust(largura) for (_, titulo), largura in zip(colunas, larguras)))
+    for r in resultados:
+        print("  ".join(str(r[chave]).ljust(largura) for (chave, _), largura in zip(colunas, larguras)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark de ponta a ponta dos geradores de livros contra o servidor LLM falso (sem rede e sem custo)."
+    )
+    parser.add_argument("--motores", nargs="+", choices=MOTORES, default=list(MOTORES),
+                        help="crewai = app.gerar_livro_generico com agentes; direto = app.gerar_livro_generico com "
+                             "chamadas diretas; openai = gerador assíncrono usado pela interface")
+    parser.add_argument("--capitulos", nargs="+", type=int, default=list(CAPITULOS_PADRAO), help="Números de capítulos a medir")
+    parser.add_argument("--repeticoes", type=int, default=1, help="Livros gerados por combinação motor/capítulos")
+    parser.add_argument("--modo-paralelo", action="store_true", help="Usa o modo paralelo do motor CrewAI")
+    parser.add_argument("--saida", help="Arquivo JSON onde gravar o relatório")
+    parser.add_argument("--executar-um", nargs=2, metavar=("MOTOR", "CAPITULOS"), help=argparse.SUPPRESS)
+    adicionar_argumentos(parser)
+    args = parser.parse_args()
+
+    if args.executar_um:
+        medicao = executar_um(args.executar_um[0], int(args.executar_um[1]), args.modo_paralelo)
+        print(json.dumps(medicao))
+        sys.exit(0)
+
+    resultados = executar_benchmark(args.motores, args.capitulos, configuracao_dos_argumentos(args),
+                                    args.repeticoes, args.modo_paralelo)
+    imprimir_tabela(resultados)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, ensure_ascii=False, indent=2)
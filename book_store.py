@@ -0,0 +1,107 @@
+import os
+import tempfile
+
+# Pasta onde ficam os livros montados pelo gerador assíncrono (a mesma dos backups da interface)
+DIRETORIO_LIVROS = os.path.abspath(os.getenv("LIVROS_DIR", "livros_gerados"))
+
+# Tamanho (em bytes) de cada página da prévia e de cada bloco das cópias de arquivo
+TAMANHO_PAGINA = int(os.getenv("LIVRO_TAMANHO_PAGINA", "20000"))
+TAMANHO_BLOCO = 64 * 1024
+
+
+class MontadorLivro:
+    """
+    Monta o livro diretamente em arquivo, parte a parte.
+
+    Cada trecho (cabeçalho, capítulo, posfácio) é gravado assim que fica pronto,
+    em vez de concatenado em uma string que cresce a cada capítulo; a memória
+    usada não depende do tamanho do livro. O arquivo final só aparece no destino
+    (via `os.replace`) quando a montagem termina sem erro.
+
+    Uso:
+        with MontadorLivro(caminho) as livro:
+            livro.escrever("# Título\\n\\n")
+            livro.copiar_arquivo(caminho_capitulo)
+    """
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        diretorio = os.path.dirname(caminho) or "."
+        os.makedirs(diretorio, exist_ok=True)
+        fd, self._temporario = tempfile.mkstemp(dir=diretorio, prefix=".tmp_", suffix=".txt")
+        self._arquivo = os.fdopen(fd, 'w', encoding='utf-8')
+
+    def escrever(self, texto):
+        self._arquivo.write(texto)
+
+    def copiar_arquivo(self, caminho):
+        """Acrescenta o conteúdo de outro arquivo de texto (ex.: um capítulo) em blocos."""
+        with open(caminho, 'r', encoding='utf-8') as origem:
+            while True:
+                bloco = origem.read(TAMANHO_BLOCO)
+                if not bloco:
+                    break
+                self._arquivo.write(bloco)
+
+    def concluir(self):
+        """Fecha o arquivo e o move para o destino final. Retorna o caminho do livro."""
+        self._arquivo.flush()
+        os.fsync(self._arquivo.fileno())
+        self._arquivo.close()
+        os.replace(self._temporario, self.caminho)
+        return self.caminho
+
+    def descartar(self):
+        self._arquivo.close()
+        if os.path.exists(self._temporario):
+            os.remove(self._temporario)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo_excecao, excecao, traceback):
+        if tipo_excecao is None:
+            self.concluir()
+        else:
+            self.descartar()
+        return False
+
+
+def total_paginas(caminho, tamanho_pagina=TAMANHO_PAGINA):
+    return max(1, -(-os.path.getsize(caminho) // tamanho_pagina))
+
+
+def _inicio_de_caractere(byte):
+    # Bytes de continuação UTF-8 têm o formato 10xxxxxx
+    return (byte & 0xC0) != 0x80
+
+
+def ler_pagina(caminho, pagina, tamanho_pagina=TAMANHO_PAGINA):
+    """
+    Lê apenas a página `pagina` (a partir de 0) do livro, sem carregar o arquivo inteiro.
+
+    Os limites da página são ajustados para não cortar um caractere UTF-8 ao meio:
+    cada página começa no primeiro caractere que inicia dentro dela.
+    """
+    with open(caminho, 'rb') as f:
+        f.seek(pagina * tamanho_pagina)
+        # Alguns bytes extras para completar o último caractere da página
+        dados = f.read(tamanho_pagina + 3)
+    inicio = 0
+    while inicio < len(dados) and not _inicio_de_caractere(dados[inicio]):
+        inicio += 1
+    fim = min(tamanho_pagina, len(dados))
+    while fim < len(dados) and not _inicio_de_caractere(dados[fim]):
+        fim += 1
+    return dados[inicio:fim].decode('utf-8', errors='replace')
+
+
+def copiar_livro(origem, destino):
+    """Copia o livro em blocos para `destino`."""
+    with open(origem, 'rb') as entrada, open(destino, 'wb') as saida:
+        while True:
+            bloco = entrada.read(TAMANHO_BLOCO)
+            if not bloco:
+                break
+            saida.write(bloco)
+    return destino
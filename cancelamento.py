@@ -0,0 +1,115 @@
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import Future, TimeoutError as EsperaEsgotada
+
+# Tempo máximo de cada chamada ao modelo, somadas as novas tentativas do SDK (um pedido travado não
+# segura o worker indefinidamente)
+PRAZO_CHAMADA = float(os.getenv("PRAZO_CHAMADA", "180"))
+# Tempo máximo de geração de um livro inteiro (0 = sem prazo)
+PRAZO_LIVRO = float(os.getenv("PRAZO_LIVRO", "7200"))
+# Intervalo entre as verificações de cancelamento dos geradores assíncronos
+INTERVALO_VERIFICACAO = 0.5
+
+MOTIVO_USUARIO = "Cancelado pelo usuário"
+MOTIVO_PRAZO = "Prazo do livro esgotado"
+
+
+class LivroCancelado(Exception):
+    """Geração interrompida por pedido de cancelamento ou por prazo esgotado."""
+
+
+class Cancelamento:
+    """
+    Sinal de cancelamento cooperativo de um livro, com prazo opcional.
+
+    É repassado a todas as etapas da geração, que chamam `verificar()` antes de
+    cada chamada ao modelo (e entre os trechos de uma resposta em streaming).
+    `cancelar()` pode ser chamado de qualquer thread; o prazo do livro é conferido
+    em cada verificação, sem thread de relógio.
+    """
+
+    def __init__(self, prazo=None):
+        self._evento = threading.Event()
+        self.motivo = None
+        self.limite = None
+        self.definir_prazo(prazo)
+
+    def definir_prazo(self, segundos):
+        """Define o prazo a partir de agora (um prazo anterior mais curto é mantido)."""
+        if not segundos:
+            return
+        limite = time.monotonic() + segundos
+        self.limite = limite if self.limite is None else min(self.limite, limite)
+
+    def cancelar(self, motivo=MOTIVO_USUARIO):
+        if not self._evento.is_set():
+            self.motivo = motivo
+            self._evento.set()
+
+    @property
+    def cancelado(self):
+        if not self._evento.is_set() and self.limite is not None and time.monotonic() >= self.limite:
+            self.cancelar(MOTIVO_PRAZO)
+        return self._evento.is_set()
+
+    def verificar(self):
+        """Levanta `LivroCancelado` se o livro foi cancelado ou passou do prazo."""
+        if self.cancelado:
+            raise LivroCancelado(self.motivo)
+
+    def restante(self):
+        """Segundos até o prazo do livro (None sem prazo)."""
+        return None if self.limite is None else max(0.0, self.limite - time.monotonic())
+
+    async def executar_async(self, coro):
+        """
+        Executa a corrotina até o fim ou até o cancelamento (ou o prazo), o que vier
+        primeiro; no cancelamento, a tarefa é cancelada e `LivroCancelado` é levantada.
+        """
+        tarefa = asyncio.ensure_future(coro)
+        while not tarefa.done():
+            if self.cancelado:
+                tarefa.cancel()
+                try:
+                    await tarefa
+                except asyncio.CancelledError:
+                    pass
+                raise LivroCancelado(self.motivo)
+            await asyncio.wait({tarefa}, timeout=INTERVALO_VERIFICACAO)
+        return tarefa.result()
+
+
+def executar_com_prazo(funcao, prazo=PRAZO_CHAMADA, cancelamento=None):
+    """
+    Executa `funcao()` em uma thread própria e espera no máximo `prazo` segundos.
+
+    Versão síncrona de `Cancelamento.executar_async` para os clientes bloqueantes: passado
+    o prazo, levanta `TimeoutError`; com `cancelamento`, o cancelamento e o prazo do livro
+    interrompem a espera com `LivroCancelado`. A chamada abandonada termina sozinha (no
+    timeout do próprio cliente) e o seu resultado é descartado.
+    """
+    if not prazo:
+        return funcao()
+    futuro = Future()
+    contexto = contextvars.copy_context()
+
+    def executar():
+        try:
+            futuro.set_result(contexto.run(funcao))
+        except BaseException as e:
+            futuro.set_exception(e)
+
+    threading.Thread(target=executar, name="chamada-com-prazo", daemon=True).start()
+    limite = time.monotonic() + prazo
+    while True:
+        restante = limite - time.monotonic()
+        if restante <= 0:
+            raise TimeoutError(f"Chamada ao modelo passou do prazo de {prazo:.0f}s")
+        try:
+            return futuro.result(timeout=restante if cancelamento is None else min(restante, INTERVALO_VERIFICACAO))
+        except EsperaEsgotada:
+            if cancelamento is not None:
+                cancelamento.verificar()
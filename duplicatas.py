@@ -0,0 +1,95 @@
+import os
+import re
+import hashlib
+
+# Palavras por shingle (sequências de 3 palavras toleram pequenas edições de um parágrafo repetido)
+PALAVRAS_SHINGLE = 3
+# Parágrafos curtos (diálogos, "***") podem se repetir sem problema
+PALAVRAS_MINIMAS_PARAGRAFO = 8
+# Assinatura MinHash de uma permutação só ("one permutation hashing"): o hash de cada shingle cai
+# em um de NUM_PERMUTACOES compartimentos e fica o mínimo de cada um. Um único passe pelos shingles
+# (em vez de um por permutação) mantém a verificação de um livro de 30 mil palavras em milissegundos.
+# NUM_PERMUTACOES = BANDAS x LINHAS_BANDA; 32 bandas de 2 linhas encontram pares com similaridade
+# acima de ~0,2 e a similaridade estimada decide o resto
+NUM_PERMUTACOES = 64
+BANDAS = 32
+LINHAS_BANDA = NUM_PERMUTACOES // BANDAS
+# Similaridade de Jaccard estimada a partir da qual dois parágrafos são considerados quase iguais
+SIMILARIDADE_DUPLICATA = float(os.getenv("SIMILARIDADE_DUPLICATA", "0.5"))
+
+
+def _shingles(texto):
+    palavras = re.sub(r'[^\w\s]', ' ', texto.lower()).split()
+    if len(palavras) < PALAVRAS_MINIMAS_PARAGRAFO:
+        return None
+    return {" ".join(palavras[i:i + PALAVRAS_SHINGLE]) for i in range(len(palavras) - PALAVRAS_SHINGLE + 1)}
+
+
+def assinatura(texto):
+    """Assinatura MinHash do parágrafo (None para parágrafos curtos demais)."""
+    shingles = _shingles(texto)
+    if not shingles:
+        return None
+    minimos = [None] * NUM_PERMUTACOES
+    for shingle in shingles:
+        # blake2b (e não hash()): a mesma assinatura para o mesmo texto em qualquer processo
+        valor = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+        compartimento, valor = valor % NUM_PERMUTACOES, valor // NUM_PERMUTACOES
+        if minimos[compartimento] is None or valor < minimos[compartimento]:
+            minimos[compartimento] = valor
+    # Compartimentos vazios copiam o próximo preenchido (densificação por rotação), marcados pela distância
+    sig = []
+    for posicao in range(NUM_PERMUTACOES):
+        for distancia in range(NUM_PERMUTACOES):
+            valor = minimos[(posicao + distancia) % NUM_PERMUTACOES]
+            if valor is not None:
+                sig.append((distancia, valor))
+                break
+    return tuple(sig)
+
+
+class IndiceDuplicatas:
+    """
+    Índice MinHash/LSH dos parágrafos de um livro, mantido em memória.
+
+    Os parágrafos são adicionados na ordem do livro; `procurar` encontra, entre os
+    já adicionados, o mais parecido com um novo parágrafo. Só os parágrafos que
+    caem na mesma banda de alguma assinatura são comparados, então verificar um
+    livro inteiro leva frações de segundo.
+    """
+
+    def __init__(self, limiar=SIMILARIDADE_DUPLICATA):
+        self.limiar = limiar
+        self.paragrafos = []
+        self.bandas = {}
+
+    def _chaves(self, sig):
+        return [(banda, sig[banda * LINHAS_BANDA:(banda + 1) * LINHAS_BANDA]) for banda in range(BANDAS)]
+
+    def procurar(self, texto, sig=None):
+        """Parágrafo anterior mais parecido com `texto` acima do limiar: `{"capitulo", "paragrafo", "texto", "similaridade"}` ou None."""
+        sig = sig or assinatura(texto)
+        if sig is None:
+            return None
+        candidatos = {posicao for chave in self._chaves(sig) for posicao in self.bandas.get(chave, ())}
+        melhor = None
+        for posicao in candidatos:
+            capitulo, paragrafo, original, sig_original = self.paragrafos[posicao]
+            similaridade = sum(a == b for a, b in zip(sig, sig_original)) / NUM_PERMUTACOES
+            if similaridade >= self.limiar and (melhor is None or similaridade > melhor["similaridade"]):
+                melhor = {"capitulo": capitulo, "paragrafo": paragrafo, "texto": original, "similaridade": similaridade}
+        return melhor
+
+    def adicionar(self, capitulo, paragrafo, texto, sig=None):
+        sig = sig or assinatura(texto)
+        if sig is None:
+            return
+        posicao = len(self.paragrafos)
+        self.paragrafos.append((capitulo, paragrafo, texto, sig))
+        for chave in self._chaves(sig):
+            self.bandas.setdefault(chave, []).append(posicao)
+
+    def adicionar_capitulo(self, capitulo, texto):
+        """Indexa todos os parágrafos de um capítulo sem verificá-los (capítulos retomados)."""
+        for paragrafo, trecho in enumerate(texto.split('\n\n')):
+            self.adicionar(capitulo, paragrafo, trecho)
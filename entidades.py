@@ -0,0 +1,160 @@
+import os
+import re
+import json
+
+from linter import PALAVRAS_NAO_NOMES, sem_acentos
+from resumos import estimar_tokens
+
+ARQUIVO_ENTIDADES = "entidades.json"
+
+TIPO_PERSONAGEM = "personagem"
+TIPO_LUGAR = "lugar"
+TIPO_OBJETO = "objeto"
+
+# Tokens máximos do bloco de continuidade enviado em cada capítulo
+MAX_TOKENS_ENTIDADES = int(os.getenv("ENTIDADES_MAX_TOKENS", "300"))
+# Palavras máximas do último estado guardado de cada entidade
+PALAVRAS_ESTADO = 35
+
+# Nome próprio de até quatro palavras, com "da", "do", "de", "dos", "das" no meio ("Vale do Silêncio")
+PADRAO_ENTIDADE = re.compile(r'\b[A-ZÀ-Ý][a-zà-ÿ]+(?:\s+(?:d[aeo]s?\s+)?[A-ZÀ-Ý][a-zà-ÿ]+){0,3}\b')
+# Fim de frase, quebra de linha ou travessão de diálogo (a palavra seguinte tem maiúscula por gramática)
+PADRAO_FRASE = re.compile(r'(?<=[.!?…:])\s+|\n+|\s*[—–]\s*')
+# Verbos de fala ou ação típicos de personagem, logo antes ou logo depois do nome
+PADRAO_FALA = re.compile(r'\b(disse|perguntou|respondeu|gritou|sussurrou|falou|murmurou|sorriu|pensou|exclamou)\b',
+                         re.IGNORECASE)
+# Palavras antes do nome que indicam lugar ou objeto
+PREPOSICOES_LUGAR = {"em", "no", "na", "nos", "nas", "pelo", "pela", "ate", "rumo", "para", "ao", "dentro", "perto"}
+ARTIGOS_OBJETO = {"o", "a", "os", "as", "um", "uma", "seu", "sua"}
+# Palavras de ligação dentro de um nome composto ("Vale do Silêncio"), que não identificam a entidade
+PALAVRAS_LIGACAO_NOME = {"da", "de", "do", "das", "dos", "e"}
+# Palavras com maiúscula que não são entidades (início de frase, pronomes, tratamentos)
+PALAVRAS_IGNORADAS = PALAVRAS_NAO_NOMES | {
+    "ele", "ela", "eles", "elas", "eu", "nos", "voce", "voces", "senhor", "senhora", "dona", "seu", "deus",
+    "mas", "quando", "entao", "depois", "antes", "enquanto", "porque", "como", "onde", "sim", "nao", "talvez",
+    "segunda", "terca", "quarta", "quinta", "sexta", "sabado", "domingo", "fim", "final", "continua"
+}
+
+
+def _palavras_do_nome(nome):
+    """Partes significativas de um nome ("Vale do Silêncio" -> {"Vale", "Silêncio"}; nomes curtos como "Ana" também contam)."""
+    return {parte for parte in nome.split() if sem_acentos(parte) not in PALAVRAS_LIGACAO_NOME}
+
+
+class IndiceEntidades:
+    """
+    Índice local de personagens, lugares e objetos do livro, salvo em `entidades.json`.
+
+    É atualizado depois de cada capítulo só com processamento de texto (sem chamadas
+    ao modelo): cada nome próprio guarda o tipo mais provável, o número de menções,
+    o primeiro e o último capítulo em que apareceu e a última frase em que foi
+    citado (o seu último estado conhecido). O contexto de um capítulo recebe apenas
+    as entradas citadas no seu trecho da estrutura, dentro de `max_tokens`, então a
+    continuidade custa sempre algumas centenas de tokens, qualquer que seja o tamanho do livro.
+    """
+
+    def __init__(self, livro_dir, personagens=(), max_tokens=MAX_TOKENS_ENTIDADES):
+        self.arquivo = os.path.join(livro_dir, ARQUIVO_ENTIDADES)
+        self.max_tokens = max_tokens
+        self.entidades = {}
+        self.capitulos = set()
+        if os.path.exists(self.arquivo):
+            try:
+                with open(self.arquivo, 'r', encoding='utf-8') as f:
+                    dados = json.load(f)
+                self.entidades = dados.get("entidades", {})
+                self.capitulos = set(dados.get("capitulos", []))
+            except Exception as e:
+                print(f"Erro ao ler {self.arquivo}: {e}")
+        # Personagens da estrutura entram no índice mesmo antes de aparecerem no texto
+        for nome in personagens:
+            entidade = self._entidade(nome)
+            if not entidade["na_estrutura"]:
+                entidade["votos"][TIPO_PERSONAGEM] += 3
+                entidade["na_estrutura"] = True
+        # Partes de nomes compostos da estrutura apontam para o nome completo ("Mariana" -> "Mariana Souza")
+        self.apelidos = {parte: nome for nome, entidade in self.entidades.items() if entidade["na_estrutura"]
+                         for parte in _palavras_do_nome(nome) if parte != nome}
+
+    def salvar(self):
+        with open(self.arquivo, 'w', encoding='utf-8') as f:
+            json.dump({"capitulos": sorted(self.capitulos), "entidades": self.entidades}, f, ensure_ascii=False, indent=2)
+
+    def _entidade(self, nome):
+        return self.entidades.setdefault(nome, {
+            "votos": {TIPO_PERSONAGEM: 0, TIPO_LUGAR: 0, TIPO_OBJETO: 0},
+            "mencoes": 0, "primeiro_capitulo": None, "ultimo_capitulo": None, "estado": "", "na_estrutura": False
+        })
+
+    def atualizar(self, numero, texto):
+        """Indexa o capítulo `numero` (uma única vez) e salva o índice."""
+        if numero in self.capitulos or texto.startswith("[ERRO NO CAPÍTULO"):
+            return
+        for frase in PADRAO_FRASE.split(texto):
+            frase = frase.strip(' "“”«»*#')
+            if not frase:
+                continue
+            for correspondencia in PADRAO_ENTIDADE.finditer(frase):
+                palavras_nome = correspondencia.group(0).split()
+                anteriores = [sem_acentos(p) for p in frase[:correspondencia.start()].split()[-2:]]
+                # Preposição ou artigo com maiúscula no início da frase ("No Vale do Silêncio")
+                while len(palavras_nome) > 1 and sem_acentos(palavras_nome[0]) in PREPOSICOES_LUGAR | ARTIGOS_OBJETO:
+                    anteriores.append(sem_acentos(palavras_nome.pop(0)))
+                nome = " ".join(palavras_nome)
+                if sem_acentos(palavras_nome[0]) in PALAVRAS_IGNORADAS:
+                    continue
+                nome = self.apelidos.get(nome, nome)
+                # No início da frase a maiúscula é gramatical: só conta nome já conhecido ou composto
+                if correspondencia.start() == 0 and nome not in self.entidades and len(palavras_nome) == 1:
+                    continue
+                entidade = self._entidade(nome)
+                if PREPOSICOES_LUGAR & set(anteriores[-2:]):
+                    entidade["votos"][TIPO_LUGAR] += 1
+                elif anteriores and anteriores[-1] in ARTIGOS_OBJETO:
+                    entidade["votos"][TIPO_OBJETO] += 1
+                if PADRAO_FALA.search(frase[max(0, correspondencia.start() - 20):correspondencia.end() + 20]):
+                    entidade["votos"][TIPO_PERSONAGEM] += 1
+                entidade["mencoes"] += 1
+                entidade["primeiro_capitulo"] = entidade["primeiro_capitulo"] or numero
+                entidade["ultimo_capitulo"] = numero
+                palavras = frase.split()
+                entidade["estado"] = " ".join(palavras[:PALAVRAS_ESTADO]) + (" [...]" if len(palavras) > PALAVRAS_ESTADO else "")
+        self.capitulos.add(numero)
+        self.salvar()
+
+    def tipo(self, nome):
+        """Tipo mais votado da entidade (personagem em caso de empate: a maioria dos nomes próprios de uma história)."""
+        votos = self.entidades[nome]["votos"]
+        return max((TIPO_PERSONAGEM, TIPO_LUGAR, TIPO_OBJETO), key=lambda t: votos[t])
+
+    def relevantes(self, trecho):
+        """Entidades citadas no trecho da estrutura do capítulo, das mais recentes às mais antigas."""
+        palavras_trecho = set(re.findall(r'\w+', trecho or ""))
+        encontradas = [
+            nome for nome, entidade in self.entidades.items()
+            # Nomes vistos uma única vez costumam ser ruído (maiúscula de ênfase, início de frase)
+            if (entidade["mencoes"] >= 2 or entidade["na_estrutura"]) and _palavras_do_nome(nome) & palavras_trecho
+        ]
+        return sorted(encontradas, key=lambda n: (self.entidades[n]["ultimo_capitulo"] or 0, self.entidades[n]["mencoes"]),
+                      reverse=True)
+
+    def montar_contexto(self, trecho):
+        """Bloco de continuidade com as entidades relevantes para o trecho, limitado a `max_tokens`."""
+        linhas = []
+        tokens = 0
+        for nome in self.relevantes(trecho):
+            entidade = self.entidades[nome]
+            if entidade["ultimo_capitulo"] is None:
+                # Personagem da estrutura que ainda não apareceu no texto
+                linha = f"- {nome} ({self.tipo(nome)}): ainda não apareceu na história."
+            else:
+                linha = (f"- {nome} ({self.tipo(nome)}, visto pela última vez no capítulo {entidade['ultimo_capitulo']}): "
+                         f"{entidade['estado']}")
+            tokens_linha = estimar_tokens(linha)
+            if tokens + tokens_linha > self.max_tokens:
+                break
+            linhas.append(linha)
+            tokens += tokens_linha
+        if not linhas:
+            return ""
+        return "\nCONTINUIDADE (último estado conhecido dos personagens, lugares e objetos deste capítulo):\n" + "\n".join(linhas) + "\n"
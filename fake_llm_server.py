@@ -0,0 +1,314 @@
+import re
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Partes das frases das respostas falsas: cada frase sorteia uma de cada lista, para que parágrafos
+# e respostas diferentes não se repitam (texto repetido dispararia a revisão de parágrafos duplicados)
+MOMENTOS = ("Ao amanhecer", "Na manhã seguinte", "Quando a chuva parou", "Pouco antes do meio-dia",
+            "Ao cair da tarde", "Depois do jantar", "No meio da noite", "Com a primeira luz do dia",
+            "Enquanto o sino tocava", "Naquele inverno")
+SUJEITOS = ("Marina", "Tomás", "a velha guardiã", "o menino do moinho", "a capitã do barco", "o cartógrafo",
+            "a irmã mais nova", "o ferreiro da vila", "a professora", "o viajante de casaco cinza")
+ACOES = ("atravessou", "examinou", "contornou", "desenhou", "escondeu", "reencontrou", "abandonou", "vigiou",
+         "consertou", "procurou")
+OBJETOS = ("a ponte de pedra", "o mapa rasgado", "a lanterna apagada", "a porta do celeiro", "o poço seco",
+           "a trilha das corujas", "o baú de cobre", "a carta sem remetente", "o relógio da praça",
+           "a escada do farol")
+COMPLEMENTOS = ("sem dizer uma palavra", "com as mãos trêmulas", "enquanto o vento soprava do rio",
+                "como se alguém a observasse", "antes que os outros acordassem", "lembrando a promessa antiga",
+                "apesar do cansaço", "ouvindo o canto distante das corujas", "sob o olhar desconfiado dos vizinhos",
+                "sem saber o que encontraria")
+FRASES_POR_PARAGRAFO = (3, 5)
+
+
+def sortear_frase(frases=None):
+    """Uma frase nova (ou, com `frases`, uma das frases do texto configurado)."""
+    if frases:
+        return random.choice(frases)
+    return (f"{random.choice(MOMENTOS)}, {random.choice(SUJEITOS)} {random.choice(ACOES)} "
+            f"{random.choice(OBJETOS)} {random.choice(COMPLEMENTOS)}.")
+
+# Trechos que identificam o pedido de estrutura do livro (respondido com um cabeçalho "Capítulo N" por capítulo)
+MARCADORES_ESTRUTURA = ("Criar a estrutura do livro",)
+
+# Cache de prefixo simulado (como o da OpenAI): blocos de 128 tokens, a partir de 1024 tokens de prefixo
+CARACTERES_BLOCO_CACHE = 128 * 4
+CARACTERES_MINIMOS_CACHE = 1024 * 4
+MAXIMO_PREFIXOS_CACHE = 100000
+
+# Aproximação usada para converter palavras em tokens
+TOKENS_POR_PALAVRA = 1.3
+
+
+def sortear_latencia(especificacao):
+    """
+    Sorteia a latência até o primeiro token, em segundos, a partir de uma especificação como
+    `fixa:0.5`, `uniforme:0.2:1.5`, `normal:1.0:0.3` ou `lognormal:0.0:0.5`.
+    """
+    partes = especificacao.split(":")
+    tipo, valores = partes[0], [float(v) for v in partes[1:]]
+    if tipo == "fixa":
+        return valores[0]
+    if tipo == "uniforme":
+        return random.uniform(valores[0], valores[1])
+    if tipo == "normal":
+        return max(0.0, random.gauss(valores[0], valores[1]))
+    if tipo == "lognormal":
+        return random.lognormvariate(valores[0], valores[1])
+    raise ValueError(f"Distribuição de latência desconhecida: {especificacao}")
+
+
+def estimar_tokens(texto):
+    return max(1, len(texto) // 4)
+
+
+class ConfiguracaoFalsa:
+    """Comportamento do servidor falso (latência, velocidade, limites e texto das respostas)."""
+
+    def __init__(self, latencia="lognormal:-0.7:0.5", tokens_por_segundo=80.0, taxa_429=0.0, retry_after_ms=500,
+                 tokens_resposta=900, rpm=5000, tpm=2000000, texto=None):
+        self.latencia = latencia
+        self.tokens_por_segundo = tokens_por_segundo
+        self.taxa_429 = taxa_429
+        self.retry_after_ms = retry_after_ms
+        self.tokens_resposta = tokens_resposta
+        self.rpm = rpm
+        self.tpm = tpm
+        # Sem texto, as frases são sorteadas; com texto, os parágrafos sorteiam as frases dele
+        self.frases = re.split(r'(?<=[.!?])\s+', " ".join(texto.split())) if texto else None
+        self._lock = threading.Lock()
+        self._prefixos = set()
+        self.zerar_contadores()
+
+    def tokens_em_cache(self, prompt):
+        """Tokens do maior prefixo do prompt (em blocos) já visto em uma requisição anterior."""
+        blocos = len(prompt) // CARACTERES_BLOCO_CACHE
+        em_cache = 0
+        with self._lock:
+            if len(self._prefixos) > MAXIMO_PREFIXOS_CACHE:
+                self._prefixos.clear()
+            for n in range(1, blocos + 1):
+                prefixo = hash(prompt[:n * CARACTERES_BLOCO_CACHE])
+                if prefixo in self._prefixos:
+                    em_cache = n * CARACTERES_BLOCO_CACHE
+                else:
+                    self._prefixos.add(prefixo)
+        return em_cache // 4 if em_cache >= CARACTERES_MINIMOS_CACHE else 0
+
+    def zerar_contadores(self):
+        with self._lock:
+            self.requisicoes = 0
+            self.respostas_429 = 0
+            self.tokens_recebidos = 0
+
+    def contar(self, limitada, tokens_prompt=0):
+        with self._lock:
+            self.requisicoes += 1
+            self.tokens_recebidos += tokens_prompt
+            if limitada:
+                self.respostas_429 += 1
+
+
+def _texto_com_tokens(config, tokens, cortado=False):
+    """
+    Parágrafos com frases sorteadas a cada chamada, somando cerca de `tokens` tokens.
+
+    `cortado` simula o corte por `max_tokens`: o texto para no meio de uma frase. Sem ele,
+    o texto termina na última frase completa que cabe no limite (ao menos uma frase).
+    """
+    restantes = max(1, int(tokens / TOKENS_POR_PALAVRA))
+    paragrafos = []
+    while restantes > 0:
+        frases = []
+        for _ in range(random.randint(*FRASES_POR_PARAGRAFO)):
+            palavras = sortear_frase(config.frases).split()
+            if len(palavras) > restantes:
+                if cortado or not (paragrafos or frases):
+                    frases.append(" ".join(palavras[:restantes]) if cortado else " ".join(palavras))
+                restantes = 0
+                break
+            frases.append(" ".join(palavras))
+            restantes -= len(palavras)
+        if frases:
+            paragrafos.append(" ".join(frases))
+    return "\n\n".join(paragrafos)
+
+
+def montar_resposta(mensagens, max_tokens, config, formato_json=False):
+    """
+    Gera o texto da resposta falsa de acordo com o tipo de pedido e o `finish_reason`
+    ("length" quando o texto foi cortado por `max_tokens`).
+    """
+    prompt = "\n".join(str(m.get("content") or "") for m in mensagens)
+    tokens = min(max_tokens or config.tokens_resposta, config.tokens_resposta)
+    finish_reason = "length" if tokens < config.tokens_resposta else "stop"
+    numero = re.search(r"(\d+)\s+cap[íi]tulos", prompt)
+    num_capitulos = int(numero.group(1)) if numero else 12
+
+    if formato_json or "JSON" in prompt:
+        capitulos = [{"titulo": f"A Jornada {i}", "sinopse": _texto_com_tokens(config, 40)}
+                     for i in range(1, num_capitulos + 1)]
+        personagens = [{"nome": f"Personagem {i}", "descricao": _texto_com_tokens(config, 15)} for i in range(1, 4)]
+        texto = json.dumps({"personagens": personagens, "titulos": [c["titulo"] for c in capitulos],
+                            "capitulos": capitulos}, ensure_ascii=False)
+        finish_reason = "stop"
+    elif any(marcador in prompt for marcador in MARCADORES_ESTRUTURA):
+        texto = f"Título: A Jornada\n\nPersonagens:\n{_texto_com_tokens(config, 60)}\n\n" + "\n\n".join(
+            f"Capítulo {i}: A Jornada {i}\n{_texto_com_tokens(config, 40)}" for i in range(1, num_capitulos + 1))
+        finish_reason = "stop"
+    else:
+        texto = _texto_com_tokens(config, tokens, cortado=finish_reason == "length")
+
+    # Agentes da CrewAI esperam o formato ReAct com "Final Answer:"
+    if "Final Answer" in prompt:
+        texto = f"Thought: I now know the final answer\nFinal Answer: {texto}"
+    return texto, finish_reason
+
+
+class ManipuladorFalso(BaseHTTPRequestHandler):
+    """Implementa `POST /v1/chat/completions` (com e sem streaming) no formato da API da OpenAI."""
+
+    config = ConfiguracaoFalsa()
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, formato, *args):
+        pass
+
+    def _cabecalhos_limite(self):
+        self.send_header("x-ratelimit-limit-requests", str(self.config.rpm))
+        self.send_header("x-ratelimit-limit-tokens", str(self.config.tpm))
+
+    def _enviar_json(self, status, dados, extras=None):
+        corpo = json.dumps(dados, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(corpo)))
+        self._cabecalhos_limite()
+        for nome, valor in (extras or {}).items():
+            self.send_header(nome, valor)
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._enviar_json(404, {"error": {"message": "Rota não encontrada", "type": "invalid_request_error"}})
+            return
+        tamanho = int(self.headers.get("Content-Length", 0))
+        pedido = json.loads(self.rfile.read(tamanho) or b"{}")
+
+        mensagens = pedido.get("messages", [])
+        tokens_prompt = sum(estimar_tokens(str(m.get("content") or "")) for m in mensagens)
+        limitada = random.random() < self.config.taxa_429
+        self.config.contar(limitada, tokens_prompt)
+        if limitada:
+            self._enviar_json(429, {"error": {"message": "Rate limit reached (servidor falso)", "type": "requests"}},
+                              {"retry-after-ms": str(self.config.retry_after_ms)})
+            return
+
+        formato_json = (pedido.get("response_format") or {}).get("type") == "json_object"
+        texto, finish_reason = montar_resposta(mensagens, pedido.get("max_tokens") or pedido.get("max_completion_tokens"),
+                                self.config, formato_json)
+        tokens_resposta = int(len(texto.split()) * TOKENS_POR_PALAVRA)
+        uso = {"prompt_tokens": tokens_prompt, "completion_tokens": tokens_resposta,
+               "total_tokens": tokens_prompt + tokens_resposta,
+               "prompt_tokens_details": {"cached_tokens": min(tokens_prompt, self.config.tokens_em_cache(
+                   "".join(str(m.get("content") or "") for m in mensagens)))}}
+        identificador = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        modelo = pedido.get("model", "gpt-4o-mini")
+
+        time.sleep(sortear_latencia(self.config.latencia))
+        if pedido.get("stream"):
+            self._transmitir(identificador, modelo, texto, finish_reason, uso,
+                             (pedido.get("stream_options") or {}).get("include_usage"))
+            return
+
+        time.sleep(tokens_resposta / self.config.tokens_por_segundo)
+        self._enviar_json(200, {
+            "id": identificador,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": modelo,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": texto}, "finish_reason": finish_reason}],
+            "usage": uso
+        })
+
+    def _transmitir(self, identificador, modelo, texto, finish_reason, uso, incluir_uso):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self._cabecalhos_limite()
+        self.end_headers()
+        self.close_connection = True
+
+        def evento(delta, finish_reason=None, usage=None, choices=True):
+            dados = {"id": identificador, "object": "chat.completion.chunk", "created": int(time.time()), "model": modelo,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if choices else []}
+            if usage:
+                dados["usage"] = usage
+            self.wfile.write(f"data: {json.dumps(dados, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        # Envia em trechos de ~8 palavras, no ritmo de tokens por segundo configurado
+        palavras = texto.split(" ")
+        intervalo = 8 * TOKENS_POR_PALAVRA / self.config.tokens_por_segundo
+        evento({"role": "assistant", "content": ""})
+        for inicio in range(0, len(palavras), 8):
+            trecho = " ".join(palavras[inicio:inicio + 8])
+            evento({"content": trecho if inicio == 0 else " " + trecho})
+            time.sleep(intervalo)
+        evento({}, finish_reason)
+        if incluir_uso:
+            evento(None, usage=uso, choices=False)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def iniciar_servidor(config=None, porta=0, host="127.0.0.1"):
+    """Inicia o servidor falso em uma thread e retorna (servidor, url_base). `porta=0` escolhe uma porta livre."""
+    manipulador = type("ManipuladorConfigurado", (ManipuladorFalso,), {"config": config or ConfiguracaoFalsa()})
+    servidor = ThreadingHTTPServer((host, porta), manipulador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="servidor-llm-falso", daemon=True).start()
+    return servidor, f"http://{host}:{servidor.server_address[1]}/v1"
+
+
+def adicionar_argumentos(parser):
+    """Argumentos de linha de comando que configuram o servidor falso (compartilhados com o benchmark)."""
+    parser.add_argument("--latencia", default="lognormal:-0.7:0.5",
+                        help="Distribuição da latência até o primeiro token (fixa:S, uniforme:A:B, normal:M:D, lognormal:MU:SIGMA)")
+    parser.add_argument("--tokens-por-segundo", type=float, default=80.0, help="Velocidade de geração dos tokens da resposta")
+    parser.add_argument("--taxa-429", type=float, default=0.0, help="Fração das requisições respondidas com 429")
+    parser.add_argument("--retry-after-ms", type=int, default=500, help="Valor do cabeçalho retry-after-ms nas respostas 429")
+    parser.add_argument("--tokens-resposta", type=int, default=900, help="Tokens de cada resposta de texto (limitado por max_tokens)")
+    parser.add_argument("--rpm", type=int, default=5000, help="Limite de requisições por minuto anunciado nos cabeçalhos")
+    parser.add_argument("--tpm", type=int, default=2000000, help="Limite de tokens por minuto anunciado nos cabeçalhos")
+    parser.add_argument("--texto", help="Arquivo com as frases usadas nas respostas (padrão: frases sorteadas)")
+
+
+def configuracao_dos_argumentos(args):
+    texto = None
+    if args.texto:
+        with open(args.texto, 'r', encoding='utf-8') as f:
+            texto = f.read()
+    return ConfiguracaoFalsa(args.latencia, args.tokens_por_segundo, args.taxa_429, args.retry_after_ms,
+                             args.tokens_resposta, args.rpm, args.tpm, texto)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor local compatível com a API da OpenAI, para testes e benchmarks sem custo.")
+    parser.add_argument("--porta", type=int, default=8099, help="Porta do servidor")
+    adicionar_argumentos(parser)
+    args = parser.parse_args()
+    servidor, url = iniciar_servidor(configuracao_dos_argumentos(args), args.porta)
+    print(f"Servidor LLM falso em {url} (use OPENAI_BASE_URL={url})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        servidor.shutdown()
@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+
+CAMINHO_FILA = os.getenv("JOB_QUEUE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "fila_livros.sqlite3"))
+
+# Um job "executando" sem sinal de vida por mais que isso volta para a fila
+TIMEOUT_HEARTBEAT = int(os.getenv("JOB_HEARTBEAT_TIMEOUT", "300"))
+MAX_TENTATIVAS = int(os.getenv("JOB_MAX_TENTATIVAS", "3"))
+
+STATUS_PENDENTE = "pendente"
+STATUS_EXECUTANDO = "executando"
+STATUS_CONCLUIDO = "concluido"
+STATUS_ERRO = "erro"
+STATUS_CANCELADO = "cancelado"
+
+
+class FilaLivros:
+    """
+    Fila persistente (SQLite) de jobs de geração de livros.
+
+    A interface apenas enfileira jobs e consulta seu status; os processos de
+    `worker.py` reservam os jobs, executam a geração e registram o progresso.
+    Como o estado fica em disco, uma sessão do navegador que cai não perde o livro.
+    """
+
+    def __init__(self, caminho=CAMINHO_FILA):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(caminho, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                tipo TEXT NOT NULL,
+                status TEXT NOT NULL,
+                parametros TEXT NOT NULL,
+                usuario_id TEXT,
+                etapa INTEGER DEFAULT 0,
+                mensagem TEXT DEFAULT '',
+                resultado TEXT,
+                erro TEXT,
+                worker TEXT,
+                tentativas INTEGER DEFAULT 0,
+                criado_em REAL NOT NULL,
+                iniciado_em REAL,
+                atualizado_em REAL,
+                concluido_em REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, criado_em);
+            CREATE TABLE IF NOT EXISTS trechos (
+                job_id TEXT NOT NULL,
+                capitulo INTEGER NOT NULL,
+                texto TEXT NOT NULL,
+                concluido INTEGER DEFAULT 0,
+                atualizado_em REAL NOT NULL,
+                PRIMARY KEY (job_id, capitulo)
+            );
+            CREATE TABLE IF NOT EXISTS segredos (
+                job_id TEXT PRIMARY KEY,
+                api_key TEXT NOT NULL
+            );
+        """)
+
+    def enfileirar(self, tipo, parametros, usuario_id=None, api_key=None):
+        """
+        Adiciona um job à fila e retorna seu id.
+
+        A `api_key` do usuário fica fora dos `parametros` (que a interface lê e exibe),
+        em uma tabela à parte, e é apagada assim que o job termina, de qualquer forma.
+        """
+        job_id = uuid.uuid4().hex
+        agora = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, tipo, status, parametros, usuario_id, criado_em, atualizado_em) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, tipo, STATUS_PENDENTE, json.dumps(parametros, ensure_ascii=False), usuario_id, agora, agora)
+            )
+            if api_key:
+                self._conn.execute("INSERT INTO segredos (job_id, api_key) VALUES (?, ?)", (job_id, api_key))
+        return job_id
+
+    def obter_api_key(self, job_id):
+        """Chave da API informada para o job (None se não houver ou se o job já terminou)."""
+        with self._lock:
+            linha = self._conn.execute("SELECT api_key FROM segredos WHERE job_id = ?", (job_id,)).fetchone()
+        return linha["api_key"] if linha else None
+
+    def _apagar_segredos(self):
+        """Apaga as chaves dos jobs que não estão mais pendentes nem em execução (chamado com o lock)."""
+        self._conn.execute(
+            "DELETE FROM segredos WHERE job_id NOT IN (SELECT id FROM jobs WHERE status IN (?, ?))",
+            (STATUS_PENDENTE, STATUS_EXECUTANDO)
+        )
+
+    def reservar(self, worker_id):
+        """Reserva atomicamente o job pendente mais antigo para o worker. Retorna None se não houver."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                linha = self._conn.execute(
+                    "SELECT id FROM jobs WHERE status = ? ORDER BY criado_em LIMIT 1", (STATUS_PENDENTE,)
+                ).fetchone()
+                if linha is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                agora = time.time()
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, worker = ?, tentativas = tentativas + 1, iniciado_em = ?, atualizado_em = ? WHERE id = ?",
+                    (STATUS_EXECUTANDO, worker_id, agora, agora, linha["id"])
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self.obter(linha["id"])
+
+    def atualizar_progresso(self, job_id, etapa, mensagem):
+        """Registra o progresso do job (também serve de sinal de vida do worker)."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET etapa = ?, mensagem = ?, atualizado_em = ? WHERE id = ?",
+                (etapa, mensagem or "", time.time(), job_id)
+            )
+
+    def sinal_de_vida(self, job_id):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET atualizado_em = ? WHERE id = ?", (time.time(), job_id))
+
+    def salvar_trecho(self, job_id, capitulo, texto, concluido=False):
+        """Grava o texto parcial (em streaming) de um capítulo do job."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO trechos (job_id, capitulo, texto, concluido, atualizado_em) VALUES (?, ?, ?, ?, ?)",
+                (job_id, capitulo, texto, int(concluido), time.time())
+            )
+
+    def obter_trechos(self, job_id, ignorar=()):
+        """
+        Retorna {capitulo: (texto, concluido)} com o texto parcial de cada capítulo do job.
+
+        Os capítulos em `ignorar` (ex.: os já concluídos e exibidos) não são lidos.
+        """
+        ignorar = list(ignorar)
+        filtro = f" AND capitulo NOT IN ({', '.join('?' * len(ignorar))})" if ignorar else ""
+        with self._lock:
+            linhas = self._conn.execute(
+                f"SELECT capitulo, texto, concluido FROM trechos WHERE job_id = ?{filtro} ORDER BY capitulo",
+                (job_id, *ignorar)
+            ).fetchall()
+        return {linha["capitulo"]: (linha["texto"], bool(linha["concluido"])) for linha in linhas}
+
+    def cancelar(self, job_id):
+        """
+        Pede o cancelamento do job. Um job pendente sai da fila na hora; um job em
+        execução é interrompido pelo worker na próxima verificação (e o livro fica
+        retomável a partir dos capítulos já salvos). Retorna False se o job já terminou.
+        """
+        agora = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, erro = ?, atualizado_em = ? WHERE id = ? AND status IN (?, ?)",
+                (STATUS_CANCELADO, "Cancelado pelo usuário", agora, job_id, STATUS_PENDENTE, STATUS_EXECUTANDO)
+            )
+            self._apagar_segredos()
+        return cursor.rowcount > 0
+
+    def cancelamento_pedido(self, job_id):
+        with self._lock:
+            linha = self._conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return linha is not None and linha["status"] == STATUS_CANCELADO
+
+    def concluir(self, job_id, resultado):
+        self._finalizar(job_id, STATUS_CONCLUIDO, resultado=resultado)
+
+    def falhar(self, job_id, erro):
+        self._finalizar(job_id, STATUS_ERRO, erro=erro)
+
+    def registrar_cancelamento(self, job_id, motivo):
+        """Finaliza como cancelado um job interrompido pelo worker (pedido do usuário ou prazo esgotado)."""
+        self._finalizar(job_id, STATUS_CANCELADO, erro=motivo)
+
+    def _finalizar(self, job_id, status, resultado=None, erro=None):
+        agora = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, resultado = ?, erro = ?, atualizado_em = ?, concluido_em = ? WHERE id = ?",
+                (status, resultado, erro, agora, agora, job_id)
+            )
+            # A chave da API só é necessária enquanto o job roda; não a mantemos em disco depois
+            self._apagar_segredos()
+            # Os textos parciais só servem para acompanhar o job em andamento
+            self._conn.execute("DELETE FROM trechos WHERE job_id = ?", (job_id,))
+
+    def recuperar_orfaos(self, timeout=TIMEOUT_HEARTBEAT, max_tentativas=MAX_TENTATIVAS):
+        """Devolve à fila os jobs cujo worker parou de dar sinal de vida (ou os marca como erro)."""
+        limite = time.time() - timeout
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, erro = ? WHERE status = ? AND atualizado_em < ? AND tentativas >= ?",
+                (STATUS_ERRO, "Worker interrompido muitas vezes", STATUS_EXECUTANDO, limite, max_tentativas)
+            )
+            self._apagar_segredos()
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, worker = NULL WHERE status = ? AND atualizado_em < ?",
+                (STATUS_PENDENTE, STATUS_EXECUTANDO, limite)
+            )
+            return cursor.rowcount
+
+    def obter(self, job_id):
+        with self._lock:
+            linha = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if linha is None:
+            return None
+        job = dict(linha)
+        job["parametros"] = json.loads(job["parametros"])
+        return job
+
+    def posicao(self, job_id):
+        """Quantos jobs pendentes estão à frente deste na fila."""
+        with self._lock:
+            linha = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND criado_em < (SELECT criado_em FROM jobs WHERE id = ?)",
+                (STATUS_PENDENTE, job_id)
+            ).fetchone()
+        return linha[0]
+
+    def job_ativo_do_usuario(self, usuario_id):
+        """Retorna o job pendente ou em execução mais recente do usuário, se houver."""
+        if not usuario_id:
+            return None
+        with self._lock:
+            linha = self._conn.execute(
+                "SELECT id FROM jobs WHERE usuario_id = ? AND status IN (?, ?) ORDER BY criado_em DESC LIMIT 1",
+                (usuario_id, STATUS_PENDENTE, STATUS_EXECUTANDO)
+            ).fetchone()
+        return self.obter(linha["id"]) if linha else None
@@ -0,0 +1,79 @@
+import os
+import json
+import tempfile
+import threading
+
+
+class Diario:
+    """
+    Diário append-only em JSONL.
+
+    Cada evento recebe um número de sequência crescente e é acrescentado ao fim
+    do arquivo (com fsync), sem reescrever o que já foi gravado. Uma linha final
+    incompleta, deixada por uma queda no meio da escrita, é cortada ao abrir o
+    diário, para que o próximo evento não seja colado a ela.
+    """
+
+    def __init__(self, caminho, seq_inicial=0):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        self._reparar_final()
+        eventos = self.ler()
+        self.seq = max([seq_inicial] + [e.get("seq", 0) for e in eventos])
+
+    def _reparar_final(self):
+        """
+        Garante que o arquivo termine em quebra de linha: uma última linha sem "\n"
+        é removida se estiver incompleta, ou recebe o "\n" se for um evento válido.
+        """
+        if not os.path.exists(self.caminho):
+            return
+        with open(self.caminho, 'rb+') as f:
+            conteudo = f.read()
+            if not conteudo or conteudo.endswith(b"\n"):
+                return
+            inicio = conteudo.rfind(b"\n") + 1
+            try:
+                json.loads(conteudo[inicio:].decode('utf-8'))
+                f.write(b"\n")
+            except ValueError:
+                f.truncate(inicio)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def registrar(self, evento):
+        """Acrescenta o evento ao diário e retorna seu número de sequência."""
+        with self._lock:
+            self.seq += 1
+            evento = dict(evento, seq=self.seq)
+            with open(self.caminho, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(evento, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            return self.seq
+
+    def ler(self, apos_seq=0):
+        """Retorna os eventos com sequência maior que `apos_seq`."""
+        if not os.path.exists(self.caminho):
+            return []
+        eventos = []
+        with open(self.caminho, 'r', encoding='utf-8') as f:
+            for linha in f:
+                linha = linha.strip()
+                if not linha:
+                    continue
+                try:
+                    evento = json.loads(linha)
+                except ValueError:
+                    continue
+                if evento.get("seq", 0) > apos_seq:
+                    eventos.append(evento)
+        return eventos
+
+    def truncar(self):
+        """Esvazia o diário (após uma compactação) trocando o arquivo de forma atômica."""
+        with self._lock:
+            diretorio = os.path.dirname(self.caminho) or "."
+            fd, temporario = tempfile.mkstemp(dir=diretorio, prefix=".tmp_", suffix=".jsonl")
+            os.close(fd)
+            os.replace(temporario, self.caminho)
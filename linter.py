@@ -0,0 +1,192 @@
+import re
+import difflib
+import unicodedata
+
+from duplicatas import IndiceDuplicatas, assinatura
+
+# Tipos de problema encontrados pelas verificações locais
+PROBLEMA_REPETIDO = "paragrafo_repetido"
+PROBLEMA_CABECALHO = "cabecalho_no_texto"
+PROBLEMA_NOME = "nome_divergente"
+PROBLEMA_CORTADO = "final_cortado"
+
+# "Capítulo N" no início de um parágrafo (com "#", "**" ou numeração na frente)
+PADRAO_CABECALHO = re.compile(r'^[#*\s\d.-]*cap[íi]tulo\s+\d+\b[^\n]*', re.IGNORECASE)
+# Palavras com inicial maiúscula (candidatas a nome próprio)
+PADRAO_NOME = re.compile(r'\b[A-ZÀ-Ý][a-zà-ÿ]{2,}\b')
+# Nome no início de uma linha da lista de personagens: "- Ana:", "**Ana Souza** -", "1. Ana (12 anos)"
+PADRAO_LINHA_PERSONAGEM = re.compile(
+    r'^[\s\-*•\d.]*\**\s*(?:nome:\s*)?([A-ZÀ-Ý][a-zà-ÿ]+(?:\s+(?:d[aeo]s?\s+)?[A-ZÀ-Ý][a-zà-ÿ]+){0,2})\**\s*[:\-–—(,]',
+    re.MULTILINE
+)
+# Palavras que abrem linhas da estrutura e não são personagens
+PALAVRAS_NAO_NOMES = {"titulo", "subtitulo", "personagens", "personagem", "arco", "narrativo", "capitulo", "sumario",
+                      "resumo", "genero", "estilo", "publico", "tema", "descricao", "protagonista", "antagonista",
+                      "introducao", "conclusao", "parte", "estrutura", "livro", "idade", "aparencia", "personalidade"}
+
+# Rótulos das linhas de descrição de um personagem ("- Física: alta e magra"), que não são nomes
+ROTULOS_DESCRICAO = {"fisica", "fisico", "fisicas", "psicologica", "psicologico", "psicologicas", "caracteristicas",
+                     "historia", "motivacao", "motivacoes", "papel", "objetivo", "perfil", "funcao", "conflito"}
+
+# Parágrafo só com o cabeçalho (removido localmente, sem chamar o modelo)
+PALAVRAS_MAXIMAS_CABECALHO = 12
+# Semelhança mínima (difflib) para considerar uma palavra uma grafia divergente de um nome; em nomes
+# curtos, em que uma letra trocada já derruba a semelhança, vale a distância de edição
+SEMELHANCA_NOME = 0.85
+LETRAS_NOME_CURTO = 6
+# Uma grafia divergente só é apontada se aparecer esse número de vezes no capítulo (no meio de frases):
+# uma ocorrência isolada costuma ser outra palavra, e não vale uma reescrita
+MINIMO_OCORRENCIAS_NOME = 2
+
+# Palavras comuns (sem acentos, minúsculas) que parecem grafias de nomes ("Claro"/"Clara", "Pedra"/"Pedro",
+# "Nada"/"Nadia", "Lua"/"Luna") e nunca são apontadas
+PALAVRAS_COMUNS = {
+    "claro", "clara", "caro", "cara", "pedra", "pedras", "nada", "dava", "davam", "cai", "caiu", "lua", "marco",
+    "rosa", "flor", "luz", "paz", "mar", "sol", "rio", "dia", "noite", "tarde", "casa", "vida", "mae", "pai",
+    "deus", "senhor", "senhora", "dona", "bela", "belo", "mas", "era", "eram", "ela", "ele", "elas", "eles",
+    "isso", "isto", "aquilo", "quando", "depois", "antes", "entao", "agora", "ainda", "sempre", "nunca",
+    "talvez", "sim", "nao", "bem", "mal", "mais", "menos", "tudo", "todo", "toda", "todos", "todas", "cada",
+    "outro", "outra", "onde", "como", "porque", "pois", "logo", "assim", "mesmo", "mesma", "apenas", "muito",
+    "muita", "pouco", "pouca", "aqui", "ali", "seu", "sua", "meu", "minha", "nosso", "nossa", "foi", "ser",
+    "ter", "tinha", "havia", "fez", "disse", "dizia", "sabia", "queria", "podia", "estava", "ficou", "viu",
+    "olhou", "parou", "sorriu", "vamos", "vem", "veio", "volta", "alto", "alta", "tanto", "tanta", "lado",
+    "mundo", "tempo", "hora", "horas", "ano", "anos", "norte", "sul", "leste", "oeste", "rua", "porta",
+}
+# Caracteres que, antes de uma palavra, indicam que ela abre uma frase ou uma fala
+INICIO_FRASE = '.!?…:;—–-"“«('
+
+
+def termina_frase(texto):
+    """Indica se o texto termina em fim de frase (e não cortado no meio)."""
+    texto = texto.rstrip()
+    return bool(texto) and texto[-1] in '.!?…"”»)*'
+
+
+def sem_acentos(texto):
+    return unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode("ascii").lower()
+
+
+def extrair_personagens(texto_estrutura):
+    """Nomes dos personagens listados na estrutura (primeira palavra de cada linha "Nome: descrição")."""
+    nomes = []
+    for correspondencia in PADRAO_LINHA_PERSONAGEM.finditer(texto_estrutura or ""):
+        nome = correspondencia.group(1).strip()
+        if sem_acentos(nome.split()[0]) in PALAVRAS_NAO_NOMES | ROTULOS_DESCRICAO:
+            continue
+        if nome not in nomes:
+            nomes.append(nome)
+    return nomes
+
+
+def _distancia_edicao(a, b):
+    """Distância de Levenshtein (inserções, remoções e trocas de uma letra)."""
+    anterior = list(range(len(b) + 1))
+    for i, letra_a in enumerate(a, 1):
+        atual = [i]
+        for j, letra_b in enumerate(b, 1):
+            atual.append(min(anterior[j] + 1, atual[j - 1] + 1, anterior[j - 1] + (letra_a != letra_b)))
+        anterior = atual
+    return anterior[-1]
+
+
+def grafia_divergente(palavra, nome):
+    """Indica se `palavra` parece uma grafia errada de `nome` ("Anna"/"Ana", "Sousa"/"Souza", "Marianna"/"Mariana")."""
+    palavra, nome = sem_acentos(palavra), sem_acentos(nome)
+    if palavra == nome or palavra[0] != nome[0]:
+        return False
+    if min(len(palavra), len(nome)) <= LETRAS_NOME_CURTO:
+        # Em nomes de três letras só uma letra a mais ou a menos: uma troca ("Eva"/"Era", "Rui"/"Rua")
+        # costuma ser outra palavra com maiúscula no início da frase
+        if min(len(palavra), len(nome)) <= 3 and len(palavra) == len(nome):
+            return False
+        return _distancia_edicao(palavra, nome) == 1
+    return difflib.SequenceMatcher(None, palavra, nome).ratio() >= SEMELHANCA_NOME
+
+
+def inicio_de_frase(paragrafo, posicao):
+    """Indica se a palavra que começa em `posicao` abre uma frase (ou fala) e leva maiúscula por isso."""
+    anterior = paragrafo[:posicao].rstrip(' \t*_')
+    return not anterior or anterior[-1] in INICIO_FRASE or anterior[-1] == '\n'
+
+
+def verificar_capitulo(texto, personagens=(), indice=None, numero=None):
+    """
+    Verificações locais (sem modelo) de um capítulo. Retorna uma lista de
+    problemas `{"tipo", "paragrafo", "detalhe"}`, com o índice do parágrafo
+    (separados por linha em branco).
+
+    - parágrafos repetidos ou quase iguais (no capítulo ou, com `indice`, em capítulos anteriores);
+    - cabeçalhos "Capítulo N" que sobraram no meio do texto;
+    - nomes parecidos, mas diferentes, com os personagens da estrutura (só grafias que se
+      repetem no meio de frases, fora de `PALAVRAS_COMUNS`);
+    - última frase cortada.
+
+    `indice` é o `IndiceDuplicatas` com os parágrafos já encontrados no livro; é
+    atualizado com os parágrafos deste capítulo (`numero`). Os problemas de
+    repetição trazem o trecho anterior parecido em `"original"`.
+    """
+    indice = IndiceDuplicatas() if indice is None else indice
+    # Partes do nome completo também valem ("Ana" de "Ana Souza"), menos as de ligação ("da", "do")
+    conhecidos = {parte for nome in personagens for parte in nome.split() if parte[:1].isupper()}
+    problemas = []
+    # Palavras com maiúscula no meio de frases -> parágrafos em que aparecem (com repetição)
+    ocorrencias = {}
+    paragrafos = texto.split('\n\n')
+    for posicao, paragrafo in enumerate(paragrafos):
+        if not paragrafo.strip():
+            continue
+        sig = assinatura(paragrafo)
+        parecido = indice.procurar(paragrafo, sig)
+        if parecido:
+            problemas.append({"tipo": PROBLEMA_REPETIDO, "paragrafo": posicao,
+                              "detalhe": f"parágrafo {parecido['similaridade']:.0%} igual ao parágrafo "
+                                         f"{parecido['paragrafo'] + 1} do capítulo {parecido['capitulo']}",
+                              "original": parecido["texto"]})
+        indice.adicionar(numero, posicao, paragrafo, sig)
+
+        # O título do próprio capítulo pode abrir o texto
+        if posicao > 0 and PADRAO_CABECALHO.match(paragrafo):
+            problemas.append({"tipo": PROBLEMA_CABECALHO, "paragrafo": posicao,
+                              "detalhe": PADRAO_CABECALHO.match(paragrafo).group(0).strip()})
+
+        for correspondencia in PADRAO_NOME.finditer(paragrafo):
+            palavra = correspondencia.group(0)
+            if palavra in conhecidos or sem_acentos(palavra) in PALAVRAS_COMUNS:
+                continue
+            if not inicio_de_frase(paragrafo, correspondencia.start()):
+                ocorrencias.setdefault(palavra, []).append(posicao)
+
+    for palavra, posicoes in ocorrencias.items():
+        if len(posicoes) < MINIMO_OCORRENCIAS_NOME:
+            continue
+        nome = next((nome for nome in conhecidos if grafia_divergente(palavra, nome)), None)
+        if nome:
+            problemas.extend({"tipo": PROBLEMA_NOME, "paragrafo": posicao, "detalhe": f"'{palavra}' deveria ser '{nome}'"}
+                             for posicao in sorted(set(posicoes)))
+
+    ultimo = max((i for i, p in enumerate(paragrafos) if p.strip()), default=None)
+    if ultimo is not None and not termina_frase(paragrafos[ultimo]):
+        problemas.append({"tipo": PROBLEMA_CORTADO, "paragrafo": ultimo, "detalhe": "a última frase está incompleta"})
+    return problemas
+
+
+def remover_cabecalhos_soltos(texto, problemas):
+    """
+    Remove localmente os parágrafos que são só um cabeçalho "Capítulo N" perdido no texto.
+
+    Retorna `(texto, problemas_restantes)`; os índices dos problemas restantes são
+    ajustados aos parágrafos que ficaram.
+    """
+    paragrafos = texto.split('\n\n')
+    remover = {p["paragrafo"] for p in problemas if p["tipo"] == PROBLEMA_CABECALHO
+               and len(paragrafos[p["paragrafo"]].split()) <= PALAVRAS_MAXIMAS_CABECALHO}
+    if not remover:
+        return texto, problemas
+    novos_indices = {}
+    mantidos = []
+    for indice, paragrafo in enumerate(paragrafos):
+        if indice not in remover:
+            novos_indices[indice] = len(mantidos)
+            mantidos.append(paragrafo)
+    restantes = [{**p, "paragrafo": novos_indices[p["paragrafo"]]} for p in problemas if p["paragrafo"] not in remover]
+    return '\n\n'.join(mantidos), restantes
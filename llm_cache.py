@@ -0,0 +1,207 @@
+import os
+import json
+import asyncio
+import time
+import sqlite3
+import hashlib
+import threading
+
+from metrics import medir_chamada
+
+CAMINHO_CACHE = os.getenv("LLM_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache_llm.sqlite3"))
+TAMANHO_MAXIMO_MB = float(os.getenv("LLM_CACHE_MAX_MB", "200"))
+
+
+def chave_cache(modelo, temperatura, max_tokens, mensagens, response_format=None, livro_id=None):
+    """
+    Hash do conteúdo da chamada: modelo, temperatura, max_tokens e a lista exata de mensagens.
+
+    Com `livro_id`, a chave vale só para aquela geração: retomá-la reaproveita as
+    respostas, mas pedir de novo um livro já pronto gera um livro novo.
+    """
+    dados = {"modelo": modelo, "temperatura": temperatura, "max_tokens": max_tokens, "mensagens": mensagens}
+    if response_format:
+        dados["response_format"] = response_format
+    if livro_id:
+        dados["livro_id"] = livro_id
+    conteudo = json.dumps(dados, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(conteudo.encode("utf-8")).hexdigest()
+
+
+class CacheLLM:
+    """
+    Cache em disco (SQLite) de respostas de modelos, endereçado pelo conteúdo da chamada.
+
+    Quando o tamanho total passa do limite, as entradas usadas há mais tempo (LRU)
+    são removidas, exceto as fixadas por um livro ainda em geração.
+    """
+
+    def __init__(self, caminho=CAMINHO_CACHE, tamanho_maximo_mb=TAMANHO_MAXIMO_MB):
+        self.caminho = caminho
+        self.tamanho_maximo = int(tamanho_maximo_mb * 1024 * 1024)
+        self.acertos = 0
+        self.falhas = 0
+        self.tokens_economizados = 0
+        self.bytes_economizados = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(caminho, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS respostas (
+                chave TEXT PRIMARY KEY,
+                modelo TEXT,
+                resposta TEXT NOT NULL,
+                tamanho INTEGER NOT NULL,
+                tokens INTEGER DEFAULT 0,
+                criado_em REAL NOT NULL,
+                ultimo_acesso REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_respostas_acesso ON respostas(ultimo_acesso);
+            CREATE TABLE IF NOT EXISTS fixados (
+                chave TEXT NOT NULL,
+                livro_id TEXT NOT NULL,
+                PRIMARY KEY (chave, livro_id)
+            );
+        """)
+        self._conn.commit()
+
+    def obter(self, chave, livro_id=None):
+        """Retorna a resposta em cache (ou None) e atualiza o último acesso."""
+        with self._lock:
+            linha = self._conn.execute(
+                "SELECT resposta, tokens FROM respostas WHERE chave = ?", (chave,)
+            ).fetchone()
+            if linha is None:
+                self.falhas += 1
+                return None
+            self.acertos += 1
+            self.tokens_economizados += linha[1] or 0
+            self.bytes_economizados += len(linha[0].encode("utf-8"))
+            self._conn.execute("UPDATE respostas SET ultimo_acesso = ? WHERE chave = ?", (time.time(), chave))
+            if livro_id:
+                self._conn.execute("INSERT OR IGNORE INTO fixados (chave, livro_id) VALUES (?, ?)", (chave, livro_id))
+            self._conn.commit()
+            return linha[0]
+
+    def salvar(self, chave, modelo, resposta, tokens=0, livro_id=None):
+        """Grava a resposta e, se informado, fixa a entrada no livro."""
+        agora = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO respostas (chave, modelo, resposta, tamanho, tokens, criado_em, ultimo_acesso) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (chave, modelo, resposta, len(resposta.encode("utf-8")), tokens or 0, agora, agora)
+            )
+            if livro_id:
+                self._conn.execute("INSERT OR IGNORE INTO fixados (chave, livro_id) VALUES (?, ?)", (chave, livro_id))
+            self._despejar()
+            self._conn.commit()
+
+    def liberar_livro(self, livro_id):
+        """Remove a fixação das entradas de um livro (elas passam a seguir o LRU normal)."""
+        with self._lock:
+            self._conn.execute("DELETE FROM fixados WHERE livro_id = ?", (livro_id,))
+            self._conn.commit()
+
+    def _despejar(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(tamanho), 0) FROM respostas").fetchone()[0]
+        if total <= self.tamanho_maximo:
+            return
+        candidatas = self._conn.execute(
+            "SELECT chave, tamanho FROM respostas WHERE chave NOT IN (SELECT chave FROM fixados) "
+            "ORDER BY ultimo_acesso ASC"
+        )
+        remover = []
+        for chave, tamanho in candidatas:
+            if total <= self.tamanho_maximo:
+                break
+            remover.append((chave,))
+            total -= tamanho
+        self._conn.executemany("DELETE FROM respostas WHERE chave = ?", remover)
+
+    def estatisticas(self):
+        with self._lock:
+            entradas, tamanho = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(tamanho), 0) FROM respostas"
+            ).fetchone()
+            fixadas = self._conn.execute("SELECT COUNT(DISTINCT chave) FROM fixados").fetchone()[0]
+        consultas = self.acertos + self.falhas
+        return {
+            "acertos": self.acertos,
+            "falhas": self.falhas,
+            "taxa_acerto": round(self.acertos / consultas, 3) if consultas else 0.0,
+            "tokens_economizados": self.tokens_economizados,
+            "bytes_economizados": self.bytes_economizados,
+            "entradas": entradas,
+            "entradas_fixadas": fixadas,
+            "tamanho_bytes": tamanho
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def obter_cache():
+    """Retorna o cache compartilhado pelo processo."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CacheLLM()
+        return _cache
+
+
+async def completar_chat_async(client, model, messages, temperature, max_tokens, livro_id=None, ao_receber=None,
+                               response_format=None):
+    """
+    Chama `client.chat.completions.create` de um cliente `AsyncOpenAI` passando pelo cache
+    e retorna o texto da resposta.
+
+    Se `ao_receber` for informado, a resposta é pedida com `stream=True` e cada
+    trecho recebido é repassado a `ao_receber(delta)` à medida que chega; o texto
+    final é montado de forma incremental. Em um acerto do cache, o texto inteiro
+    é repassado de uma só vez.
+    """
+    cache = obter_cache()
+    chave = chave_cache(model, temperature, max_tokens, messages, response_format, livro_id)
+    extras = {"response_format": response_format} if response_format else {}
+    with medir_chamada(model, livro_id) as chamada:
+        resposta = await asyncio.to_thread(cache.obter, chave, livro_id)
+        if resposta is not None:
+            chamada["cache"] = True
+            if ao_receber:
+                ao_receber(resposta)
+            return resposta
+        if ao_receber is None:
+            response = chamada["resposta"] = await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                **extras
+            )
+            conteudo = response.choices[0].message.content or ""
+            tokens = response.usage.total_tokens if getattr(response, "usage", None) else 0
+        else:
+            partes = []
+            tokens = 0
+            stream = await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=True,
+                stream_options={"include_usage": True},
+                **extras
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    partes.append(chunk.choices[0].delta.content)
+                    ao_receber(chunk.choices[0].delta.content)
+                if getattr(chunk, "usage", None):
+                    # O último trecho traz o uso da chamada inteira
+                    chamada["resposta"] = chunk
+                    tokens = chunk.usage.total_tokens
+            conteudo = "".join(partes)
+    await asyncio.to_thread(cache.salvar, chave, model, conteudo, tokens, livro_id)
+    return conteudo
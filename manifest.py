@@ -0,0 +1,198 @@
+import os
+import json
+import glob
+import hashlib
+import tempfile
+from datetime import datetime
+
+from journal import Diario
+
+ARQUIVO_MANIFESTO = "manifest.json"
+ARQUIVO_DIARIO = "capitulos.jsonl"
+
+# Quantos eventos de capítulo acumular no diário antes de compactar no manifesto
+COMPACTAR_A_CADA = int(os.getenv("DIARIO_COMPACTAR_A_CADA", "8"))
+
+STATUS_EM_ANDAMENTO = "em_andamento"
+STATUS_CONCLUIDO = "concluido"
+STATUS_CANCELADO = "cancelado"
+STATUS_ERRO = "erro"
+
+# Campos da especificação que identificam um livro (mesmos nomes dos parâmetros de app.gerar_livro_generico)
+CAMPOS_ESPECIFICACAO = ("tema", "autor", "email_autor", "descricao", "genero", "estilo", "publico_alvo", "num_capitulos")
+
+
+def hash_texto(texto):
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+def escrever_json_atomico(caminho, dados, indent=2):
+    """Grava JSON em um arquivo temporário e o renomeia por cima do destino (nunca deixa o arquivo pela metade)."""
+    escrever_texto_atomico(caminho, json.dumps(dados, ensure_ascii=False, indent=indent), sufixo=".json")
+
+
+def escrever_texto_atomico(caminho, texto, sufixo=".txt"):
+    """Como `escrever_json_atomico`, para texto: o destino tem sempre o conteúdo antigo ou o novo completo."""
+    diretorio = os.path.dirname(caminho) or "."
+    fd, temporario = tempfile.mkstemp(dir=diretorio, prefix=".tmp_", suffix=sufixo)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(texto)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporario, caminho)
+    except Exception:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+
+
+def gerar_job_id(especificacao):
+    """ID estável do livro: o mesmo pedido sempre gera o mesmo ID, permitindo retomar o trabalho."""
+    dados = {campo: especificacao.get(campo) for campo in CAMPOS_ESPECIFICACAO}
+    return hash_texto(json.dumps(dados, ensure_ascii=False, sort_keys=True))[:16]
+
+
+def localizar_livro(base_dir, job_id, incluir_concluidos=False):
+    """
+    Retorna o diretório `livro_*` mais recente cujo manifesto tem o `job_id` informado, ou None.
+
+    Por padrão só considera livros não concluídos, para que o mesmo pedido feito
+    depois de um livro pronto gere um livro novo.
+    """
+    for pasta in sorted(glob.glob(os.path.join(base_dir, "livro_*")), reverse=True):
+        manifesto = ler_manifesto(pasta)
+        if not manifesto or manifesto.get("job_id") != job_id:
+            continue
+        if incluir_concluidos or manifesto.get("status") != STATUS_CONCLUIDO:
+            return pasta
+    return None
+
+
+def listar_livros_interrompidos(base_dir):
+    """Lista (diretório, manifesto) dos livros não concluídos, do mais recente para o mais antigo."""
+    interrompidos = []
+    for pasta in sorted(glob.glob(os.path.join(base_dir, "livro_*")), reverse=True):
+        manifesto = ler_manifesto(pasta)
+        if manifesto and manifesto.get("status") != STATUS_CONCLUIDO:
+            interrompidos.append((pasta, manifesto))
+    return interrompidos
+
+
+def aplicar_evento(dados, evento):
+    """Aplica um evento do diário de capítulos ao estado do manifesto."""
+    if evento.get("tipo") == "capitulo":
+        registro = {k: v for k, v in evento.items() if k not in ("tipo", "numero", "seq")}
+        dados.setdefault("capitulos", {})[str(evento["numero"])] = registro
+
+
+def ler_manifesto(livro_dir):
+    """Reconstrói o estado do livro: último snapshot (`manifest.json`) mais a cauda do diário."""
+    caminho = os.path.join(livro_dir, ARQUIVO_MANIFESTO)
+    if not os.path.exists(caminho):
+        return None
+    try:
+        with open(caminho, 'r', encoding='utf-8') as f:
+            dados = json.load(f)
+    except Exception as e:
+        print(f"Erro ao ler {caminho}: {e}")
+        return None
+    for evento in Diario(os.path.join(livro_dir, ARQUIVO_DIARIO)).ler(apos_seq=dados.get("seq", 0)):
+        aplicar_evento(dados, evento)
+    return dados
+
+
+class ManifestoLivro:
+    """
+    Manifesto de um livro em geração (`manifest.json` no diretório do livro).
+
+    Registra o ID estável do job, a especificação do pedido, a estrutura gerada
+    e o status e o hash de cada capítulo, para que um livro interrompido seja
+    retomado a partir da estrutura ou de qualquer capítulo sem pagar de novo
+    pelo que já foi gerado.
+
+    Os capítulos são registrados como eventos no diário append-only
+    `capitulos.jsonl`; a cada `COMPACTAR_A_CADA` eventos o estado é compactado
+    em um novo snapshot do manifesto, gravado de forma atômica.
+    """
+
+    def __init__(self, livro_dir, job_id, especificacao):
+        self.livro_dir = livro_dir
+        self.caminho = os.path.join(livro_dir, ARQUIVO_MANIFESTO)
+        self.dados = ler_manifesto(livro_dir) or {
+            "job_id": job_id,
+            "especificacao": especificacao,
+            "status": STATUS_EM_ANDAMENTO,
+            "criado_em": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "estrutura": None,
+            "capitulos": {}
+        }
+        self.diario = Diario(os.path.join(livro_dir, ARQUIVO_DIARIO), self.dados.get("seq", 0))
+        self.eventos_pendentes = 0
+        self.dados["status"] = STATUS_EM_ANDAMENTO
+        self.compactar()
+
+    def salvar(self):
+        """Grava um snapshot completo do estado (que já inclui todos os eventos do diário)."""
+        self.dados["seq"] = self.diario.seq
+        self.dados["atualizado_em"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        escrever_json_atomico(self.caminho, self.dados)
+
+    def compactar(self):
+        """Grava o snapshot e esvazia o diário."""
+        self.salvar()
+        self.diario.truncar()
+        self.eventos_pendentes = 0
+
+    def registrar_estrutura(self, texto, arquivo):
+        self.dados["estrutura"] = {"arquivo": os.path.basename(arquivo), "hash": hash_texto(texto)}
+        self.salvar()
+
+    def estrutura_salva(self):
+        """Retorna o texto da estrutura já gerada (se o arquivo ainda confere com o hash), ou None."""
+        return self._ler_verificado(self.dados.get("estrutura"))
+
+    def registrar_capitulo(self, numero, texto, arquivo, revisado=False):
+        evento = {
+            "tipo": "capitulo",
+            "numero": numero,
+            "status": STATUS_CONCLUIDO,
+            "arquivo": os.path.basename(arquivo),
+            "hash": hash_texto(texto),
+            "palavras": len(texto.split()),
+            "revisado": revisado,
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        evento["seq"] = self.diario.registrar(evento)
+        aplicar_evento(self.dados, evento)
+        self.eventos_pendentes += 1
+        if self.eventos_pendentes >= COMPACTAR_A_CADA:
+            self.compactar()
+
+    def capitulos_registrados(self):
+        """Lista de capítulos no formato de `metadata.json` (número, arquivo e horário)."""
+        return [
+            {"numero": int(numero), "arquivo": os.path.join(self.livro_dir, c["arquivo"]), "timestamp": c["timestamp"]}
+            for numero, c in sorted(self.dados["capitulos"].items(), key=lambda item: int(item[0]))
+        ]
+
+    def capitulo_salvo(self, numero):
+        """Retorna o texto do capítulo já gerado (se o arquivo ainda confere com o hash), ou None."""
+        return self._ler_verificado(self.dados["capitulos"].get(str(numero)))
+
+    def capitulo_revisado(self, numero):
+        return bool(self.dados["capitulos"].get(str(numero), {}).get("revisado"))
+
+    def definir_status(self, status):
+        self.dados["status"] = status
+        self.compactar()
+
+    def _ler_verificado(self, entrada):
+        if not entrada:
+            return None
+        caminho = os.path.join(self.livro_dir, entrada["arquivo"])
+        if not os.path.exists(caminho):
+            return None
+        with open(caminho, 'r', encoding='utf-8') as f:
+            texto = f.read()
+        return texto if hash_texto(texto) == entrada["hash"] else None
@@ -0,0 +1,306 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import contextvars
+from contextlib import contextmanager
+
+CAMINHO_METRICAS = os.getenv("METRICS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "metricas_llm.sqlite3"))
+
+# Preço em dólares por milhão de tokens (entrada, saída); modelos desconhecidos ficam com custo 0
+PRECOS_POR_MILHAO = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+
+# Limites (em segundos) dos buckets do histograma de latência
+LIMITES_LATENCIA = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+
+# Etiquetas da chamada em andamento (livro, capítulo, etapa) e contador de novas tentativas
+_etiquetas = contextvars.ContextVar("etiquetas_metricas", default={})
+_tentativas = contextvars.ContextVar("tentativas_metricas", default=None)
+
+
+def custo_estimado(modelo, tokens_prompt, tokens_resposta):
+    """Custo em dólares de uma chamada, pelo prefixo mais longo do nome do modelo na tabela de preços."""
+    precos = None
+    for nome in sorted(PRECOS_POR_MILHAO, key=len, reverse=True):
+        if (modelo or "").startswith(nome):
+            precos = PRECOS_POR_MILHAO[nome]
+            break
+    if precos is None:
+        return 0.0
+    return (tokens_prompt * precos[0] + tokens_resposta * precos[1]) / 1_000_000
+
+
+@contextmanager
+def etiquetar(**etiquetas):
+    """Associa etiquetas (ex.: `capitulo=3`) às chamadas feitas dentro do bloco, na mesma thread ou tarefa."""
+    token = _etiquetas.set({**_etiquetas.get(), **{k: v for k, v in etiquetas.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _etiquetas.reset(token)
+
+
+def contar_nova_tentativa():
+    """Chamado pelos ganchos HTTP quando a API responde com erro que o SDK vai repetir (429/5xx)."""
+    tentativas = _tentativas.get()
+    if tentativas is not None:
+        tentativas[0] += 1
+
+
+def _ler(objeto, *nomes):
+    for nome in nomes:
+        valor = objeto.get(nome) if isinstance(objeto, dict) else getattr(objeto, nome, None)
+        if isinstance(valor, (int, float)):
+            return int(valor)
+    return 0
+
+
+def _ler_detalhe(objeto, campo, *nomes):
+    detalhes = objeto.get(campo) if isinstance(objeto, dict) else getattr(objeto, campo, None)
+    return _ler(detalhes, *nomes) if detalhes is not None else 0
+
+
+def ler_uso(objeto):
+    """
+    Extrai (tokens_prompt, tokens_resposta, tokens_prompt_em_cache) de uma resposta da OpenAI,
+    de uma mensagem do LangChain ou das métricas de uso de uma Crew. Retorna zeros se não houver uso.
+
+    `tokens_prompt_em_cache` é a parte do prompt atendida pelo cache de prefixo do provedor
+    (`prompt_tokens_details.cached_tokens` na API da OpenAI).
+    """
+    if objeto is None:
+        return 0, 0, 0
+    uso = getattr(objeto, "usage_metadata", None)
+    if uso:
+        return (_ler(uso, "input_tokens"), _ler(uso, "output_tokens"),
+                _ler_detalhe(uso, "input_token_details", "cache_read"))
+    metadados = getattr(objeto, "response_metadata", None)
+    if isinstance(metadados, dict) and metadados.get("token_usage"):
+        objeto = metadados["token_usage"]
+    elif getattr(objeto, "usage", None) is not None:
+        objeto = objeto.usage
+    elif getattr(objeto, "token_usage", None) is not None:
+        objeto = objeto.token_usage
+    elif getattr(objeto, "usage_metrics", None) is not None:
+        objeto = objeto.usage_metrics
+    em_cache = _ler_detalhe(objeto, "prompt_tokens_details", "cached_tokens") or _ler(objeto, "cached_prompt_tokens")
+    return _ler(objeto, "prompt_tokens", "input_tokens"), _ler(objeto, "completion_tokens", "output_tokens"), em_cache
+
+
+class MetricasLLM:
+    """
+    Registro (SQLite) de cada chamada a modelo: tokens, latência, custo e novas tentativas.
+
+    Cada chamada é etiquetada com livro, capítulo e etapa. O mesmo arquivo é gravado
+    pelos workers e lido pelo servidor, que expõe os totais no formato do Prometheus.
+    """
+
+    def __init__(self, caminho=CAMINHO_METRICAS):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(caminho, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS chamadas (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                livro_id TEXT,
+                capitulo INTEGER,
+                etapa TEXT,
+                modelo TEXT,
+                tokens_prompt INTEGER DEFAULT 0,
+                tokens_resposta INTEGER DEFAULT 0,
+                tokens_prompt_cache INTEGER DEFAULT 0,
+                latencia REAL NOT NULL,
+                novas_tentativas INTEGER DEFAULT 0,
+                custo REAL DEFAULT 0,
+                cache INTEGER DEFAULT 0,
+                erro TEXT,
+                criado_em REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_chamadas_livro ON chamadas(livro_id);
+        """)
+        # Bancos criados antes da coluna de tokens do prompt em cache
+        colunas = [linha[1] for linha in self._conn.execute("PRAGMA table_info(chamadas)")]
+        if "tokens_prompt_cache" not in colunas:
+            self._conn.execute("ALTER TABLE chamadas ADD COLUMN tokens_prompt_cache INTEGER DEFAULT 0")
+        self._conn.commit()
+
+    def registrar(self, modelo, tokens_prompt, tokens_resposta, latencia, novas_tentativas=0, livro_id=None,
+                  capitulo=None, etapa=None, cache=False, erro=None, tokens_prompt_cache=0):
+        custo = 0.0 if cache else custo_estimado(modelo, tokens_prompt, tokens_resposta)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO chamadas (livro_id, capitulo, etapa, modelo, tokens_prompt, tokens_resposta, tokens_prompt_cache, "
+                "latencia, novas_tentativas, custo, cache, erro, criado_em) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (livro_id, capitulo, etapa, modelo, tokens_prompt, tokens_resposta, tokens_prompt_cache, latencia,
+                 novas_tentativas, custo, int(cache), erro, time.time())
+            )
+            self._conn.commit()
+
+    def resumo_livro(self, livro_id):
+        """Totais do livro, por etapa, por capítulo, por modelo e por etapa e modelo (para ajustar as rotas)."""
+        colunas = ("COUNT(*), COALESCE(SUM(tokens_prompt), 0), COALESCE(SUM(tokens_resposta), 0), "
+                   "COALESCE(SUM(latencia), 0), COALESCE(SUM(novas_tentativas), 0), COALESCE(SUM(custo), 0), "
+                   "COALESCE(SUM(cache), 0), COUNT(erro), COALESCE(SUM(tokens_prompt_cache), 0)")
+
+        def totais(linha):
+            return {
+                "chamadas": linha[0],
+                "tokens_prompt": linha[1],
+                "tokens_resposta": linha[2],
+                "tokens_prompt_cache": linha[8],
+                # Fração do prompt atendida pelo cache de prefixo do provedor
+                "taxa_prompt_cache": round(linha[8] / linha[1], 3) if linha[1] else 0.0,
+                "latencia_total_s": round(linha[3], 3),
+                "novas_tentativas": linha[4],
+                "custo_usd": round(linha[5], 6),
+                "acertos_cache": linha[6],
+                "erros": linha[7]
+            }
+
+        with self._lock:
+            geral = self._conn.execute(f"SELECT {colunas} FROM chamadas WHERE livro_id = ?", (livro_id,)).fetchone()
+            agrupados = {
+                campo: self._conn.execute(
+                    f"SELECT {campo}, {colunas} FROM chamadas WHERE livro_id = ? GROUP BY {campo} ORDER BY {campo}",
+                    (livro_id,)
+                ).fetchall()
+                for campo in ("etapa", "capitulo", "modelo", "etapa || ' / ' || modelo")
+            }
+        resumo = {"livro_id": livro_id, "total": totais(geral)}
+        for campo, chave in (("etapa", "por_etapa"), ("capitulo", "por_capitulo"), ("modelo", "por_modelo"),
+                             ("etapa || ' / ' || modelo", "por_etapa_modelo")):
+            resumo[chave] = {str(linha[0]): totais(linha[1:]) for linha in agrupados[campo] if linha[0] is not None}
+        return resumo
+
+    def latencias(self, etapa=None, livro_id=None):
+        """Latências (em segundos) das chamadas não atendidas pelo cache, filtradas por etapa e livro."""
+        filtros, valores = ["cache = 0"], []
+        if etapa is not None:
+            filtros.append("etapa = ?")
+            valores.append(etapa)
+        if livro_id is not None:
+            filtros.append("livro_id = ?")
+            valores.append(livro_id)
+        with self._lock:
+            linhas = self._conn.execute(f"SELECT latencia FROM chamadas WHERE {' AND '.join(filtros)}", valores).fetchall()
+        return [linha[0] for linha in linhas]
+
+    def salvar_resumo_livro(self, livro_id, caminho):
+        """Grava o resumo do livro em `caminho` (normalmente `metrics.json` ao lado de `metadata.json`)."""
+        resumo = self.resumo_livro(livro_id)
+        with open(caminho, 'w', encoding='utf-8') as f:
+            json.dump(resumo, f, ensure_ascii=False, indent=2)
+        return resumo
+
+    def exportar_prometheus(self):
+        """Contadores e histograma de latência no formato de texto do Prometheus."""
+        buckets = ", ".join(f"SUM(latencia <= {limite})" for limite in LIMITES_LATENCIA)
+        with self._lock:
+            por_etapa = self._conn.execute(
+                "SELECT modelo, COALESCE(etapa, ''), cache, COUNT(*), SUM(tokens_prompt), SUM(tokens_resposta), "
+                "SUM(custo), SUM(novas_tentativas), COUNT(erro), SUM(tokens_prompt_cache) FROM chamadas "
+                "GROUP BY modelo, etapa, cache"
+            ).fetchall()
+            latencias = self._conn.execute(
+                f"SELECT modelo, COUNT(*), SUM(latencia), {buckets} FROM chamadas WHERE cache = 0 GROUP BY modelo"
+            ).fetchall()
+
+        linhas = []
+
+        def metrica(nome, tipo, ajuda, amostras):
+            linhas.append(f"# HELP {nome} {ajuda}")
+            linhas.append(f"# TYPE {nome} {tipo}")
+            for etiquetas, valor in amostras:
+                rotulo = ",".join(f'{k}="{v}"' for k, v in etiquetas.items())
+                linhas.append(f"{nome}{{{rotulo}}} {valor}")
+
+        def rotulos(linha):
+            return {"modelo": linha[0], "etapa": linha[1], "cache": "sim" if linha[2] else "nao"}
+
+        metrica("gerador_llm_chamadas_total", "counter", "Chamadas a modelos de linguagem.",
+                [(rotulos(l), l[3]) for l in por_etapa])
+        metrica("gerador_llm_tokens_total", "counter", "Tokens enviados e recebidos.",
+                [({**rotulos(l), "tipo": "prompt"}, l[4] or 0) for l in por_etapa]
+                + [({**rotulos(l), "tipo": "resposta"}, l[5] or 0) for l in por_etapa]
+                + [({**rotulos(l), "tipo": "prompt_cache"}, l[9] or 0) for l in por_etapa])
+        metrica("gerador_llm_custo_dolares_total", "counter", "Custo estimado das chamadas em dólares.",
+                [(rotulos(l), round(l[6] or 0, 6)) for l in por_etapa])
+        metrica("gerador_llm_novas_tentativas_total", "counter", "Respostas 429/5xx repetidas automaticamente.",
+                [(rotulos(l), l[7] or 0) for l in por_etapa])
+        metrica("gerador_llm_erros_total", "counter", "Chamadas que terminaram em erro.",
+                [(rotulos(l), l[8]) for l in por_etapa])
+
+        amostras = []
+        totais_latencia = []
+        for linha in latencias:
+            modelo, quantidade, soma = linha[0], linha[1], linha[2] or 0
+            for limite, acumulado in zip(LIMITES_LATENCIA, linha[3:]):
+                amostras.append(({"modelo": modelo, "le": limite}, acumulado or 0))
+            amostras.append(({"modelo": modelo, "le": "+Inf"}, quantidade))
+            totais_latencia.append((modelo, quantidade, soma))
+        linhas.append("# HELP gerador_llm_latencia_segundos Latência das chamadas (sem acertos do cache).")
+        linhas.append("# TYPE gerador_llm_latencia_segundos histogram")
+        for etiquetas, valor in amostras:
+            linhas.append(f'gerador_llm_latencia_segundos_bucket{{modelo="{etiquetas["modelo"]}",le="{etiquetas["le"]}"}} {valor}')
+        for modelo, quantidade, soma in totais_latencia:
+            linhas.append(f'gerador_llm_latencia_segundos_sum{{modelo="{modelo}"}} {round(soma, 3)}')
+            linhas.append(f'gerador_llm_latencia_segundos_count{{modelo="{modelo}"}} {quantidade}')
+        return "\n".join(linhas) + "\n"
+
+
+_metricas = None
+_metricas_lock = threading.Lock()
+
+
+def obter_metricas():
+    """Retorna o registro de métricas compartilhado pelo processo."""
+    global _metricas
+    with _metricas_lock:
+        if _metricas is None:
+            _metricas = MetricasLLM()
+        return _metricas
+
+
+@contextmanager
+def medir_chamada(modelo, livro_id=None, capitulo=None, etapa=None):
+    """
+    Mede uma chamada a modelo feita dentro do bloco e a registra ao sair.
+
+    O bloco recebe um dicionário em que deve preencher `tokens_prompt` e
+    `tokens_resposta` (ou `resposta`, de onde o uso, inclusive os tokens do
+    prompt em cache no provedor, é lido com `ler_uso`) e, em acertos do
+    cache, `cache=True`. Livro, capítulo e etapa não informados
+    vêm de `etiquetar`; as novas tentativas são contadas pelos ganchos HTTP.
+    """
+    etiquetas = {**_etiquetas.get(), **{k: v for k, v in
+                                         {"livro_id": livro_id, "capitulo": capitulo, "etapa": etapa}.items()
+                                         if v is not None}}
+    chamada = {"tokens_prompt": 0, "tokens_resposta": 0, "tokens_prompt_cache": 0, "cache": False}
+    tentativas = [0]
+    token = _tentativas.set(tentativas)
+    inicio = time.perf_counter()
+    erro = None
+    try:
+        yield chamada
+    except Exception as e:
+        erro = type(e).__name__
+        raise
+    finally:
+        latencia = time.perf_counter() - inicio
+        _tentativas.reset(token)
+        if "resposta" in chamada:
+            chamada["tokens_prompt"], chamada["tokens_resposta"], chamada["tokens_prompt_cache"] = ler_uso(chamada["resposta"])
+        try:
+            obter_metricas().registrar(
+                modelo, chamada["tokens_prompt"], chamada["tokens_resposta"], latencia, tentativas[0],
+                livro_id=etiquetas.get("livro_id"), capitulo=etiquetas.get("capitulo"), etapa=etiquetas.get("etapa"),
+                cache=chamada["cache"], erro=erro, tokens_prompt_cache=chamada["tokens_prompt_cache"]
+            )
+        except Exception as e:
+            print(f"Erro ao registrar métricas da chamada: {str(e)}")
@@ -0,0 +1,434 @@
+import os
+import re
+import json
+
+from linter import PADRAO_LINHA_PERSONAGEM, PALAVRAS_NAO_NOMES, ROTULOS_DESCRICAO, sem_acentos
+from manifest import escrever_json_atomico, hash_texto
+
+# Prefixos como "Capítulo 3:", "3." ou "Cap. 3 -" que o modelo às vezes coloca no título
+PADRAO_PREFIXO_TITULO = re.compile(r'^\s*(?:cap[íi]tulo|cap\.)?\s*\d+\s*[:.\-–—)]\s*', re.IGNORECASE)
+
+
+def extrair_json(texto):
+    """Recorta o objeto/lista JSON de uma resposta (remove cercas ``` e texto ao redor)."""
+    texto = (texto or "").strip()
+    cerca = re.search(r'```(?:json)?\s*(.*?)(?:```|$)', texto, re.DOTALL)
+    if cerca:
+        texto = cerca.group(1).strip()
+    inicios = [p for p in (texto.find('{'), texto.find('[')) if p >= 0]
+    return texto[min(inicios):] if inicios else texto
+
+
+def reparar_json(texto):
+    """
+    Tenta consertar JSON malformado comum em respostas de modelos:
+    vírgulas sobrando e resposta truncada (strings e colchetes/chaves sem fechar).
+    """
+    texto = re.sub(r',\s*([}\]])', r'\1', texto)
+    pilha = []
+    em_string = False
+    escape = False
+    for caractere in texto:
+        if em_string:
+            if escape:
+                escape = False
+            elif caractere == '\\':
+                escape = True
+            elif caractere == '"':
+                em_string = False
+        elif caractere == '"':
+            em_string = True
+        elif caractere in '{[':
+            pilha.append('}' if caractere == '{' else ']')
+        elif caractere in '}]' and pilha:
+            pilha.pop()
+    if em_string:
+        texto += '"'
+    texto = re.sub(r'[,:]\s*$', '', texto.rstrip())
+    return texto + ''.join(reversed(pilha))
+
+
+def _primeiro(item, *chaves):
+    for chave in chaves:
+        valor = item.get(chave)
+        if isinstance(valor, str) and valor.strip():
+            return valor.strip()
+    return ""
+
+
+def validar_sumario(dados, num_capitulos):
+    """
+    Normaliza o sumário para exatamente `num_capitulos` itens
+    `{"numero", "titulo", "sinopse"}`, completando o que faltar.
+    """
+    if isinstance(dados, dict):
+        itens = dados.get("capitulos") or dados.get("chapters") or dados.get("sumario") or []
+    elif isinstance(dados, list):
+        itens = dados
+    else:
+        itens = []
+
+    capitulos = []
+    for item in itens:
+        if isinstance(item, str):
+            item = {"titulo": item}
+        if not isinstance(item, dict):
+            continue
+        titulo = PADRAO_PREFIXO_TITULO.sub('', _primeiro(item, "titulo", "title", "nome")).strip('"\'').strip()
+        sinopse = _primeiro(item, "sinopse", "resumo", "synopsis", "summary", "descricao")
+        capitulos.append({"titulo": titulo, "sinopse": sinopse})
+        if len(capitulos) == num_capitulos:
+            break
+
+    while len(capitulos) < num_capitulos:
+        capitulos.append({"titulo": "", "sinopse": ""})
+
+    for numero, capitulo in enumerate(capitulos, 1):
+        capitulo["numero"] = numero
+        if not capitulo["titulo"]:
+            capitulo["titulo"] = f"Capítulo {numero}"
+    return capitulos
+
+
+def interpretar_sumario(texto, num_capitulos):
+    """Interpreta a resposta do modelo como sumário, reparando o JSON localmente se necessário."""
+    bruto = extrair_json(texto)
+    # Se a resposta foi cortada no meio de um capítulo, descartamos o item incompleto
+    for candidato in (bruto, reparar_json(bruto), reparar_json(bruto[:bruto.rfind('}') + 1])):
+        try:
+            return validar_sumario(json.loads(candidato), num_capitulos)
+        except ValueError:
+            continue
+    # Último recurso: uma linha por capítulo no formato "N. Título"
+    linhas = [l for l in (texto or "").splitlines() if PADRAO_PREFIXO_TITULO.match(l)]
+    return validar_sumario(linhas, num_capitulos)
+
+
+# Cabeçalhos "Capítulo N" da estrutura em texto livre (também com "#", "**" ou numeração na frente)
+PADRAO_CABECALHO_CAPITULO = re.compile(r'^[#*\s\d.-]*cap[íi]tulo\s+(\d+)\b', re.IGNORECASE | re.MULTILINE)
+
+# Trechos mais curtos que isto são linhas de sumário ("Capítulo 3: Título"), não a descrição do capítulo
+PALAVRAS_MINIMAS_TRECHO = 20
+
+
+def separar_estrutura(estrutura, palavras_minimas=PALAVRAS_MINIMAS_TRECHO):
+    """
+    Divide a estrutura em texto livre em `(parte_global, trechos)`.
+
+    `parte_global` é o que vem antes do primeiro cabeçalho "Capítulo N" (título,
+    personagens, arco) e `trechos` mapeia cada número de capítulo para o seu
+    trecho. Se o capítulo aparece mais de uma vez (sumário e descrição), vale o
+    primeiro trecho com pelo menos `palavras_minimas` palavras, como em
+    `LeitorEstrutura`. Sem cabeçalhos, a estrutura inteira é a parte global.
+    """
+    marcas = [(m.start(), int(m.group(1))) for m in PADRAO_CABECALHO_CAPITULO.finditer(estrutura)]
+    if not marcas:
+        return estrutura.strip(), {}
+    trechos = {}
+    for indice, (inicio, numero) in enumerate(marcas):
+        fim = marcas[indice + 1][0] if indice + 1 < len(marcas) else len(estrutura)
+        trecho = estrutura[inicio:fim].strip()
+        atual = trechos.get(numero)
+        if atual is None or (len(atual.split()) < palavras_minimas and len(trecho.split()) > len(atual.split())):
+            trechos[numero] = trecho
+    return estrutura[:marcas[0][0]].strip(), trechos
+
+
+class LeitorEstrutura:
+    """
+    Lê a estrutura em texto livre enquanto ela chega em streaming.
+
+    `alimentar(delta)` retorna os capítulos `(numero, trecho)` cujo trecho acabou de
+    ficar completo (já apareceu o cabeçalho seguinte); `concluir()` entrega os que
+    faltam quando o streaming termina. `parte_global` fica disponível assim que
+    chega o primeiro cabeçalho de capítulo. Os trechos entregues são os mesmos
+    que `separar_estrutura` escolheria no texto completo.
+    """
+
+    def __init__(self, palavras_minimas=PALAVRAS_MINIMAS_TRECHO):
+        self.texto = ""
+        self.parte_global = None
+        self.palavras_minimas = palavras_minimas
+        self._entregues = set()
+
+    def alimentar(self, delta):
+        self.texto += delta
+        # Um cabeçalho colado no fim do texto ainda pode crescer ("Capítulo 1" -> "Capítulo 12")
+        marcas = [(m.start(), int(m.group(1))) for m in PADRAO_CABECALHO_CAPITULO.finditer(self.texto)
+                  if m.end() < len(self.texto)]
+        if marcas and self.parte_global is None:
+            self.parte_global = self.texto[:marcas[0][0]].strip()
+        prontos = []
+        for indice in range(len(marcas) - 1):
+            inicio, numero = marcas[indice]
+            trecho = self.texto[inicio:marcas[indice + 1][0]].strip()
+            if numero not in self._entregues and len(trecho.split()) >= self.palavras_minimas:
+                self._entregues.add(numero)
+                prontos.append((numero, trecho))
+        return prontos
+
+    def concluir(self):
+        """Fim do streaming: retorna a parte global e os capítulos ainda não entregues."""
+        parte_global, trechos = separar_estrutura(self.texto, self.palavras_minimas)
+        self.parte_global = parte_global
+        restantes = [(n, t) for n, t in sorted(trechos.items()) if n not in self._entregues]
+        self._entregues.update(trechos)
+        return restantes
+
+
+# Estrutura tipada: a estrutura em texto livre interpretada uma única vez em um dicionário
+# `{"titulo", "subtitulo", "personagens", "arco", "texto_global", "capitulos"}`, salvo em `estrutura.json`
+ARQUIVO_ESTRUTURA = "estrutura.json"
+# Palavras máximas da parte global compacta (enviada em todos os capítulos)
+PALAVRAS_DESCRICAO_PERSONAGEM = 40
+PALAVRAS_ARCO = 150
+# Sinopses dos capítulos vizinhos que acompanham a do capítulo (de cada lado) e o seu tamanho máximo;
+# a sinopse do próprio capítulo vai inteira
+CAPITULOS_VIZINHOS = int(os.getenv("ESTRUTURA_CAPITULOS_VIZINHOS", "1"))
+PALAVRAS_SINOPSE_VIZINHA = 60
+
+# Rótulo no início da linha: "Título: ...", "**Arco narrativo:** ...", "## Personagens"
+PADRAO_ROTULO = re.compile(r'^[#*_\s\-•\d.]*([A-Za-zÀ-ÿ][A-Za-zÀ-ÿ ]{1,40}?)[*_\s]*(?::[*_\s]*(.*))?$')
+# Linha só com o nome de um personagem, em negrito ou como título ("**Ana Souza**", "### Ana Souza")
+PADRAO_NOME_SOLTO = re.compile(r'^[#*_\s\-•\d.]*([A-ZÀ-Ý][a-zà-ÿ]+(?:\s+(?:d[aeo]s?\s+)?[A-ZÀ-Ý][a-zà-ÿ]+){0,2})[*_\s]*$')
+# Linha que abre uma seção sem conteúdo próprio: "## Temas", "**Sumário**", "Sumário:"
+PADRAO_CABECALHO_SECAO = re.compile(r'^\s*(?:#.*|\*\*[^*]+\*\*:?|[^:*]{1,40}:)\s*$')
+
+
+def _encurtar(texto, palavras):
+    partes = (texto or "").split()
+    return " ".join(partes[:palavras]) + (" [...]" if len(partes) > palavras else "")
+
+
+def _limpar(texto):
+    return (texto or "").strip().strip('#*_"“”').strip()
+
+
+def _secao(linha):
+    """Seção da parte global que a linha rotula e o conteúdo na mesma linha: `(secao, valor)` ou `(None, None)`."""
+    correspondencia = PADRAO_ROTULO.match(linha)
+    if not correspondencia:
+        return None, None
+    palavras = sem_acentos(correspondencia.group(1)).split()
+    if len(palavras) > 3:
+        return None, None
+    for secao, chaves in (("subtitulo", {"subtitulo"}), ("titulo", {"titulo"}),
+                          ("personagens", {"personagens", "personagem"}), ("arco", {"arco", "enredo"})):
+        if chaves & set(palavras):
+            return secao, _limpar(correspondencia.group(2))
+    return None, None
+
+
+def interpretar_parte_global(parte_global):
+    """
+    Interpreta a parte global da estrutura (antes do primeiro capítulo) em
+    `{"titulo", "subtitulo", "personagens", "arco", "texto_global"}`.
+
+    `personagens` é uma lista `{"nome", "descricao"}`, com as linhas seguintes
+    ao nome acumuladas na descrição. `texto_global` guarda o texto original, usado
+    quando nenhum personagem nem arco é reconhecido.
+    """
+    estrutura = {"titulo": "", "subtitulo": "", "personagens": [], "arco": "", "texto_global": (parte_global or "").strip()}
+    secao = None
+    arco = []
+    for linha in estrutura["texto_global"].splitlines():
+        if not linha.strip():
+            continue
+        rotulo, valor = _secao(linha)
+        if rotulo in ("titulo", "subtitulo"):
+            estrutura[rotulo] = estrutura[rotulo] or valor
+            continue
+        if rotulo:
+            secao = rotulo
+            if valor and secao == "arco":
+                arco.append(valor)
+            continue
+        if secao == "personagens":
+            correspondencia = PADRAO_LINHA_PERSONAGEM.match(linha) or PADRAO_NOME_SOLTO.match(linha)
+            nome = correspondencia.group(1).strip() if correspondencia else ""
+            primeira = sem_acentos(nome.split()[0]) if nome else ""
+            if nome and primeira not in PALAVRAS_NAO_NOMES and primeira not in ROTULOS_DESCRICAO:
+                estrutura["personagens"].append({"nome": nome, "descricao": linha[correspondencia.end():].strip(" *_:-–—")})
+                continue
+        if PADRAO_CABECALHO_SECAO.match(linha) and not ROTULOS_DESCRICAO & set(sem_acentos(linha).split()[:2]):
+            # Outra seção ("## Temas", "Sumário:"); o primeiro cabeçalho pode ser o título do livro
+            if secao is None and not estrutura["titulo"] and linha.lstrip().startswith("#"):
+                estrutura["titulo"] = _limpar(linha)
+            secao = None
+        elif secao == "personagens" and estrutura["personagens"]:
+            personagem = estrutura["personagens"][-1]
+            personagem["descricao"] = f"{personagem['descricao']} {linha.strip(' *_-•')}".strip()
+        elif secao == "arco":
+            arco.append(linha.strip(' *_-•'))
+    estrutura["arco"] = " ".join(arco)
+    return estrutura
+
+
+def interpretar_capitulo(numero, trecho):
+    """Capítulo `{"numero", "titulo", "sinopse"}` a partir do seu trecho da estrutura ("Capítulo N: título" e resumo)."""
+    linhas = (trecho or "").strip().splitlines()
+    cabecalho = PADRAO_CABECALHO_CAPITULO.match(linhas[0]) if linhas else None
+    titulo = _limpar(linhas[0][cabecalho.end():].strip(' *_:.-–—')) if cabecalho else ""
+    sinopse = "\n".join(linha.strip() for linha in linhas[1 if cabecalho else 0:] if linha.strip())
+    return {"numero": numero, "titulo": titulo or f"Capítulo {numero}", "sinopse": sinopse}
+
+
+def interpretar_estrutura(texto, num_capitulos):
+    """Estrutura tipada do livro, com exatamente `num_capitulos` capítulos (os que faltarem ficam sem sinopse)."""
+    parte_global, trechos = separar_estrutura(texto or "")
+    estrutura = interpretar_parte_global(parte_global)
+    estrutura["capitulos"] = [interpretar_capitulo(numero, trechos.get(numero, "")) for numero in range(1, num_capitulos + 1)]
+    return estrutura
+
+
+def carregar_estrutura(livro_dir, texto, num_capitulos):
+    """
+    Estrutura tipada do livro salva em `estrutura.json`, interpretada de novo (e
+    salva) só se o arquivo não existir ou tiver vindo de outro texto da estrutura.
+    """
+    arquivo = os.path.join(livro_dir, ARQUIVO_ESTRUTURA)
+    if os.path.exists(arquivo):
+        try:
+            with open(arquivo, 'r', encoding='utf-8') as f:
+                dados = json.load(f)
+            if dados.get("hash") == hash_texto(texto) and len(dados.get("capitulos", [])) == num_capitulos:
+                return dados
+        except Exception as e:
+            print(f"Erro ao ler {arquivo}: {e}")
+    estrutura = interpretar_estrutura(texto, num_capitulos)
+    estrutura["hash"] = hash_texto(texto)
+    escrever_json_atomico(arquivo, estrutura)
+    return estrutura
+
+
+def formatar_parte_global(estrutura):
+    """Parte global compacta enviada em todos os capítulos: título, personagens e arco, com tamanho limitado."""
+    if not estrutura["personagens"] and not estrutura["arco"]:
+        return estrutura["texto_global"]
+    linhas = []
+    if estrutura["titulo"]:
+        linhas.append(f"Título: {estrutura['titulo']}")
+    if estrutura["subtitulo"]:
+        linhas.append(f"Subtítulo: {estrutura['subtitulo']}")
+    if estrutura["personagens"]:
+        linhas.append("Personagens:")
+        linhas.extend(f"- {p['nome']}: {_encurtar(p['descricao'], PALAVRAS_DESCRICAO_PERSONAGEM)}".rstrip(": ")
+                      for p in estrutura["personagens"])
+    if estrutura["arco"]:
+        linhas.append(f"Arco narrativo: {_encurtar(estrutura['arco'], PALAVRAS_ARCO)}")
+    return "\n".join(linhas)
+
+
+def contexto_capitulo(capitulos, numero, vizinhos=CAPITULOS_VIZINHOS):
+    """
+    Trecho da estrutura enviado com o capítulo `numero`: a sua sinopse inteira e
+    as dos `vizinhos` capítulos de cada lado, encurtadas. `capitulos` mapeia o
+    número aos capítulos já conhecidos (durante o streaming, só os que chegaram).
+    """
+    capitulo = capitulos.get(numero)
+    if not capitulo or not capitulo["sinopse"]:
+        return ""
+    texto = f"RESUMO DESTE CAPÍTULO NA ESTRUTURA:\nCapítulo {numero}: {capitulo['titulo']}\n{capitulo['sinopse']}"
+    proximos = [capitulos[n] for n in range(numero - vizinhos, numero + vizinhos + 1)
+                if n != numero and n in capitulos and capitulos[n]["sinopse"]]
+    if proximos:
+        texto += "\n\nCAPÍTULOS VIZINHOS NA ESTRUTURA (só para a continuidade; não os escreva):\n" + "\n".join(
+            f"- Capítulo {c['numero']} ({c['titulo']}): {_encurtar(c['sinopse'], PALAVRAS_SINOPSE_VIZINHA)}"
+            for c in proximos)
+    return texto
+
+
+def _normalizar_capitulo(item):
+    if isinstance(item, str):
+        item = {"titulo": item}
+    if not isinstance(item, dict):
+        return None
+    titulo = PADRAO_PREFIXO_TITULO.sub('', _primeiro(item, "titulo", "title", "nome")).strip('"\'').strip()
+    return {"titulo": titulo, "sinopse": _primeiro(item, "sinopse", "resumo", "synopsis", "summary", "descricao")}
+
+
+class LeitorSumario:
+    """
+    Lê o sumário em JSON enquanto ele chega em streaming.
+
+    Espera um objeto com as listas `personagens`, `titulos` e `capitulos`, nessa
+    ordem. Cada item de lista é interpretado assim que se fecha; `alimentar(delta)`
+    retorna os capítulos `{"numero", "titulo", "sinopse"}` que acabaram de chegar.
+    `listas_concluidas` guarda o nome das listas já fechadas, para saber quando
+    `personagens` e `titulos` (a parte global do sumário) estão completos.
+    """
+
+    def __init__(self, num_capitulos):
+        self.num_capitulos = num_capitulos
+        self.texto = ""
+        self.personagens = []
+        self.titulos = []
+        self.capitulos = []
+        self.listas_concluidas = set()
+        self._posicao = 0
+        self._pilha = []
+        self._em_string = False
+        self._escape = False
+        self._lista_atual = None
+        self._inicio_item = None
+
+    def alimentar(self, delta):
+        self.texto += delta
+        novos = []
+        while self._posicao < len(self.texto):
+            posicao = self._posicao
+            caractere = self.texto[posicao]
+            self._posicao += 1
+            no_item = self._pilha == ['{', '[']
+            if self._em_string:
+                if self._escape:
+                    self._escape = False
+                elif caractere == '\\':
+                    self._escape = True
+                elif caractere == '"':
+                    self._em_string = False
+                    if no_item and self._inicio_item is not None:
+                        # Item de lista que é só uma string (ex.: um título)
+                        novos.extend(self._fechar_item(posicao))
+                continue
+            if caractere == '"':
+                self._em_string = True
+                if no_item and self._inicio_item is None:
+                    self._inicio_item = posicao
+            elif caractere in '{[':
+                if self._pilha == ['{'] and caractere == '[':
+                    chave = re.search(r'"(\w+)"\s*:\s*$', self.texto[:posicao])
+                    self._lista_atual = chave.group(1) if chave else None
+                elif no_item and self._inicio_item is None:
+                    self._inicio_item = posicao
+                self._pilha.append(caractere)
+            elif caractere in '}]' and self._pilha:
+                self._pilha.pop()
+                if self._pilha == ['{', '['] and self._inicio_item is not None:
+                    novos.extend(self._fechar_item(posicao))
+                elif self._pilha == ['{'] and caractere == ']':
+                    self.listas_concluidas.add(self._lista_atual)
+                    self._lista_atual = None
+        return novos
+
+    def _fechar_item(self, fim):
+        trecho = self.texto[self._inicio_item:fim + 1]
+        self._inicio_item = None
+        try:
+            item = json.loads(trecho)
+        except ValueError:
+            return []
+        if self._lista_atual == "personagens":
+            self.personagens.append(item)
+        elif self._lista_atual == "titulos" and isinstance(item, str):
+            self.titulos.append(PADRAO_PREFIXO_TITULO.sub('', item).strip('"\'').strip())
+        elif self._lista_atual in ("capitulos", "chapters", "sumario") and len(self.capitulos) < self.num_capitulos:
+            capitulo = _normalizar_capitulo(item)
+            if capitulo is not None:
+                capitulo["numero"] = len(self.capitulos) + 1
+                if not capitulo["titulo"]:
+                    capitulo["titulo"] = (self.titulos[len(self.capitulos)] if len(self.titulos) > len(self.capitulos)
+                                          else f"Capítulo {capitulo['numero']}")
+                self.capitulos.append(capitulo)
+                return [capitulo]
+        return []
@@ -0,0 +1,286 @@
+import os
+import json
+import asyncio
+import time
+import hashlib
+import threading
+from collections import deque
+from multiprocessing.managers import BaseManager
+
+import httpx
+
+from metrics import contar_nova_tentativa
+
+# Limites iniciais (podem ser ajustados por variáveis de ambiente)
+RPM_INICIAL = int(os.getenv("OPENAI_RPM_INICIAL", "60"))
+TPM_INICIAL = int(os.getenv("OPENAI_TPM_INICIAL", "150000"))
+RPM_MAXIMO = int(os.getenv("OPENAI_RPM_MAXIMO", "5000"))
+TPM_MAXIMO = int(os.getenv("OPENAI_TPM_MAXIMO", "2000000"))
+
+JANELA_SEGUNDOS = 60.0
+
+
+class LimitadorTaxa:
+    """
+    Limitador adaptativo de requisições por minuto (RPM) e tokens por minuto (TPM).
+
+    Usa uma janela deslizante de 60 segundos e ajusta os limites com AIMD:
+    cada resposta bem-sucedida aumenta os limites de forma aditiva e cada 429
+    os reduz de forma multiplicativa, respeitando o cabeçalho `Retry-After`.
+    """
+
+    def __init__(self, rpm=RPM_INICIAL, tpm=TPM_INICIAL, rpm_minimo=3, tpm_minimo=10000,
+                 rpm_maximo=RPM_MAXIMO, tpm_maximo=TPM_MAXIMO, incremento_rpm=1.0,
+                 incremento_tpm=1000.0, fator_reducao=0.5):
+        self.rpm = float(rpm)
+        self.tpm = float(tpm)
+        self.rpm_minimo = rpm_minimo
+        self.tpm_minimo = tpm_minimo
+        self.rpm_maximo = rpm_maximo
+        self.tpm_maximo = tpm_maximo
+        self.incremento_rpm = incremento_rpm
+        self.incremento_tpm = incremento_tpm
+        self.fator_reducao = fator_reducao
+        self.pausa_ate = 0.0
+        self.total_429 = 0
+        self._janela = deque()  # (instante, tokens)
+        self._tokens_janela = 0
+        self._lock = threading.Lock()
+
+    def _limpar_janela(self, agora):
+        while self._janela and agora - self._janela[0][0] >= JANELA_SEGUNDOS:
+            _, tokens = self._janela.popleft()
+            self._tokens_janela -= tokens
+
+    def _reservar(self, tokens):
+        """Tenta reservar uma requisição. Retorna 0 se reservou, ou quantos segundos esperar."""
+        with self._lock:
+            agora = time.monotonic()
+            if agora < self.pausa_ate:
+                return self.pausa_ate - agora
+            self._limpar_janela(agora)
+            # Uma requisição maior que o limite de tokens inteiro passa sozinha com a janela vazia
+            tokens_cabem = self._tokens_janela + tokens <= self.tpm or not self._janela
+            if len(self._janela) < int(self.rpm) and tokens_cabem:
+                self._janela.append((agora, tokens))
+                self._tokens_janela += tokens
+                return 0
+            # Esperar até a requisição mais antiga sair da janela
+            return max(0.05, JANELA_SEGUNDOS - (agora - self._janela[0][0]))
+
+    def adquirir(self, tokens=0):
+        """Bloqueia até que a requisição possa ser enviada."""
+        while True:
+            espera = self._reservar(tokens)
+            if espera <= 0:
+                return
+            time.sleep(min(espera, 1.0))
+
+    async def adquirir_async(self, tokens=0):
+        """Versão assíncrona de `adquirir`: espera sem bloquear o loop de eventos."""
+        while True:
+            espera = self._reservar(tokens)
+            if espera <= 0:
+                return
+            await asyncio.sleep(min(espera, 1.0))
+
+    def registrar_sucesso(self):
+        """Aumento aditivo dos limites após uma resposta bem-sucedida."""
+        with self._lock:
+            self.rpm = min(self.rpm_maximo, self.rpm + self.incremento_rpm)
+            self.tpm = min(self.tpm_maximo, self.tpm + self.incremento_tpm)
+
+    def registrar_limite(self, retry_after=None):
+        """Redução multiplicativa dos limites após um 429."""
+        with self._lock:
+            self.total_429 += 1
+            self.rpm = max(self.rpm_minimo, self.rpm * self.fator_reducao)
+            self.tpm = max(self.tpm_minimo, self.tpm * self.fator_reducao)
+            if retry_after:
+                self.pausa_ate = max(self.pausa_ate, time.monotonic() + retry_after)
+
+    def ajustar_maximos(self, rpm_maximo=None, tpm_maximo=None):
+        """Limita o crescimento aos valores informados pela API nos cabeçalhos x-ratelimit-*."""
+        with self._lock:
+            if rpm_maximo:
+                self.rpm_maximo = rpm_maximo
+                self.rpm = min(self.rpm, rpm_maximo)
+            if tpm_maximo:
+                self.tpm_maximo = tpm_maximo
+                self.tpm = min(self.tpm, tpm_maximo)
+
+    def estado(self):
+        with self._lock:
+            return {
+                "rpm": round(self.rpm, 1),
+                "tpm": round(self.tpm),
+                "requisicoes_na_janela": len(self._janela),
+                "tokens_na_janela": self._tokens_janela,
+                "total_429": self.total_429
+            }
+
+
+class GerenciadorLimitador(BaseManager):
+    """Processo servidor (multiprocessing Manager) que hospeda um `LimitadorTaxa` para vários processos."""
+
+
+GerenciadorLimitador.register(
+    "LimitadorTaxa", LimitadorTaxa,
+    exposed=("_reservar", "registrar_sucesso", "registrar_limite", "ajustar_maximos", "estado")
+)
+
+
+class LimitadorCompartilhado:
+    """
+    Interface local de um `LimitadorTaxa` hospedado em um `GerenciadorLimitador`.
+
+    Só a reserva (`_reservar`) e os ajustes vão ao processo servidor; a espera
+    acontece neste processo, sem ocupar o servidor enquanto dorme.
+    """
+
+    def __init__(self, proxy):
+        self._proxy = proxy
+
+    def adquirir(self, tokens=0):
+        while True:
+            espera = self._proxy._callmethod("_reservar", (tokens,))
+            if espera <= 0:
+                return
+            time.sleep(min(espera, 1.0))
+
+    async def adquirir_async(self, tokens=0):
+        while True:
+            espera = await asyncio.to_thread(self._proxy._callmethod, "_reservar", (tokens,))
+            if espera <= 0:
+                return
+            await asyncio.sleep(min(espera, 1.0))
+
+    def registrar_sucesso(self):
+        self._proxy.registrar_sucesso()
+
+    def registrar_limite(self, retry_after=None):
+        self._proxy.registrar_limite(retry_after)
+
+    def ajustar_maximos(self, rpm_maximo=None, tpm_maximo=None):
+        self._proxy.ajustar_maximos(rpm_maximo, tpm_maximo)
+
+    def estado(self):
+        return self._proxy.estado()
+
+
+# Um limitador por chave de API, compartilhado por todo o processo
+_limitadores = {}
+_limitadores_lock = threading.Lock()
+# Limitador entre processos (ex.: lote de livros): quando definido, vale para todas as chaves
+_limitador_compartilhado = None
+
+
+def usar_limitador_compartilhado(limitador):
+    """
+    Faz este processo usar `limitador` (um `LimitadorCompartilhado`) em todos os
+    clientes criados daqui em diante. Chamado no início de cada processo worker.
+    """
+    global _limitador_compartilhado
+    _limitador_compartilhado = limitador
+
+
+def obter_limitador(api_key=None):
+    """Retorna o limitador do processo associado à chave de API."""
+    if _limitador_compartilhado is not None:
+        return _limitador_compartilhado
+    api_key = api_key or os.getenv("OPENAI_API_KEY") or ""
+    chave = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+    with _limitadores_lock:
+        if chave not in _limitadores:
+            _limitadores[chave] = LimitadorTaxa()
+        return _limitadores[chave]
+
+
+def estimar_tokens_requisicao(corpo):
+    """Estima os tokens de uma requisição de chat (prompt + max_tokens) a partir do corpo JSON."""
+    try:
+        dados = json.loads(corpo or b"{}")
+    except (ValueError, TypeError):
+        return 0
+    caracteres = sum(len(str(m.get("content") or "")) for m in dados.get("messages", []))
+    return caracteres // 4 + int(dados.get("max_tokens") or dados.get("max_completion_tokens") or 0)
+
+
+def ler_retry_after(headers):
+    """Lê o tempo de espera sugerido pela API (Retry-After ou retry-after-ms), em segundos."""
+    valor_ms = headers.get("retry-after-ms")
+    if valor_ms:
+        try:
+            return float(valor_ms) / 1000
+        except ValueError:
+            pass
+    valor = headers.get("retry-after")
+    if valor:
+        try:
+            return float(valor)
+        except ValueError:
+            return None
+    return None
+
+
+def _registrar_resposta(limitador, response):
+    if response.status_code == 429 or response.status_code >= 500:
+        # O SDK repete essas respostas automaticamente; contamos a nova tentativa na chamada em andamento
+        contar_nova_tentativa()
+    if response.status_code == 429:
+        limitador.registrar_limite(ler_retry_after(response.headers))
+        return
+    if response.status_code < 400:
+        limitador.registrar_sucesso()
+        try:
+            limitador.ajustar_maximos(
+                int(response.headers.get("x-ratelimit-limit-requests", 0)) or None,
+                int(response.headers.get("x-ratelimit-limit-tokens", 0)) or None
+            )
+        except ValueError:
+            pass
+
+
+def criar_http_client(api_key=None):
+    """
+    Cria um cliente httpx que passa todas as chamadas pelo limitador da chave de API.
+
+    Pode ser usado tanto em `OpenAI(http_client=...)` quanto em `ChatOpenAI(http_client=...)`.
+    Os ganchos rodam em cada tentativa, inclusive nas novas tentativas automáticas do SDK.
+    """
+    limitador = obter_limitador(api_key)
+
+    def ao_enviar(request):
+        try:
+            corpo = request.content
+        except httpx.RequestNotRead:
+            corpo = None
+        limitador.adquirir(estimar_tokens_requisicao(corpo))
+
+    def ao_receber(response):
+        _registrar_resposta(limitador, response)
+
+    return httpx.Client(
+        timeout=httpx.Timeout(600.0, connect=10.0),
+        event_hooks={"request": [ao_enviar], "response": [ao_receber]}
+    )
+
+
+def criar_http_client_async(api_key=None):
+    """Equivalente assíncrono de `criar_http_client`, para `AsyncOpenAI(http_client=...)`."""
+    limitador = obter_limitador(api_key)
+
+    async def ao_enviar(request):
+        try:
+            corpo = request.content
+        except httpx.RequestNotRead:
+            corpo = None
+        await limitador.adquirir_async(estimar_tokens_requisicao(corpo))
+
+    async def ao_receber(response):
+        _registrar_resposta(limitador, response)
+
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(600.0, connect=10.0),
+        event_hooks={"request": [ao_enviar], "response": [ao_receber]}
+    )
@@ -0,0 +1,154 @@
+import os
+import json
+
+from metrics import medir_chamada
+from routing import executar_com_llm, ETAPA_RESUMOS
+from cancelamento import LivroCancelado
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken é opcional; sem ele usamos uma estimativa por caracteres
+    tiktoken = None
+
+ARQUIVO_RESUMOS = "resumos.json"
+
+
+def estimar_tokens(texto, modelo="gpt-4o-mini"):
+    """
+    Conta (ou estima, sem tiktoken) o número de tokens de um texto.
+
+    Nunca falha: se o tiktoken não conseguir carregar a codificação (ex.: sem acesso
+    à rede para baixá-la), passa a usar a estimativa por caracteres no processo todo.
+    """
+    global tiktoken
+    if not texto:
+        return 0
+    if tiktoken is not None:
+        try:
+            try:
+                return len(tiktoken.encoding_for_model(modelo).encode(texto))
+            except KeyError:
+                return len(tiktoken.get_encoding("cl100k_base").encode(texto))
+        except Exception as e:
+            print(f"tiktoken indisponível ({e}); usando a estimativa de tokens por caracteres.")
+            tiktoken = None
+    # Aproximação usual: ~4 caracteres por token
+    return max(1, len(texto) // 4)
+
+
+def contexto_legado(capitulos_conteudo):
+    """
+    Reproduz o contexto antigo (início e fim de todos os capítulos anteriores).
+
+    Usado apenas para medir a economia de tokens da memória de resumos.
+    """
+    contexto = ""
+    for j, capitulo in enumerate(capitulos_conteudo):
+        contexto += f"\n--- CAPÍTULO {j+1} ---\n"
+        cap_paragrafos = capitulo.split('\n\n')
+        if len(cap_paragrafos) > 6:
+            inicio = '\n\n'.join(cap_paragrafos[:3])
+            fim = '\n\n'.join(cap_paragrafos[-3:])
+            contexto += f"\n{inicio}\n\n[...]\n\n{fim}\n"
+        else:
+            contexto += f"\n{capitulo}\n"
+    return contexto
+
+
+class MemoriaResumos:
+    """
+    Memória incremental de resumos de capítulos, salva em `resumos.json` no diretório do livro.
+
+    Cada capítulo é resumido uma única vez. O contexto do próximo capítulo recebe
+    todos os resumos anteriores e apenas o final completo do capítulo imediatamente
+    anterior, então o contexto cresce linearmente com o número de capítulos.
+    """
+
+    def __init__(self, livro_dir, paragrafos_finais=6, palavras_resumo=120, livro_id=None, cancelamento=None):
+        self.arquivo = os.path.join(livro_dir, ARQUIVO_RESUMOS)
+        self.livro_id = livro_id
+        self.cancelamento = cancelamento
+        self.paragrafos_finais = paragrafos_finais
+        self.palavras_resumo = palavras_resumo
+        self.resumos = {}
+        self.tokens_contexto = 0
+        self.tokens_contexto_legado = 0
+        self.tokens_resumos = 0
+        if os.path.exists(self.arquivo):
+            try:
+                with open(self.arquivo, 'r', encoding='utf-8') as f:
+                    self.resumos = {int(k): v for k, v in json.load(f).items()}
+            except Exception as e:
+                print(f"Erro ao ler {self.arquivo}: {e}")
+
+    def salvar(self):
+        with open(self.arquivo, 'w', encoding='utf-8') as f:
+            json.dump({str(k): v for k, v in sorted(self.resumos.items())}, f, ensure_ascii=False, indent=2)
+
+    def adicionar(self, numero, resumo):
+        self.resumos[numero] = resumo.strip()
+        self.salvar()
+
+    def resumir(self, numero, texto):
+        """Gera (uma única vez) o resumo compacto do capítulo, com o modelo da rota de resumos, e o salva."""
+        if numero in self.resumos:
+            return self.resumos[numero]
+        prompt = f"""Resuma o capítulo {numero} abaixo em no máximo {self.palavras_resumo} palavras.
+Inclua os acontecimentos principais, os personagens envolvidos (com os nomes exatos) e como o capítulo termina.
+Responda somente com o resumo.
+
+{texto}"""
+        self.tokens_resumos += estimar_tokens(prompt)
+        def invocar(llm):
+            with medir_chamada(getattr(llm, "model_name", None), self.livro_id, numero, "resumo") as chamada:
+                chamada["resposta"] = llm.invoke(prompt)
+            return chamada["resposta"]
+
+        try:
+            resposta = executar_com_llm(ETAPA_RESUMOS, invocar, self.cancelamento)
+            resumo = str(getattr(resposta, "content", resposta))
+        except LivroCancelado:
+            raise
+        except Exception as e:
+            print(f"Erro ao resumir capítulo {numero}: {str(e)}")
+            # Sem resumo do modelo, usamos o último parágrafo como resumo mínimo
+            resumo = texto.split('\n\n')[-1][:800]
+        self.adicionar(numero, resumo)
+        return self.resumos[numero]
+
+    def montar_contexto(self, capitulo_num, texto_anterior, resumos_recentes=None):
+        """
+        Monta o contexto de continuidade para o capítulo `capitulo_num`.
+
+        Com `resumos_recentes`, só os resumos dos últimos capítulos são enviados (a
+        continuidade mais antiga fica a cargo do índice de entidades).
+        """
+        if capitulo_num <= 1:
+            return ""
+        contexto = "\nRESUMO DOS CAPÍTULOS ANTERIORES:\n"
+        primeiro = max(1, capitulo_num - resumos_recentes) if resumos_recentes else 1
+        for numero in range(primeiro, capitulo_num):
+            if numero in self.resumos:
+                contexto += f"\n--- CAPÍTULO {numero} ---\n{self.resumos[numero]}\n"
+        final = '\n\n'.join(texto_anterior.split('\n\n')[-self.paragrafos_finais:])
+        contexto += f"\nFINAL DO CAPÍTULO {capitulo_num - 1}:\n{final}\n"
+        return contexto
+
+    def registrar_economia(self, contexto_novo, contexto_antigo):
+        """Acumula os tokens do contexto novo e do contexto que seria enviado no modo antigo."""
+        self.tokens_contexto += estimar_tokens(contexto_novo)
+        self.tokens_contexto_legado += estimar_tokens(contexto_antigo)
+
+    def relatorio(self):
+        economia = self.tokens_contexto_legado - self.tokens_contexto
+        percentual = (economia / self.tokens_contexto_legado * 100) if self.tokens_contexto_legado else 0.0
+        return {
+            "tokens_contexto": self.tokens_contexto,
+            "tokens_contexto_legado": self.tokens_contexto_legado,
+            "tokens_economizados": economia,
+            "economia_percentual": round(percentual, 1),
+            # Custo das chamadas de resumo (cada capítulo é resumido uma vez)
+            "tokens_resumos": self.tokens_resumos,
+            "tokens_economizados_liquidos": economia - self.tokens_resumos,
+            "contagem_exata": tiktoken is not None
+        }
@@ -0,0 +1,153 @@
+import os
+import json
+import time
+import asyncio
+import threading
+
+from rate_limiter import criar_http_client
+from cancelamento import PRAZO_CHAMADA, executar_com_prazo
+
+# Etapas do pipeline com modelo próprio na tabela de rotas
+ETAPA_TITULOS = "titulos"        # sumário do gerador assíncrono (títulos e sinopses)
+ETAPA_ESTRUTURA = "estrutura"    # estrutura do livro (app.py)
+ETAPA_PROSA = "prosa"            # capítulos e continuações
+ETAPA_RESUMOS = "resumos"        # memória de resumos do modo sequencial
+ETAPA_REVISAO = "revisao"        # revisão de transições e trechos sinalizados
+
+# Rota padrão de cada etapa: modelo, temperatura, max_tokens e modelos alternativos,
+# usados em ordem quando o modelo da rota estiver limitado (429 mesmo após as novas tentativas)
+ROTAS_PADRAO = {
+    ETAPA_TITULOS: {"modelo": "gpt-4o-mini", "temperatura": 0.7, "max_tokens": 4000, "alternativos": ["gpt-3.5-turbo"]},
+    ETAPA_ESTRUTURA: {"modelo": "gpt-4o-mini", "temperatura": 0.7, "max_tokens": 3000, "alternativos": ["gpt-3.5-turbo"]},
+    ETAPA_PROSA: {"modelo": "gpt-4o-mini", "temperatura": 0.7, "max_tokens": 4000, "alternativos": ["gpt-3.5-turbo"]},
+    ETAPA_RESUMOS: {"modelo": "gpt-4o-mini", "temperatura": 0.2, "max_tokens": 2000, "alternativos": ["gpt-3.5-turbo"]},
+    ETAPA_REVISAO: {"modelo": "gpt-4o-mini", "temperatura": 0.2, "max_tokens": 2000, "alternativos": ["gpt-3.5-turbo"]},
+}
+
+# Por quanto tempo um modelo limitado fica fora das rotas (as chamadas vão direto para os alternativos)
+ESPERA_MODELO_LIMITADO = float(os.getenv("ROTA_ESPERA_LIMITADO", "60"))
+
+
+def carregar_rotas():
+    """
+    Tabela de rotas: `ROTAS_PADRAO` com as alterações de `ROTAS_MODELOS`.
+
+    `ROTAS_MODELOS` pode ser o caminho de um arquivo JSON ou o próprio JSON, com
+    só os campos a alterar por etapa, ex.: `{"prosa": {"modelo": "gpt-4o", "max_tokens": 6000}}`.
+    """
+    rotas = {etapa: dict(rota) for etapa, rota in ROTAS_PADRAO.items()}
+    configuracao = os.getenv("ROTAS_MODELOS", "").strip()
+    if not configuracao:
+        return rotas
+    try:
+        if os.path.exists(configuracao):
+            with open(configuracao, 'r', encoding='utf-8') as f:
+                alteracoes = json.load(f)
+        else:
+            alteracoes = json.loads(configuracao)
+    except Exception as e:
+        print(f"Erro ao ler ROTAS_MODELOS ({e}); usando as rotas padrão.")
+        return rotas
+    for etapa, campos in alteracoes.items():
+        rotas.setdefault(etapa, dict(ROTAS_PADRAO[ETAPA_PROSA])).update(campos)
+    return rotas
+
+
+ROTAS = carregar_rotas()
+
+# Modelos limitados recentemente: modelo -> instante (monotonic) até quando evitá-lo
+_limitados = {}
+_limitados_lock = threading.Lock()
+
+
+def obter_rota(etapa):
+    """Rota (modelo, temperatura, max_tokens, alternativos) da etapa."""
+    return dict(ROTAS[etapa])
+
+
+def modelo_limitado(erro):
+    """Indica se a exceção é um 429 (limite de taxa) que sobrou depois das novas tentativas do SDK."""
+    return getattr(erro, "status_code", None) == 429 or type(erro).__name__ == "RateLimitError"
+
+
+def _candidatos(rota):
+    modelos = [rota["modelo"]] + [m for m in rota.get("alternativos", []) if m != rota["modelo"]]
+    agora = time.monotonic()
+    with _limitados_lock:
+        disponiveis = [m for m in modelos if _limitados.get(m, 0) <= agora]
+    # Todos limitados: tentamos na ordem da rota mesmo assim
+    return disponiveis or modelos
+
+
+def _marcar_limitado(etapa, modelo, proximo):
+    with _limitados_lock:
+        _limitados[modelo] = time.monotonic() + ESPERA_MODELO_LIMITADO
+    print(f"Modelo {modelo} limitado na etapa '{etapa}'; usando {proximo}.")
+
+
+def executar_com_rota(etapa, chamar, cancelamento=None):
+    """
+    Executa `chamar(rota)` com a rota da etapa e, se o modelo estiver limitado,
+    repete com cada modelo alternativo (a mesma temperatura e o mesmo max_tokens).
+
+    Cada tentativa é medida por quem faz a chamada, com o modelo realmente usado,
+    então latência e custo ficam registrados por etapa e por modelo. Cada tentativa
+    tem no máximo `PRAZO_CHAMADA` segundos, contando as novas tentativas do SDK. Com
+    `cancelamento`, nenhuma tentativa começa depois de o livro ser cancelado, e o
+    cancelamento interrompe a espera pela tentativa em andamento.
+    """
+    rota = obter_rota(etapa)
+    candidatos = _candidatos(rota)
+    for indice, modelo in enumerate(candidatos):
+        if cancelamento is not None:
+            cancelamento.verificar()
+        try:
+            return executar_com_prazo(lambda: chamar({**rota, "modelo": modelo}), PRAZO_CHAMADA, cancelamento)
+        except Exception as e:
+            if not modelo_limitado(e) or indice == len(candidatos) - 1:
+                raise
+            _marcar_limitado(etapa, modelo, candidatos[indice + 1])
+
+
+async def executar_com_rota_async(etapa, chamar, cancelamento=None):
+    """Versão assíncrona de `executar_com_rota`: `chamar(rota)` retorna uma corrotina."""
+    rota = obter_rota(etapa)
+    candidatos = _candidatos(rota)
+    for indice, modelo in enumerate(candidatos):
+        if cancelamento is not None:
+            cancelamento.verificar()
+        try:
+            # O prazo vale para a tentativa inteira (streaming e novas tentativas do SDK incluídos)
+            return await asyncio.wait_for(chamar({**rota, "modelo": modelo}), PRAZO_CHAMADA or None)
+        except Exception as e:
+            if not modelo_limitado(e) or indice == len(candidatos) - 1:
+                raise
+            _marcar_limitado(etapa, modelo, candidatos[indice + 1])
+
+
+# Clientes de modelo compartilhados entre livros do mesmo processo, por chave de API e configuração
+_llms = {}
+_http_clients = {}
+_llms_lock = threading.Lock()
+
+
+def obter_llm(modelo, temperatura, max_tokens):
+    """Retorna um `ChatOpenAI` já construído para a chave de API atual (criado uma única vez por configuração)."""
+    from langchain_openai import ChatOpenAI
+
+    api_key = os.environ.get("OPENAI_API_KEY")
+    with _llms_lock:
+        if api_key not in _http_clients:
+            # Todas as chamadas passam pelo limitador de taxa compartilhado da chave de API
+            _http_clients[api_key] = criar_http_client(api_key)
+        chave = (api_key, modelo, temperatura, max_tokens)
+        if chave not in _llms:
+            _llms[chave] = ChatOpenAI(model_name=modelo, temperature=temperatura, max_tokens=max_tokens,
+                                      http_client=_http_clients[api_key], max_retries=6, timeout=PRAZO_CHAMADA)
+        return _llms[chave]
+
+
+def executar_com_llm(etapa, chamar, cancelamento=None):
+    """`executar_com_rota` para chamadas via langchain: `chamar(llm)` recebe o `ChatOpenAI` da rota."""
+    return executar_com_rota(etapa, lambda rota: chamar(obter_llm(rota["modelo"], rota["temperatura"], rota["max_tokens"])),
+                             cancelamento)
@@ -13,12 +13,15 @@ import firebase_admin
 from firebase_admin import credentials, firestore, auth
 import bcrypt
 import stripe
-from openai import OpenAI
 import hashlib
-import glob
 import webbrowser
 from firebase_setup import db, get_user_by_email, update_subscription_status
-from app import gerar_livro_generico
+from app import DIRETORIO_LIVROS as DIRETORIO_LIVROS_CREWAI
+from job_queue import FilaLivros, STATUS_PENDENTE, STATUS_EXECUTANDO, STATUS_CONCLUIDO, STATUS_ERRO, STATUS_CANCELADO
+from worker import garantir_workers_locais, TIPO_OPENAI, TIPO_CREWAI
+from manifest import listar_livros_interrompidos
+from book_store import ler_pagina, total_paginas, copiar_livro
+from metrics import obter_metricas
 
 # Função para atualizar o status da assinatura no Firestore
 def atualizar_status_assinatura(usuario_id, status):
@@ -66,6 +69,11 @@ ARQUIVO_USUARIOS = os.getenv("ARQUIVO_USUARIOS", "usuarios.csv")
 # Inicializar cliente OpenAI (será configurado pelo usuário)
 client = None
 
+# Fila persistente de jobs de geração (compartilhada entre as sessões)
+@st.cache_resource
+def obter_fila():
+    return FilaLivros()
+
 # Configuração da página (deve ser a primeira chamada Streamlit)
 st.set_page_config(
     page_title="Gerador de Livros para Amazon KDP",
@@ -202,46 +210,54 @@ def fazer_logout():
 # === DETECÇÃO DE LIVRO EM ANDAMENTO ===
 
 def verificar_livro_em_andamento():
-    """Verifica se há um livro em andamento e exibe opção para continuar."""
-    livros_existentes = sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'livro_*')), reverse=True)
-    livro_ultimo = None
-    metadata_ultimo = None
-    
-    if livros_existentes:
-        for pasta in livros_existentes:
-            metadata_path = os.path.join(pasta, 'metadata.json')
-            if os.path.exists(metadata_path):
-                try:
-                    with open(metadata_path, 'r', encoding='utf-8') as f:
-                        metadata_ultimo = json.load(f)
-                        livro_ultimo = pasta
-                        break
-                except Exception as e:
-                    print(f"Erro ao ler metadata.json: {e}")
-    
-    if livro_ultimo and metadata_ultimo and st.session_state.usuario["id"] is None:
-        with st.container():
-            st.warning("⚠️ Livro em andamento detectado!")
-            st.write(f"**Tema:** {metadata_ultimo.get('tema', 'Desconhecido')}")
-            st.write(f"**Autor:** {metadata_ultimo.get('autor', 'Desconhecido')}")
-            
-            if st.button('Continuar último livro'):
-                # Preencher os campos do formulário ao retomar
-                st.session_state.tema_livro = metadata_ultimo.get('tema', '')
-                st.session_state.autor_livro = metadata_ultimo.get('autor', '')
-                st.session_state.email_autor_livro = metadata_ultimo.get('email', '')
-                st.session_state.genero_livro = metadata_ultimo.get('genero', '')
-                st.session_state.estilo_livro = metadata_ultimo.get('estilo', '')
-                st.session_state.publico_alvo_livro = metadata_ultimo.get('publico_alvo', '')
-                st.session_state.descricao_livro = metadata_ultimo.get('descricao', '')
-                st.session_state.retomar_livro = True
-                st.success('Campos preenchidos! Faça login para continuar a geração do livro.')
-                st.rerun()
-        
-        st.markdown("<div style='background:#FFF4F4;padding:10px;border-radius:6px;margin:10px 0;color:#c00;font-weight:bold;'>"
-                   "Se a sessão cair, faça login novamente e clique em 'Continuar último livro' para retomar de onde parou.</div>", 
-                   unsafe_allow_html=True)
-        st.markdown("---")
+    """Verifica se há um livro interrompido e oferece retomá-lo a partir do seu manifesto."""
+    interrompidos = listar_livros_interrompidos(DIRETORIO_LIVROS_CREWAI)
+    if not interrompidos or st.session_state.usuario["id"] is not None:
+        return
+
+    livro_ultimo, manifesto_ultimo = interrompidos[0]
+    especificacao = manifesto_ultimo.get('especificacao', {})
+    concluidos = sum(1 for c in manifesto_ultimo.get('capitulos', {}).values() if c.get('status') == 'concluido')
+    with st.container():
+        st.warning("⚠️ Livro em andamento detectado!")
+        st.write(f"**Tema:** {especificacao.get('tema', 'Desconhecido')}")
+        st.write(f"**Autor:** {especificacao.get('autor', 'Desconhecido')}")
+        st.write(f"**Progresso:** estrutura {'pronta' if manifesto_ultimo.get('estrutura') else 'pendente'}, "
+                 f"{concluidos} de {especificacao.get('num_capitulos', '?')} capítulos gerados")
+
+        if st.button('Continuar último livro'):
+            # Preencher os campos do formulário e guardar o job a ser retomado
+            st.session_state.tema_livro = especificacao.get('tema', '')
+            st.session_state.autor_livro = especificacao.get('autor', '')
+            st.session_state.email_autor_livro = especificacao.get('email_autor', '')
+            st.session_state.genero_livro = especificacao.get('genero', '')
+            st.session_state.estilo_livro = especificacao.get('estilo', '')
+            st.session_state.publico_alvo_livro = especificacao.get('publico_alvo', '')
+            st.session_state.descricao_livro = especificacao.get('descricao', '')
+            st.session_state.retomar_livro = {"job_id": manifesto_ultimo['job_id'], "especificacao": especificacao}
+            st.success('Faça login para continuar a geração do livro de onde ela parou.')
+            st.rerun()
+
+    st.markdown("<div style='background:#FFF4F4;padding:10px;border-radius:6px;margin:10px 0;color:#c00;font-weight:bold;'>"
+               "Se a sessão cair, faça login novamente e clique em 'Continuar último livro' para retomar de onde parou.</div>", 
+               unsafe_allow_html=True)
+    st.markdown("---")
+
+def retomar_livro_interrompido():
+    """Envia para a fila a retomada do livro escolhido em `verificar_livro_em_andamento`."""
+    retomar = st.session_state.get('retomar_livro')
+    if not isinstance(retomar, dict):
+        return False
+    if not st.session_state.get('api_key'):
+        st.warning("⚠️ Informe sua chave da API da OpenAI para retomar o livro em andamento.")
+        return False
+    garantir_workers_locais()
+    parametros = dict(retomar["especificacao"], job_id=retomar["job_id"])
+    st.session_state.job_id = obter_fila().enfileirar(TIPO_CREWAI, parametros, usuario_id=st.session_state.usuario["id"],
+                                                      api_key=st.session_state.api_key)
+    st.session_state.retomar_livro = None
+    st.session_state.gerando_livro = True
+    return True
 
 # === ROTAS DA APLICAÇÃO ===
 
@@ -786,79 +802,11 @@ def exibir_criar_livro():
         gerar_livro()
 
 def gerar_livro():
-    """Gera o livro com base nos parâmetros fornecidos."""
-    # Cria um container para o progresso
-    progress_placeholder = st.empty()
-    result_placeholder = st.empty()
-    
-    # Define as etapas do processo
-    etapas = [
-        "Preparando estrutura do livro...",
-        f"Gerando {st.session_state.num_capitulos} capítulos...",
-        "Criando introdução e conclusão...",
-        "Revisando o conteúdo...",
-        "Formatando para publicação...",
-        "Finalizando..."
-    ]
-    
-    # Função de callback para atualizar o progresso
-    def callback_progresso(etapa, mensagem=None):
-        with progress_placeholder.container():
-            st.markdown(f"**Etapa {etapa}/{len(etapas)}: {mensagem or etapas[etapa-1]}")
-            st.progress(etapa / len(etapas))
-    
-    try:
-        # Inicia a geração do livro
-        with st.spinner("Iniciando geração do livro. Este processo pode levar alguns minutos..."):
-            # Chama a função de geração do livro da API
-            conteudo_livro = gerar_livro_generico(
-                tema=st.session_state.tema_livro,
-                api_key=st.session_state.api_key,
-                autor=st.session_state.autor_livro,
-                email_autor=st.session_state.email_autor_livro,
-                genero=st.session_state.genero_livro,
-                estilo=st.session_state.estilo_livro,
-                publico_alvo=st.session_state.publico_alvo_livro,
-                descricao=st.session_state.descricao_livro,
-                formato=st.session_state.formato_livro,
-                num_capitulos=st.session_state.num_capitulos,
-                callback=callback_progresso
-            )
-            
-            # Verifica se o conteúdo foi gerado corretamente
-            if not conteudo_livro or len(conteudo_livro) < 100:
-                st.error("❌ O conteúdo gerado parece estar vazio ou incompleto. Tente novamente com uma descrição mais detalhada.")
-                return
-            
-            # Salva o conteúdo na sessão
-            st.session_state.conteudo_livro = conteudo_livro
-            st.session_state.livro_gerado = True
-            
-            # Exibe mensagem de sucesso
-            st.success("✅ Livro gerado com sucesso!")
-            st.balloons()
-            
-            # Exibe o conteúdo gerado
-            with st.expander("📖 Visualizar Livro", expanded=True):
-                st.markdown(conteudo_livro, unsafe_allow_html=True)
-            
-            # Opções de download
-            st.download_button(
-                label="⬇️ Baixar em PDF",
-                data=conteudo_livro.encode('utf-8'),
-                file_name=f"{st.session_state.tema_livro}.txt",
-                mime="text/plain",
-                help="Baixe o livro em formato de texto simples."
-            )
-            
-            # Botão para gerar um novo livro
-            if st.button("🔄 Gerar Outro Livro", type="secondary"):
-                st.session_state.livro_gerado = False
-                st.rerun()
-    
-    except Exception as e:
-        st.error(f"❌ Ocorreu um erro ao gerar o livro: {str(e)}")
-        st.error("Verifique sua conexão com a internet e tente novamente.")
+    """Envia o livro para a fila de geração; o acompanhamento fica com acompanhar_geracao."""
+    # A geração roda nos workers: fechar ou recarregar a página não interrompe nem duplica o livro
+    st.session_state.job_id = enviar_job_livro()
+    st.session_state.gerando_livro = True
+    st.rerun()
 
 def exibir_meus_livros():
     """Exibe a lista de livros gerados pelo usuário."""
@@ -978,7 +926,7 @@ def exibir_configuracoes():
 def novo_livro():
     """Limpa a sessão e inicia um novo livro."""
     st.session_state.livro_gerado = False
-    st.session_state.conteudo_livro = None
+    st.session_state.caminho_livro = None
     st.session_state.tema_livro = ""
     st.session_state.autor_livro = ""
     st.session_state.email_autor_livro = ""
@@ -1432,126 +1380,95 @@ def exibir_tela_assinatura():
 
 # === FUNÇÕES DE GERAÇÃO DE LIVROS ===
 
-def gerar_livro_generico(tema, autor, email_autor, genero, estilo, publico_alvo, descricao, formato, num_capitulos=12, api_key=None):
-    """
-    Gera um livro completo com base nos parâmetros fornecidos usando a API da OpenAI.
-    
-    Args:
-        tema: Tema principal do livro
-        autor: Nome do autor
-        email_autor: E-mail do autor
-        genero: Gênero literário
-        estilo: Estilo de escrita
-        publico_alvo: Público-alvo do livro
-        descricao: Descrição detalhada do livro
-        formato: Formato do livro (eBook, impresso, etc.)
-        num_capitulos: Número de capítulos a serem gerados (padrão: 12)
-        api_key: Chave da API da OpenAI
-    
-    Returns:
-        str: Conteúdo completo do livro formatado
-    """
-    # Inicializar cliente OpenAI com a chave fornecida
-    if api_key:
-        client = OpenAI(api_key=api_key)
+def enviar_job_livro():
+    """Envia o livro descrito na sessão para a fila de geração e retorna o id do job."""
+    garantir_workers_locais()
+    parametros = {
+        "tema": st.session_state.tema_livro,
+        "autor": st.session_state.autor_livro,
+        "email_autor": st.session_state.email_autor_livro,
+        "genero": st.session_state.genero_livro,
+        "estilo": st.session_state.estilo_livro,
+        "publico_alvo": st.session_state.publico_alvo_livro,
+        "descricao": st.session_state.descricao_livro,
+        "formato": st.session_state.formato_livro,
+        "num_capitulos": st.session_state.num_capitulos
+    }
+    return obter_fila().enfileirar(TIPO_OPENAI, parametros, usuario_id=st.session_state.usuario["id"],
+                                   api_key=st.session_state.get('api_key'))
+
+def acompanhar_geracao():
+    """Envia o job (se ainda não enviado) e exibe seu status até a conclusão."""
+    if not st.session_state.get('job_id'):
+        st.session_state.job_id = enviar_job_livro()
+
+    job = obter_fila().obter(st.session_state.job_id)
+    if job is None:
+        st.error("Job de geração não encontrado. Tente gerar o livro novamente.")
+        st.session_state.gerando_livro = False
+        st.session_state.job_id = None
+        return
+
+    if job["status"] == STATUS_CONCLUIDO:
+        # Salvar o conteúdo gerado na sessão (os dados do livro vêm do job, que pode ser de uma sessão anterior)
+        parametros = job["parametros"]
+        st.session_state.caminho_livro = job["resultado"]
+        st.session_state.tema_livro = parametros["tema"]
+        st.session_state.autor_livro = parametros["autor"]
+        st.session_state.formato_livro = parametros.get("formato", st.session_state.get('formato_livro', 'eBook Kindle'))
+        st.session_state.livro_gerado = True
+        st.session_state.gerando_livro = False
+        st.session_state.job_id = None
+
+        # Salvar cópia local
+        salvar_livro_local(job["resultado"], parametros["tema"])
+
+        # Rerun para exibir o resultado
+        st.rerun()
+    elif job["status"] == STATUS_ERRO:
+        st.error(f"Ocorreu um erro ao gerar o livro: {job['erro']}")
+        st.session_state.gerando_livro = False
+        st.session_state.job_id = None
+    elif job["status"] == STATUS_CANCELADO:
+        st.warning(f"Geração interrompida: {job['erro'] or 'cancelada'}. Os capítulos já prontos foram guardados; "
+                   "gere o mesmo livro de novo para continuar de onde parou.")
+        st.session_state.gerando_livro = False
+        st.session_state.job_id = None
     else:
-        raise ValueError("Chave da API da OpenAI não fornecida")
-    try:
-        # Inicializar variáveis
-        livro_completo = f"# {tema.upper()}\n\n"
-        livro_completo += f"**Autor:** {autor}\n"
-        livro_completo += f"**Gênero:** {genero}\n"
-        livro_completo += f"**Estilo:** {estilo}\n"
-        livro_completo += f"**Público-alvo:** {publico_alvo}\n\n"
-        
-        # Adicionar prefácio
-        livro_completo += "## Prefácio\n\n"
-        livro_completo += f"Este livro foi gerado automaticamente pelo Gerador de Livros AI. \n"
-        livro_completo += f"Tema: {tema}\n"
-        livro_completo += f"Autor: {autor} ({email_autor})\n\n"
-        
-        # Gerar índice
-        livro_completo += "## Índice\n\n"
-        capitulos = []
-        
-        # Gerar títulos dos capítulos
-        for i in range(1, num_capitulos + 1):
-            try:
-                # Usar a API da OpenAI para gerar títulos de capítulos criativos
-                response = client.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=[
-                        {"role": "system", "content": "Você é um escritor especializado em criar títulos de capítulos cativantes."},
-                        {"role": "user", "content": f"Gere um título criativo para o capítulo {i} de um livro sobre '{tema}'. O gênero é {genero} e o estilo é {estilo}. Apenas o título, sem numeração."}
-                    ],
-                    max_tokens=50,
-                    temperature=0.7
-                )
-                titulo_capitulo = response.choices[0].message.content.strip('"\'').strip()
-            except Exception as e:
-                st.error(f"Erro ao gerar título do capítulo {i}: {str(e)}")
-                titulo_capitulo = f"Capítulo {i}"
-            
-            capitulos.append(titulo_capitulo)
-            livro_completo += f"{i}. {titulo_capitulo}\n"
-        
-        livro_completo += "\n"
-        
-        # Gerar conteúdo para cada capítulo
-        for i, titulo in enumerate(capitulos, 1):
-            st.toast(f"Gerando capítulo {i}/{num_capitulos}: {titulo}")
-            
-            livro_completo += f"# Capítulo {i}: {titulo}\n\n"
-            
-            # Usar a API da OpenAI para gerar o conteúdo do capítulo
-            prompt = f"""
-            Escreva um capítulo de um livro com as seguintes características:
-            - Título: {titulo}
-            - Tema principal: {tema}
-            - Gênero: {genero}
-            - Estilo: {estilo}
-            - Público-alvo: {publico_alvo}
-            - Descrição: {descricao}
-            
-            O capítulo deve ter entre 500 e 800 palavras, ser bem estruturado e cativante.
-            """
-            
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "Você é um escritor profissional especializado em criar conteúdo literário cativante."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=2000,
-                temperature=0.8
-            )
-            
-            conteudo_capitulo = response.choices[0].message.content.strip()
-            livro_completo += f"{conteudo_capitulo}\n\n"
-            
-            # Adicionar uma pequena pausa para evitar sobrecarga da API
-            time.sleep(1)
-        
-        # Adicionar posfácio
-        livro_completo += "# Posfácio\n\n"
-        livro_completo += f"Chegamos ao final desta jornada sobre '{tema}'. Espero que tenha gostado da leitura. "
-        livro_completo += f"Este livro foi gerado automaticamente, mas cada palavra foi cuidadosamente elaborada para você.\n\n"
-        livro_completo += f"Atenciosamente,\n{autor}\n"
-        
-        # Adicionar informações de direitos autorais
-        ano_atual = datetime.now().year
-        livro_completo += f"\n---\n"
-        livro_completo += f"© {ano_atual} {autor}. Todos os direitos reservados.\n"
-        livro_completo += f"Este livro foi gerado pelo Gerador de Livros AI.\n"
-        
-        return livro_completo
-        
-    except Exception as e:
-        st.error(f"Erro ao gerar o livro: {str(e)}")
-        return f"Ocorreu um erro ao gerar o livro: {str(e)}"
+        # Acompanhar o job: status e texto dos capítulos em streaming, cada um no seu placeholder
+        status_placeholder = st.empty()
+        st.caption("Você pode fechar esta página: a geração continua em segundo plano.")
+        # O clique reinicia o script: o pedido vai para a fila e o worker interrompe o livro
+        if st.button("Cancelar", key=f"cancelar_{job['id']}"):
+            obter_fila().cancelar(job["id"])
+            st.rerun()
+        placeholders = {}
+        # (tamanho, concluído) de cada capítulo já desenhado: só o que mudou volta ao navegador, e os
+        # capítulos concluídos são desenhados uma única vez e deixam de ser lidos da fila
+        exibidos = {}
+        concluidos = set()
+        while job["status"] in (STATUS_PENDENTE, STATUS_EXECUTANDO):
+            if job["status"] == STATUS_PENDENTE:
+                status_placeholder.info(f"⏳ Livro na fila de geração ({obter_fila().posicao(job['id'])} à frente).")
+            else:
+                status_placeholder.info(f"✍️ Gerando seu livro... {job['mensagem']}")
+            for capitulo, (texto, concluido) in obter_fila().obter_trechos(job["id"], ignorar=concluidos).items():
+                if exibidos.get(capitulo) == (len(texto), concluido):
+                    continue
+                exibidos[capitulo] = (len(texto), concluido)
+                if concluido:
+                    concluidos.add(capitulo)
+                if capitulo not in placeholders:
+                    placeholders[capitulo] = st.empty()
+                with placeholders[capitulo].container():
+                    st.markdown(f"#### Capítulo {capitulo} {'✅' if concluido else '✍️'}")
+                    st.markdown(texto)
+            time.sleep(0.5)
+            job = obter_fila().obter(job["id"])
+        st.rerun()
 
-def salvar_livro_local(conteudo, tema, formato="txt"):
-    """Salva o livro localmente na pasta de livros gerados."""
+def salvar_livro_local(caminho_livro, tema, formato="txt"):
+    """Salva uma cópia do livro (copiada em blocos a partir do arquivo) na pasta de livros gerados."""
     try:
         # Criar pasta de backup se não existir
         backup_dir = "livros_gerados"
@@ -1564,14 +1481,40 @@ def salvar_livro_local(conteudo, tema, formato="txt"):
         caminho_arquivo = os.path.join(backup_dir, nome_arquivo)
         
         # Salvar arquivo
-        with open(caminho_arquivo, "w", encoding="utf-8") as f:
-            f.write(conteudo)
+        copiar_livro(caminho_livro, caminho_arquivo)
         
         return True, f"Arquivo salvo com sucesso em: {caminho_arquivo}"
     except Exception as e:
         return False, f"Erro ao salvar arquivo: {str(e)}"
 
-def exibir_resultado_livro(conteudo_livro, tema, autor, formato):
+def exibir_pagina_livro(caminho_livro, chave):
+    """Exibe uma página do livro por vez, lida do arquivo sob demanda."""
+    paginas = total_paginas(caminho_livro)
+    pagina = 1
+    if paginas > 1:
+        pagina = st.number_input(f"Página (de {paginas})", min_value=1, max_value=paginas, value=1, step=1,
+                                 key=f"pagina_livro_{chave}")
+    st.markdown(f"<div class='book-content'>{ler_pagina(caminho_livro, pagina - 1)}</div>", unsafe_allow_html=True)
+
+def botao_download(caminho_livro, chave, rotulo, nome_arquivo, mime, **opcoes):
+    """
+    Botão de download do livro, montado só depois de o usuário pedir o download.
+
+    O `st.download_button` lê o arquivo inteiro para a memória a cada execução do
+    script; com o botão "Preparar" na frente, o livro só é carregado na sessão de
+    quem vai de fato baixá-lo, e não em toda atualização da página.
+    """
+    chave_pronto = f"download_pronto_{chave}_{caminho_livro}"
+    if not st.session_state.get(chave_pronto):
+        if st.button(f"{rotulo} (preparar download)", key=f"preparar_{chave}", **opcoes):
+            st.session_state[chave_pronto] = True
+            st.rerun()
+        return
+    with open(caminho_livro, 'rb') as arquivo_livro:
+        st.download_button(label=rotulo, data=arquivo_livro.read(), file_name=nome_arquivo, mime=mime,
+                           key=f"baixar_{chave}", **opcoes)
+
+def exibir_resultado_livro(caminho_livro, tema, autor, formato):
     """Exibe o resultado do livro gerado com opções de download."""
     st.success(f"Livro sobre '{tema}' gerado com sucesso!")
     
@@ -1579,8 +1522,8 @@ def exibir_resultado_livro(conteudo_livro, tema, autor, formato):
     tab1, tab2 = st.tabs(["Visualizar Livro", "Informações de Publicação KDP"])
     
     with tab1:
-        # Exibir o conteúdo do livro com formatação adequada
-        st.markdown(f"<div class='book-content'>{conteudo_livro}</div>", unsafe_allow_html=True)
+        # Exibir o conteúdo do livro com formatação adequada, uma página por vez
+        exibir_pagina_livro(caminho_livro, chave="resultado")
     
     with tab2:
         st.markdown("### Instruções para Publicação na Amazon KDP")
@@ -1613,27 +1556,16 @@ def exibir_resultado_livro(conteudo_livro, tema, autor, formato):
     # Opção para baixar o livro como arquivo de texto
     col1, col2 = st.columns(2)
     with col1:
-        st.download_button(
-            label="Baixar como TXT",
-            data=conteudo_livro,
-            file_name=txt_filename,
-            mime="text/plain",
-            use_container_width=True
-        )
+        botao_download(caminho_livro, "txt", "Baixar como TXT", txt_filename, "text/plain", use_container_width=True)
     
     with col2:
         # Opção para baixar como Markdown
-        st.download_button(
-            label="Baixar como Markdown",
-            data=conteudo_livro,
-            file_name=md_filename,
-            mime="text/markdown",
-            use_container_width=True
-        )
+        botao_download(caminho_livro, "md", "Baixar como Markdown", md_filename, "text/markdown",
+                       use_container_width=True)
     
     # Botão para salvar cópia local
     if st.button("💾 Salvar cópia local (backup)", key="backup_button"):
-        success, message = salvar_livro_local(conteudo_livro, tema)
+        success, message = salvar_livro_local(caminho_livro, tema)
         if success:
             st.success(message)
         else:
@@ -2264,6 +2196,20 @@ def handle_checkout_session_completed(session):
         return {'statusCode': 500, 'body': 'Erro ao processar assinatura'}
 
 class WebhookHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            # Métricas das chamadas aos modelos (gravadas pelos workers) no formato do Prometheus
+            corpo = obter_metricas().exportar_prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+        else:
+            self.send_response(404)
+            self.end_headers()
+            self.wfile.write(b'Not Found')
+
     def do_POST(self):
         if self.path == '/webhook':
             content_length = int(self.headers['Content-Length'])
@@ -2306,8 +2252,8 @@ def main():
     if 'livro_gerado' not in st.session_state:
         st.session_state.livro_gerado = False
     
-    if 'conteudo_livro' not in st.session_state:
-        st.session_state.conteudo_livro = None
+    if 'caminho_livro' not in st.session_state:
+        st.session_state.caminho_livro = None
     
     # Carregar estilos CSS
     carregar_estilos()
@@ -2357,47 +2303,28 @@ def main():
             st.rerun()
             return
         
+        # Retomar um livro interrompido escolhido antes do login
+        if not st.session_state.get('gerando_livro'):
+            retomar_livro_interrompido()
+
+        # Retomar o acompanhamento de um livro ainda em geração (ex.: após a sessão cair)
+        if not st.session_state.get('gerando_livro') and not st.session_state.get('livro_gerado'):
+            job_ativo = obter_fila().job_ativo_do_usuario(st.session_state.usuario["id"])
+            if job_ativo:
+                st.session_state.job_id = job_ativo["id"]
+                st.session_state.gerando_livro = True
+
         # Exibir conteúdo do app baseado no estado
-        if st.session_state.get('livro_gerado') and st.session_state.conteudo_livro:
+        if st.session_state.get('livro_gerado') and st.session_state.caminho_livro:
             exibir_resultado_livro(
-                st.session_state.conteudo_livro,
+                st.session_state.caminho_livro,
                 st.session_state.tema_livro,
                 st.session_state.autor_livro,
                 st.session_state.formato_livro
             )
         elif st.session_state.get('gerando_livro', False):
-            # Lógica para gerar o livro
-            with st.spinner("Gerando seu livro. Isso pode levar alguns minutos..."):
-                try:
-                    # Chamar a função de geração do livro
-                    conteudo_livro = gerar_livro_generico(
-                        tema=st.session_state.tema_livro,
-                        autor=st.session_state.autor_livro,
-                        email_autor=st.session_state.email_autor_livro,
-                        genero=st.session_state.genero_livro,
-                        estilo=st.session_state.estilo_livro,
-                        publico_alvo=st.session_state.publico_alvo_livro,
-                        descricao=st.session_state.descricao_livro,
-                        formato=st.session_state.formato_livro,
-                        num_capitulos=st.session_state.num_capitulos,
-                        api_key=st.session_state.get('api_key')
-                    )
-                    
-                    # Salvar o conteúdo gerado na sessão
-                    st.session_state.conteudo_livro = conteudo_livro
-                    st.session_state.livro_gerado = True
-                    st.session_state.gerando_livro = False
-                    
-                    # Salvar cópia local
-                    salvar_livro_local(conteudo_livro, st.session_state.tema_livro)
-                    
-                    # Rerun para exibir o resultado
-                    st.rerun()
-                    
-                except Exception as e:
-                    st.error(f"Ocorreu um erro ao gerar o livro: {str(e)}")
-                    st.session_state.gerando_livro = False
-                    st.rerun()
+            # A geração roda nos workers; a interface só envia o job e acompanha o status
+            acompanhar_geracao()
         else:
             # Exibir o formulário de criação de livro
             pagina_principal()
@@ -0,0 +1,145 @@
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import threading
+import subprocess
+import multiprocessing
+
+from dotenv import load_dotenv
+
+from job_queue import FilaLivros, CAMINHO_FILA
+from cancelamento import Cancelamento, LivroCancelado
+
+# Número de processos worker por nó
+WORKERS_POR_NO = int(os.getenv("WORKERS_POR_NO", "2"))
+INTERVALO_CONSULTA = float(os.getenv("JOB_INTERVALO_CONSULTA", "2"))
+INTERVALO_SINAL_DE_VIDA = 30
+# Intervalo entre as consultas de pedido de cancelamento do job em execução
+INTERVALO_CANCELAMENTO = float(os.getenv("JOB_INTERVALO_CANCELAMENTO", "2"))
+# Intervalo mínimo entre gravações do texto parcial de um capítulo
+INTERVALO_TRECHOS = float(os.getenv("JOB_INTERVALO_TRECHOS", "0.5"))
+
+TIPO_OPENAI = "openai"
+TIPO_CREWAI = "crewai"
+
+
+def executar_job(fila, job, cancelamento=None):
+    """Executa a geração do livro descrita no job e retorna o conteúdo gerado."""
+    parametros = dict(job["parametros"])
+    # A chave do usuário fica fora dos parâmetros; sem ela, vale a OPENAI_API_KEY do ambiente do worker
+    parametros["api_key"] = fila.obter_api_key(job["id"]) or os.getenv("OPENAI_API_KEY")
+
+    def callback(etapa, mensagem):
+        fila.atualizar_progresso(job["id"], etapa, mensagem)
+
+    # Texto de cada capítulo montado a partir do streaming, gravado na fila em intervalos curtos
+    partes = {}
+    ultima_gravacao = {}
+
+    def ao_receber_trecho(capitulo, delta, fim=False):
+        # delta None: o capítulo vai ser pedido de novo e o texto parcial recebido é descartado
+        if delta is None:
+            partes[capitulo] = []
+            return
+        partes.setdefault(capitulo, []).append(delta)
+        agora = time.monotonic()
+        if fim or agora - ultima_gravacao.get(capitulo, 0) >= INTERVALO_TRECHOS:
+            fila.salvar_trecho(job["id"], capitulo, "".join(partes[capitulo]), fim)
+            ultima_gravacao[capitulo] = agora
+
+    if job["tipo"] == TIPO_OPENAI:
+        from async_engine import gerar_livro_generico_async
+        return asyncio.run(gerar_livro_generico_async(callback=callback, ao_receber_trecho=ao_receber_trecho,
+                                                      cancelamento=cancelamento, **parametros))
+    if job["tipo"] == TIPO_CREWAI:
+        from app import gerar_livro_generico
+        return gerar_livro_generico(callback=callback, cancelamento=cancelamento, **parametros)
+    raise ValueError(f"Tipo de job desconhecido: {job['tipo']}")
+
+
+def loop_worker(worker_id, caminho_fila=CAMINHO_FILA):
+    """Reserva e executa jobs da fila indefinidamente."""
+    load_dotenv()
+    fila = FilaLivros(caminho_fila)
+    print(f"Worker {worker_id} aguardando jobs em {caminho_fila}")
+    while True:
+        fila.recuperar_orfaos()
+        job = fila.reservar(worker_id)
+        if job is None:
+            time.sleep(INTERVALO_CONSULTA)
+            continue
+
+        print(f"Worker {worker_id} iniciando job {job['id']} ({job['tipo']})")
+        # Sinal de vida periódico enquanto uma chamada longa estiver em andamento, e repasse do
+        # pedido de cancelamento feito pela interface
+        parar = threading.Event()
+        cancelamento = Cancelamento()
+
+        def manter_vivo():
+            ultimo_sinal = time.monotonic()
+            while not parar.wait(INTERVALO_CANCELAMENTO):
+                if fila.cancelamento_pedido(job["id"]):
+                    cancelamento.cancelar()
+                if time.monotonic() - ultimo_sinal >= INTERVALO_SINAL_DE_VIDA:
+                    fila.sinal_de_vida(job["id"])
+                    ultimo_sinal = time.monotonic()
+
+        threading.Thread(target=manter_vivo, daemon=True).start()
+        try:
+            resultado = executar_job(fila, job, cancelamento)
+            fila.concluir(job["id"], resultado)
+            print(f"Worker {worker_id} concluiu job {job['id']}")
+        except LivroCancelado as e:
+            print(f"Worker {worker_id} interrompeu job {job['id']}: {str(e)}")
+            fila.registrar_cancelamento(job["id"], str(e))
+        except Exception as e:
+            print(f"Worker {worker_id} falhou no job {job['id']}: {str(e)}")
+            fila.falhar(job["id"], str(e))
+        finally:
+            parar.set()
+
+
+def iniciar_workers(num_workers=WORKERS_POR_NO, caminho_fila=CAMINHO_FILA):
+    """Inicia o pool de processos worker deste nó e aguarda todos terminarem."""
+    processos = []
+    for i in range(num_workers):
+        worker_id = f"{socket.gethostname()}-{os.getpid()}-{i}"
+        processo = multiprocessing.Process(target=loop_worker, args=(worker_id, caminho_fila), daemon=True)
+        processo.start()
+        processos.append(processo)
+    for processo in processos:
+        processo.join()
+
+
+# Pool local iniciado pela interface (um por processo do servidor)
+_processo_local = None
+_processo_local_lock = threading.Lock()
+
+
+def garantir_workers_locais(num_workers=WORKERS_POR_NO):
+    """
+    Inicia, uma única vez por processo, um pool de workers em segundo plano.
+
+    Usado pela interface Streamlit quando nenhum worker externo foi configurado
+    (WORKERS_POR_NO=0 desativa e deixa o processamento para `python worker.py`).
+    """
+    global _processo_local
+    if num_workers <= 0:
+        return None
+    with _processo_local_lock:
+        if _processo_local is None or _processo_local.poll() is not None:
+            _processo_local = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "--workers", str(num_workers)]
+            )
+        return _processo_local
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pool de workers para geração de livros em segundo plano.")
+    parser.add_argument("--workers", type=int, default=WORKERS_POR_NO, help="Número de processos worker neste nó")
+    parser.add_argument("--fila", default=CAMINHO_FILA, help="Caminho do banco SQLite da fila de jobs")
+    args = parser.parse_args()
+    iniciar_workers(args.workers, args.fila)